@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""Benchmark Civet's asset discovery, staleness checks and compile throughput.
+
+Generates a synthetic project with the given number of CoffeeScript, Sass and
+ES6 sources in a temporary staticfiles layout, and uses stub `coffee`, `sass`
+and `babel` executables that just copy their input, so that Civet's own
+overhead is what gets measured. Each step is timed separately:
+
+* collect_files: discovering all sources (with and without the directory
+  listing cache)
+* cold compile: compiling everything from scratch with the stub compilers
+* no-op rebuild: precompiling again when everything is up to date
+* watch latency: time from modifying a source to its output being rewritten
+
+Results are printed as JSON, so that they can be tracked over time:
+
+    python benchmarks/run_benchmarks.py --files 2000 --output results.json
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STUB_COFFEE = """#!/bin/sh
+# coffee -o <dst_dir> [options] <src>...
+dst_dir=$2
+shift 2
+mkdir -p "$dst_dir"
+for arg in "$@"; do
+    case "$arg" in
+        -*) ;;
+        *) cp "$arg" "$dst_dir/$(basename "$arg" .coffee).js" ;;
+    esac
+done
+"""
+
+STUB_BABEL = """#!/bin/sh
+# babel --source-maps true -o <dst> <src>
+[ "$1" = "--version" ] && echo stub && exit 0
+cp "$5" "$4"
+"""
+
+STUB_SASS = """#!/bin/sh
+# sass [options] <src> <dst>
+[ "$1" = "--version" ] && echo stub && exit 0
+for arg in "$@"; do src=$dst; dst=$arg; done
+cp "$src" "$dst"
+"""
+
+FILES_PER_DIR = 50
+
+
+def write_executable(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+
+def generate_tree(root, count):
+    """Create count sources of each kind under root/static, spread over
+    directories of FILES_PER_DIR files, plus one Sass partial per directory.
+    """
+    static_dir = os.path.join(root, 'static')
+    for kind, ext, template in (
+            ('coffee', '.coffee', 'square{0} = (x) -> x * x\n'),
+            ('es6', '.es6', 'export const square{0} = (x) => x * x;\n'),
+            ('sass', '.scss', '@import "shared";\n.c{0} {{ width: $w; }}\n')):
+        for i in range(count):
+            directory = os.path.join(
+                static_dir, kind, 'd{0}'.format(i // FILES_PER_DIR))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+                if kind == 'sass':
+                    with open(os.path.join(directory, '_shared.scss'),
+                              'w') as f:
+                        f.write('$w: 10px;\n')
+            with open(os.path.join(directory, 'f{0}{1}'.format(i, ext)),
+                      'w') as f:
+                f.write(template.format(i))
+    return static_dir
+
+
+def configure_django(root, static_dir, workers):
+    bin_dir = os.path.join(root, 'bin')
+    os.makedirs(bin_dir)
+    for name, content in (('coffee', STUB_COFFEE), ('babel', STUB_BABEL),
+                          ('sass', STUB_SASS)):
+        write_executable(os.path.join(bin_dir, name), content)
+
+    from django.conf import settings
+    settings.configure(
+        DEBUG=True,
+        SECRET_KEY='benchmark',
+        INSTALLED_APPS=['django.contrib.staticfiles'],
+        STATIC_URL='/static/',
+        STATICFILES_DIRS=(static_dir,),
+        CIVET_PRECOMPILED_ASSET_DIR=os.path.join(root, 'precompiled'),
+        CIVET_COFFEE_BIN=os.path.join(bin_dir, 'coffee'),
+        CIVET_BABEL_BIN=os.path.join(bin_dir, 'babel'),
+        CIVET_SASS_BIN=os.path.join(bin_dir, 'sass'),
+        CIVET_ES6_EXTENSION='.es6',
+        CIVET_MAX_WORKERS=workers,
+    )
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def measure_watch_latency(src_path, dst_path, samples, timeout=10.0):
+    """Modify src_path samples times and return how long each took to show
+    up in dst_path.
+    """
+    latencies = []
+    for i in range(samples):
+        start = time.time()
+        with open(src_path, 'a') as f:
+            f.write('# edit {0}\n'.format(i))
+        while True:
+            try:
+                if os.path.getmtime(dst_path) >= start:
+                    break
+            except OSError:
+                pass
+            if time.time() - start > timeout:
+                raise RuntimeError(
+                    'Timed out waiting for {0} to be compiled'.format(
+                        src_path))
+            time.sleep(0.001)
+        latencies.append(time.time() - start)
+        # Let the debounce window and any duplicate events pass
+        time.sleep(0.3)
+    return latencies
+
+
+def run(args):
+    root = tempfile.mkdtemp(prefix='civet-benchmark-')
+    try:
+        static_dir = generate_tree(root, args.files)
+        configure_django(root, static_dir, args.workers)
+
+        sys.path.insert(0, REPO_ROOT)
+        from civet import asset_precompiler
+        from civet.compilers.base_compiler import CompilerObserver
+        from civet.discovery import DirectoryListingCache
+        from civet.pool import get_max_workers
+
+        compilers = [
+            compiler_class(asset_precompiler.precompiled_assets_dir, False)
+            for compiler_class in asset_precompiler.compiler_classes]
+        os.makedirs(asset_precompiler.precompiled_assets_dir)
+
+        results = {
+            'files_per_compiler': args.files,
+            'workers': args.workers or get_max_workers(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        }
+
+        seconds, files = timed(asset_precompiler.collect_files, compilers)
+        results['collect_files_seconds'] = seconds
+        results['collected_files'] = sum(len(f) for f in files.values())
+
+        listing_cache = DirectoryListingCache(
+            asset_precompiler.precompiled_assets_dir)
+        asset_precompiler.collect_files(compilers, listing_cache)
+        results['collect_files_cached_seconds'], _ = timed(
+            asset_precompiler.collect_files, compilers, listing_cache)
+
+        seconds, stats = timed(asset_precompiler.precompile_assets)
+        results['cold_compile_seconds'] = seconds
+        results['cold_compile_files_per_second'] = (
+            stats.total(stats.COMPILED) / seconds)
+
+        results['noop_rebuild_seconds'], _ = timed(
+            asset_precompiler.precompile_assets)
+
+        if args.latency_samples:
+            asset_precompiler.precompile_assets(watch=True)
+            src_path = os.path.join(static_dir, 'coffee', 'd0', 'f0.coffee')
+            dst_path = os.path.join(
+                asset_precompiler.precompiled_assets_dir, 'coffee', 'd0',
+                'f0.js')
+            latencies = measure_watch_latency(
+                src_path, dst_path, args.latency_samples)
+            for thread in threading.enumerate():
+                if isinstance(thread, CompilerObserver):
+                    thread.stop()
+                    thread.compile_queue.stop()
+            results['watch_latency_seconds'] = {
+                'median': median(latencies),
+                'max': max(latencies),
+                'samples': len(latencies),
+            }
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--files', type=int, default=1000,
+        help='Number of sources of each kind to generate (default: 1000)')
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='CIVET_MAX_WORKERS to use (default: number of CPUs)')
+    parser.add_argument(
+        '--latency-samples', type=int, default=10,
+        help='Number of watcher round trips to time, 0 to skip (default: 10)')
+    parser.add_argument(
+        '--output', default=None,
+        help='Also write the results to this file')
+    args = parser.parse_args()
+
+    # Civet's progress output goes to stderr, so stdout only has the results
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        results = run(args)
+    finally:
+        sys.stdout = stdout
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
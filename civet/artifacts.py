@@ -0,0 +1,220 @@
+from __future__ import print_function
+import hashlib
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import zipfile
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django.utils.six.moves.urllib.error import HTTPError
+from django.utils.six.moves.urllib.request import Request
+from django.utils.six.moves.urllib.request import urlopen
+
+from civet.util import write_file_atomically
+
+
+# The cache to fetch compiled outputs from instead of compiling them, in the
+# style of Django's CACHES, eg
+#
+#     {
+#         'BACKEND': 'civet.artifacts.HTTPArtifactCache',
+#         'LOCATION': 'https://cache.example.com/civet/',
+#         'OPTIONS': {'HEADERS': {'Authorization': 'Bearer ...'}},
+#         'READ_ONLY': True,
+#     }
+artifact_cache_setting = getattr(
+    settings, 'CIVET_ARTIFACT_CACHE', None)
+
+# Bump this when the layout of artifacts or their keys changes
+ARTIFACT_VERSION = 1
+
+
+def hash_file(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_portable_path(path):
+    """Return path the same way on every machine: relative to the current
+    directory (the project, when running manage.py) if it is inside it, or
+    else by its name only.
+    """
+    if not os.path.isabs(path):
+        return path
+    relative_path = os.path.relpath(path)
+    if relative_path.startswith(os.pardir):
+        return os.path.basename(path)
+    return relative_path.replace(os.sep, '/')
+
+
+def get_artifact_key(compiler, src_path, dst_path):
+    """Return the key of the artifact compiling src_path to dst_path.
+
+    The key is a hash of the content of the source and the files it depends
+    on, of the compiler's identity and arguments, and of the output's name,
+    none of which depend on where the project is checked out.
+    """
+    sha = hashlib.sha1()
+    sha.update(json.dumps([
+        ARTIFACT_VERSION,
+        compiler.get_artifact_identity(),
+        os.path.relpath(
+            dst_path, compiler.precompiled_assets_dir).replace(os.sep, '/'),
+        hash_file(src_path),
+        # A deleted dependency makes the compile fail, see BuildCache
+        sorted(hash_file(path) if os.path.exists(path) else ''
+               for path in compiler.get_dependencies(src_path)),
+    ]).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def pack_outputs(paths):
+    """Return a zip archive of the files at paths that exist, by name."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for path in paths:
+            if os.path.exists(path):
+                archive.write(path, os.path.basename(path))
+    return buf.getvalue()
+
+
+def unpack_outputs(data, dst_dir):
+    """Extract the files of an archive made by pack_outputs() into dst_dir.
+    """
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for name in archive.namelist():
+            # Only plain names are ever packed
+            if os.path.basename(name) != name:
+                raise zipfile.BadZipfile('unexpected name {0}'.format(name))
+            with open(os.path.join(dst_dir, name), 'wb') as f:
+                f.write(archive.read(name))
+
+
+class ArtifactCache(object):
+    """Stores the compiled outputs of sources by artifact key (see
+    get_artifact_key()), to be shared between machines.
+
+    Subclasses implement load() and store(). Errors talking to the cache are
+    reported once, after which the cache is not used for the rest of the run,
+    so that an unreachable cache costs at most one timeout.
+    """
+
+    def __init__(self, location, options=None, read_only=False):
+        self.location = location
+        self.options = options or {}
+        self.read_only = read_only
+        self.available = True
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        """Return the artifact stored under key, or None."""
+        raise NotImplementedError("Subclasses must implement load()")
+
+    def store(self, key, data):
+        """Store the artifact data under key."""
+        raise NotImplementedError("Subclasses must implement store()")
+
+    def disable(self, err):
+        with self._lock:
+            if not self.available:
+                return
+            self.available = False
+        print('Warning: not using the artifact cache {0} for the rest of '
+              'this run: {1}'.format(self.location, err), file=sys.stderr)
+
+    def get(self, key):
+        if not self.available:
+            return None
+        try:
+            return self.load(key)
+        except (IOError, OSError, socket.error) as err:
+            self.disable(err)
+            return None
+
+    def set(self, key, data):
+        if self.read_only or not self.available:
+            return
+        try:
+            self.store(key, data)
+        except (IOError, OSError, socket.error) as err:
+            self.disable(err)
+
+
+class LocalArtifactCache(ArtifactCache):
+    """Artifacts in a directory, eg on a shared volume or restored by CI."""
+
+    def get_path(self, key):
+        return os.path.join(self.location, key[:2], key + '.zip')
+
+    def load(self, key):
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def store(self, key, data):
+        write_file_atomically(self.get_path(key), data, 'wb')
+
+
+class HTTPArtifactCache(ArtifactCache):
+    """Artifacts fetched with GET and stored with PUT at LOCATION + key, as
+    served by S3 (through a bucket policy or a proxy), WebDAV or any plain
+    HTTP store.
+
+    OPTIONS may give HEADERS to send with every request (eg for
+    authentication) and a TIMEOUT in seconds (5 by default).
+    """
+
+    def get_url(self, key):
+        return self.location.rstrip('/') + '/' + key + '.zip'
+
+    def request(self, method, key, data=None):
+        request = Request(self.get_url(key), data=data)
+        request.get_method = lambda: method
+        for name, value in self.options.get('HEADERS', {}).items():
+            request.add_header(name, value)
+        if data is not None:
+            request.add_header('Content-Type', 'application/zip')
+        return urlopen(request, timeout=self.options.get('TIMEOUT', 5))
+
+    def load(self, key):
+        try:
+            response = self.request('GET', key)
+        except HTTPError as err:
+            if err.code == 404:
+                return None
+            raise
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+    def store(self, key, data):
+        self.request('PUT', key, data).close()
+
+
+_artifact_cache = None
+_artifact_cache_lock = threading.Lock()
+
+
+def get_artifact_cache():
+    """Return the ArtifactCache of settings.CIVET_ARTIFACT_CACHE, or None."""
+    global _artifact_cache
+    if not artifact_cache_setting:
+        return None
+    with _artifact_cache_lock:
+        if _artifact_cache is None:
+            cache_class = import_string(artifact_cache_setting['BACKEND'])
+            _artifact_cache = cache_class(
+                artifact_cache_setting['LOCATION'],
+                artifact_cache_setting.get('OPTIONS'),
+                artifact_cache_setting.get('READ_ONLY', False))
+        return _artifact_cache
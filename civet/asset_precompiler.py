@@ -1,17 +1,35 @@
 from __future__ import print_function
 from collections import defaultdict
+from distutils.spawn import find_executable
 import os
-import subprocess
 import sys
 
 from django.conf import settings
 from django.contrib.staticfiles import finders
 
+from civet import sourcemaps
+from civet.artifacts import get_artifact_cache
+from civet.build_cache import BuildCache
+from civet.bundles import BundleBuilder
+from civet.bundles import load_bundles
 from civet.compilers.base_compiler import CompilerObserver
 from civet.compilers.coffeescript import CoffeescriptCompiler
 from civet.compilers.es6 import ES6Compiler
 from civet.compilers.sass import SassCompiler
+from civet.diagnostics import get_error_log
+from civet.discovery import DirectoryListingCache
+from civet.discovery import is_ignored_dir
+from civet.discovery import walk_storage
+from civet.manifest import AssetManifest
+from civet.polling import PollingCompilerObserver
+from civet.pool import CompilePool
+from civet.pool import report_errors
+from civet.readiness import registry as readiness
+from civet.stats import CompileStats
+from civet.util import is_same_path
+from civet.util import mkdir_p
 from civet.util import raise_error_or_kill
+from civet.util import remove_file
 
 
 try:
@@ -33,6 +51,66 @@ additional_ignore_patterns = getattr(
 ignore_dirs = getattr(
     settings, 'CIVET_IGNORE_DIRS', [])
 
+# Whether to keep a content-hash index of compiled outputs, so that sources
+# whose content has not changed are not recompiled when their mtime changes.
+use_build_cache = getattr(
+    settings, 'CIVET_BUILD_CACHE', True)
+
+# Whether to save directory listings between runs, so that unchanged
+# directories do not have to be listed again.
+use_listing_cache = getattr(
+    settings, 'CIVET_DISCOVERY_CACHE', False)
+
+# Whether to compile CoffeeScript and ES6 with long-lived Node worker processes
+# instead of starting `coffee` or `babel` for every file.
+use_persistent_workers = getattr(
+    settings, 'CIVET_PERSISTENT_WORKERS', False)
+
+# Whether to write a copy of every compiled file with a hash of its content in
+# its name, and a staticfiles.json manifest of them in the format of Django's
+# ManifestStaticFilesStorage.
+use_hashed_filenames = getattr(
+    settings, 'CIVET_HASHED_FILENAMES', False)
+
+# Whether to delete compiled files in CIVET_PRECOMPILED_ASSET_DIR whose sources
+# no longer exist when starting. Off by default, since every output file no
+# current source compiles to is deleted, including files put there by hand or
+# by other tools.
+remove_orphaned_outputs = getattr(
+    settings, 'CIVET_REMOVE_ORPHANED_OUTPUTS', False)
+
+# Extensions of the files considered compiled outputs
+output_extensions = ('.js', '.css', '.map')
+
+# Whether runserver starts watching right away and compiles in the background,
+# most recently modified sources first, instead of watching only once
+# everything is compiled.
+background_precompile = getattr(
+    settings, 'CIVET_BACKGROUND_PRECOMPILE', False)
+
+# Whether assets are compiled when they are first requested, by
+# civet.finders.LazyCompileFinder, instead of all at once when runserver
+# starts.
+lazy_compile = getattr(
+    settings, 'CIVET_LAZY_COMPILE', False)
+
+# How the watcher learns about changes: 'native' uses the file system's events
+# (through watchdog, which falls back to polling everything every second where
+# there are none), 'polling' polls the sources found at startup at adaptive
+# intervals (see civet.polling), for Docker bind mounts and network file
+# systems.
+watcher = getattr(
+    settings, 'CIVET_WATCHER', 'native')
+
+# Location of `node`, used to run persistent workers.
+node_bin = getattr(
+    settings, 'CIVET_NODE_BIN', 'node')
+
+# If given, a per-file report of compile times is written to this path at the
+# end of precompile_assets(), as CSV if it ends with .csv or else as JSON.
+profile_report_path = getattr(
+    settings, 'CIVET_PROFILE_REPORT', None)
+
 compiler_classes = getattr(
     settings, 'CIVET_COMPILER_CLASSES', [
         CoffeescriptCompiler,
@@ -42,14 +120,34 @@ compiler_classes = getattr(
 
 
 def precompile_and_watch_assets():
+    if lazy_compile:
+        print('Compiling assets when they are requested')
+        return
     thread.start_new_thread(
         precompile_assets, (), {
             'watch': True,
-            'kill_on_error': True
+            'kill_on_error': True,
+            'background': background_precompile,
         })
 
 
-def precompile_assets(watch=False, kill_on_error=False):
+def add_precompiled_assets_dir(create=True):
+    """Create precompiled_assets_dir if needed (and create is True) and add it
+    to settings.STATICFILES_DIRS, so that staticfiles serves compiled assets.
+    """
+    if create and not os.path.exists(precompiled_assets_dir):
+        print('Directory created for saving precompiled assets: %s' % (
+            precompiled_assets_dir))
+        # The sidecar and the server may both get here
+        mkdir_p(precompiled_assets_dir)
+
+    if precompiled_assets_dir not in settings.STATICFILES_DIRS:
+        settings.STATICFILES_DIRS += (precompiled_assets_dir,)
+
+
+def precompile_assets(watch=False, kill_on_error=False, classes=None,
+                      max_workers=None, force=False, dry_run=False,
+                      report_path=None, background=False):
     """Precompile and watch assets for all configured Compilers.
 
     This function has the side effect of adding precompiled_assets_dir to
@@ -63,42 +161,254 @@ def precompile_assets(watch=False, kill_on_error=False):
             calling `sys.exit()`. If you call this method from the Django
             `runserver` management command, you need to use this so that you
             can correctly stop the command's loader thread.
+        classes: The Compiler classes to use instead of
+            settings.CIVET_COMPILER_CLASSES.
+        max_workers: The number of files to compile at the same time instead
+            of settings.CIVET_MAX_WORKERS.
+        force: If True, recompile files even if they are up to date.
+        dry_run: If True, only print which files would be compiled.
+        report_path: Where to write a per-file report of compile times
+            instead of settings.CIVET_PROFILE_REPORT.
+        background: If True (and watch is True), start watching as soon as
+            the sources are found, compile the most recently modified
+            sources first, and keep watching even if some files fail to
+            compile.
+
+    Returns:
+        A civet.stats.CompileStats with what happened to each file.
     """
-    if not os.path.exists(precompiled_assets_dir):
-        print('Directory created for saving precompiled assets: %s' % (
-            precompiled_assets_dir))
-        os.makedirs(precompiled_assets_dir)
+    # A dry run writes nothing
+    add_precompiled_assets_dir(create=not dry_run)
+
+    build_cache = None
+    if use_build_cache:
+        build_cache = BuildCache(precompiled_assets_dir)
+    compilers = create_compilers(classes, kill_on_error, build_cache)
+    stats = CompileStats()
+    for compiler in compilers:
+        compiler.stats = stats
+        compiler.force = force
+        compiler.dry_run = dry_run
+        compiler.prioritize_recent = background
+
+    if use_hashed_filenames:
+        manifest = AssetManifest(precompiled_assets_dir)
+        for compiler in compilers:
+            compiler.manifest = manifest
 
-    if precompiled_assets_dir not in settings.STATICFILES_DIRS:
-        settings.STATICFILES_DIRS += (precompiled_assets_dir,)
+    listing_cache = None
+    if use_listing_cache:
+        listing_cache = DirectoryListingCache(precompiled_assets_dir)
 
     if watch:
-        observer = CompilerObserver()
+        observer = create_observer(listing_cache)
+
+    # Compile jobs of all compilers share one bounded pool, so that e.g. babel
+    # and sass processes can run at the same time.
+    print('Start precompiling assets')
+    pool = CompilePool(max_workers)
+
+    # Compilers that handle files one by one start compiling while discovery
+    # is still running, the others get all their files at the end. In the
+    # background, everything waits for discovery, so that the watcher can
+    # start and the compile order can be chosen.
+    background = watch and background
+    src_dest_tuples_by_compiler = defaultdict(list)
+    for compiler, src, dst in iter_files(compilers, listing_cache):
+        src_dest_tuples_by_compiler[compiler].append((src, dst))
+        # Requests for the output wait until the compiler is done with it.
+        # The pool stands for this run as the owner of the mark.
+        readiness.begin(dst, owner=pool)
+        if compiler.supports_streaming and not background:
+            compiler.submit_all([(src, dst)], pool)
+    if listing_cache is not None and not dry_run:
+        listing_cache.save()
+    if background:
+        start_watching(compilers, src_dest_tuples_by_compiler, observer)
+    for compiler in compilers:
+        if ((background or not compiler.supports_streaming)
+                and src_dest_tuples_by_compiler[compiler]):
+            compiler.submit_all(src_dest_tuples_by_compiler[compiler], pool)
+
+    errors = pool.shutdown()
+    sourcemaps.pipeline.wait()
+    # Outputs that were not reported on, eg of Sass partials, but not those
+    # the watcher is about to recompile
+    readiness.end_owned(pool)
+    # Only when every compiler ran, or the outputs of the others would be
+    # mistaken for orphans
+    bundles = load_bundles(precompiled_assets_dir)
+    if remove_orphaned_outputs and classes is None:
+        sweep_orphaned_outputs(
+            src_dest_tuples_by_compiler, dry_run,
+            [bundle.path for bundle in bundles])
+    if build_cache is not None and not dry_run:
+        build_cache.evict_stale()
+        build_cache.save()
+    if not dry_run:
+        get_error_log().evict_stale()
+    if use_hashed_filenames and not dry_run:
+        manifest.update(
+            dst for src_dest_tuples in src_dest_tuples_by_compiler.values()
+            for src, dst in src_dest_tuples)
+        manifest.evict_stale()
+        manifest.save()
+    # Only when every compiler ran, or the members compiled by the others
+    # would be left out
+    if bundles and classes is None and not dry_run:
+        bundle_builder = BundleBuilder(
+            precompiled_assets_dir, bundles,
+            manifest if use_hashed_filenames else None)
+        bundle_builder.add_outputs(
+            dst for src_dest_tuples in src_dest_tuples_by_compiler.values()
+            for src, dst in src_dest_tuples)
+        if watch:
+            bundle_builder.watch()
+        bundle_builder.build_all()
+    report_path = report_path or profile_report_path
+    if report_path:
+        stats.write_report(report_path)
+        print('Wrote compile report to {0}'.format(report_path))
+    if errors:
+        report_errors(errors)
+        if background:
+            # The server is up and the watcher recompiles fixed files
+            print('Incomplete asset precompilation.', file=sys.stderr)
+        else:
+            print(
+                'Incomplete asset precompilation{0}.'.format(
+                    ', server not started' if kill_on_error else ''),
+                file=sys.stderr)
+            raise_error_or_kill(kill_on_error)
+    print('End precompiling assets')
+
+    if watch and not background:
+        for compiler in compilers:
+            # Changes seen by the watcher are compiled as usual
+            compiler.force = False
+        start_watching(compilers, src_dest_tuples_by_compiler, observer)
+
+    return stats
+
+
+def create_compilers(classes=None, kill_on_error=False, build_cache=None):
+    """Create the compilers, which also checks that their executables exist,
+    and start their persistent workers if enabled.
 
-    # Create compilers, also checks if executables exist.
+    Args:
+        classes: The Compiler classes to use instead of
+            settings.CIVET_COMPILER_CLASSES.
+        kill_on_error: See precompile_assets().
+        build_cache: The civet.build_cache.BuildCache for the compilers to
+            share, if any.
+    """
     compilers = []
-    for compiler_class in compiler_classes:
-        compilers.append(compiler_class(precompiled_assets_dir, kill_on_error))
+    artifact_cache = get_artifact_cache()
+    for compiler_class in classes or compiler_classes:
+        compiler = compiler_class(precompiled_assets_dir, kill_on_error)
+        compiler.build_cache = build_cache
+        compiler.artifact_cache = artifact_cache
+        compilers.append(compiler)
+
+    if use_persistent_workers:
+        node_executable = find_executable(node_bin)
+        if node_executable:
+            for compiler in compilers:
+                compiler.start_worker(node_executable)
+        else:
+            print(
+                'Warning: persistent workers are enabled, but "{0}" is not '
+                'found.'.format(node_bin), file=sys.stderr)
+    return compilers
+
+
+def create_observer(listing_cache=None):
+    """Return the observer of settings.CIVET_WATCHER.
 
-    src_dest_tuples_by_compiler = collect_files(compilers)
+    Args:
+        listing_cache: The civet.discovery.DirectoryListingCache the polling
+            observer lists directories with when it starts, if any.
+    """
+    if watcher == 'polling':
+        return PollingCompilerObserver(
+            get_ignore_patterns(), ignore_dirs, [precompiled_assets_dir],
+            listing_cache)
+    if watcher != 'native':
+        raise AssertionError(
+            "CIVET_WATCHER must be 'native' or 'polling', not {0!r}".format(
+                watcher))
+    return CompilerObserver(
+        get_ignore_patterns(), ignore_dirs, [precompiled_assets_dir])
+
+
+def get_source_roots(finder_list=None):
+    """Return the directories of the static files storages of finder_list (by
+    default, of all finders), in the order they are searched, except the
+    precompiled asset directory.
+    """
+    if finder_list is None:
+        finder_list = finders.get_finders()
+    roots = []
+    for finder in finder_list:
+        for storage in getattr(finder, 'storages', {}).values():
+            root = getattr(storage, 'location', None)
+            if (not root or root in roots or
+                    is_same_path(root, precompiled_assets_dir)):
+                continue
+            roots.append(root)
+    return roots
+
+
+def start_watching(compilers, src_dest_tuples_by_compiler, observer):
+    """Watch the sources found for each compiler, and the static files
+    directories for new ones, and start the observer.
+    """
+    roots = [os.path.realpath(root) for root in get_source_roots()]
+    for compiler in compilers:
+        compiler.watch(src_dest_tuples_by_compiler[compiler], observer, roots)
+    observer.start()
 
-    try:
-        for compiler in compilers:
-            if src_dest_tuples_by_compiler[compiler]:
-                compiler.compile_all(src_dest_tuples_by_compiler[compiler])
-    except subprocess.CalledProcessError:
-        print(
-            'Incomplete asset precompilation, server not started.',
-            file=sys.stderr)
-        raise_error_or_kill(kill_on_error)
 
-    if watch:
-        for compiler in compilers:
-            compiler.watch(src_dest_tuples_by_compiler[compiler], observer)
-        observer.start()
+def sweep_orphaned_outputs(src_dest_tuples_by_compiler, dry_run=False,
+                           kept_paths=()):
+    """Delete compiled files that no current source compiles to.
 
+    Every file in precompiled_assets_dir with one of output_extensions is
+    kept if its name, after removing one or more extensions, is the name of
+    a current output (or of one of kept_paths, eg bundles) without its
+    extension. That covers the outputs, their sourcemaps (eg foo.map or
+    foo.js.map) and their hashed copies (eg foo.5f1a8c3b9e02.js).
 
-def collect_files(compilers):
+    Returns:
+        The number of files deleted (or that would be deleted in a dry run).
+    """
+    stems = set(os.path.splitext(path)[0] for path in kept_paths)
+    for src_dest_tuples in src_dest_tuples_by_compiler.values():
+        for src, dst in src_dest_tuples:
+            stems.add(os.path.splitext(dst)[0])
+
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(precompiled_assets_dir):
+        # Skip temporary directories of compiles in progress
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            if os.path.splitext(filename)[1] not in output_extensions:
+                continue
+            path = os.path.join(dirpath, filename)
+            stem = os.path.splitext(path)[0]
+            while stem not in stems and os.path.splitext(stem)[1]:
+                stem = os.path.splitext(stem)[0]
+            if stem in stems:
+                continue
+            removed += 1
+            if dry_run:
+                print('Would remove orphaned output {0}'.format(path))
+            elif remove_file(path):
+                print('Removed orphaned output {0}'.format(path))
+    return removed
+
+
+def collect_files(compilers, listing_cache=None):
     """Collect files for given compilers across the project.
 
     Given list of compilers to collect files for, returns a dictionary mapping
@@ -106,7 +416,14 @@ def collect_files(compilers):
 
     This is a mini implementation of the "collectstatic" management command.
     """
+    output = defaultdict(list)
+    for compiler, src_path, dst_path in iter_files(compilers, listing_cache):
+        output[compiler].append((src_path, dst_path))
+    return output
+
 
+def get_ignore_patterns():
+    """Return the patterns of file and directory names to skip."""
     # This common ignore pattern is defined inline in
     # django.contrib.staticfiles.management.commands.collectstatic, and we
     # just repeat it here verbatim
@@ -114,8 +431,38 @@ def collect_files(compilers):
 
     if additional_ignore_patterns:
         ignore_patterns.extend(additional_ignore_patterns)
+    return ignore_patterns
 
-    output = defaultdict(list)
+
+def get_compiler_index(compilers):
+    """Return a dict mapping file extensions to the compilers that may handle
+    them, and a list of compilers that have to be asked about every file.
+    """
+    index = defaultdict(list)
+    unindexed = []
+    for compiler in compilers:
+        if compiler.extensions is None:
+            unindexed.append(compiler)
+        else:
+            for ext in compiler.extensions:
+                index[ext].append(compiler)
+    return index, unindexed
+
+
+def iter_files(compilers, listing_cache=None):
+    """Yield (compiler, src_path, dest_path) for files across the project.
+
+    Files are yielded as they are found, so that compiling can start while
+    the rest of the project is still being searched.
+
+    Args:
+        compilers: The compilers to find source files for.
+        listing_cache: An optional civet.discovery.DirectoryListingCache to
+            read directory listings from.
+    """
+
+    ignore_patterns = get_ignore_patterns()
+    index, unindexed = get_compiler_index(compilers)
 
     # staticfiles has two default finders, one for the STATICFILES_DIRS and
     # one for the /static directories of the apps listed in INSTALLED_APPS.
@@ -123,18 +470,36 @@ def collect_files(compilers):
     # the entire project, including the libraries it uses.
 
     for finder in finders.get_finders():
-        for partial_path, storage in finder.list(ignore_patterns):
-            # Get the actual path of the asset
-            full_path = storage.path(partial_path)
-
-            # Resolve symbolic links
-            src_path = os.path.realpath(full_path)
-
+        storages = getattr(finder, 'storages', None)
+        if storages is None:
+            # A custom finder we can only ask for the list of its files
+            files = (
+                (partial_path, storage.path(partial_path))
+                for partial_path, storage in finder.list(ignore_patterns)
+                if not is_ignored_dir(storage.path(partial_path), ignore_dirs))
+        else:
+            files = (
+                item
+                for storage in storages.values()
+                # Our own output is never a source
+                if not is_same_path(storage.location, precompiled_assets_dir)
+                for item in walk_storage(
+                    storage.location, ignore_patterns, ignore_dirs,
+                    listing_cache))
+
+        real_dirs = {}
+        for partial_path, full_path in files:
             base, ext = os.path.splitext(partial_path)
-
-            if not any(dirs in full_path for dirs in ignore_dirs):
-                for compiler in compilers:
-                    if compiler.matches(base, ext):
-                        output[compiler].append(
-                            (src_path, compiler.get_dest_path(base, ext)))
-    return output
+            for compiler in index.get(ext, []) + unindexed:
+                if not compiler.matches(base, ext):
+                    continue
+                # Resolve symbolic links, once per directory unless the file
+                # itself is a link
+                if os.path.islink(full_path):
+                    src_path = os.path.realpath(full_path)
+                else:
+                    full_dir, filename = os.path.split(full_path)
+                    if full_dir not in real_dirs:
+                        real_dirs[full_dir] = os.path.realpath(full_dir)
+                    src_path = os.path.join(real_dirs[full_dir], filename)
+                yield compiler, src_path, compiler.get_dest_path(base, ext)
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+
+from civet.util import JSONFile
+
+
+# Bump this when the layout of the index changes, so that old indexes are
+# discarded instead of misread.
+INDEX_VERSION = 1
+
+INDEX_FILENAME = '.civet-cache.json'
+
+
+class BuildCache(JSONFile):
+    """A persistent index of compiled outputs keyed by source content.
+
+    Each entry maps a destination path to the source it was compiled from, a
+    hash of the content of the source and the files it depends on, and a hash
+    of the compiler's identity (name, executable, version and arguments). An
+    output stays valid for as long as both hashes are unchanged, no matter
+    what happens to file modification times.
+
+    The mtime and size of each file are kept alongside the hashes, so that
+    sources that have not been touched can be checked without reading and
+    hashing them.
+
+    The index lives in CIVET_PRECOMPILED_ASSET_DIR, which means it is cached
+    and restored together with the outputs it describes.
+    """
+
+    description = 'build cache'
+
+    def __init__(self, precompiled_assets_dir):
+        super(BuildCache, self).__init__(
+            os.path.join(precompiled_assets_dir, INDEX_FILENAME))
+        self._identities = {}
+        self._hashes = {}
+        self._entries = self._load()
+        self._dirty = False
+
+    def _load(self):
+        data = self.load()
+        if not data or data.get('version') != INDEX_VERSION:
+            return {}
+        return data.get('entries', {})
+
+    def get_data(self):
+        if not self._dirty:
+            return None
+        self._dirty = False
+        return {
+            'version': INDEX_VERSION,
+            'entries': self._entries,
+        }
+
+    def _get_identity(self, compiler):
+        with self._lock:
+            identity = self._identities.get(compiler)
+        if identity is None:
+            identity = hashlib.sha1(json.dumps(
+                compiler.get_cache_identity()).encode('utf-8')).hexdigest()
+            with self._lock:
+                self._identities[compiler] = identity
+        return identity
+
+    def _hash_file(self, path, st):
+        cache_key = (path, st.st_mtime, st.st_size)
+        with self._lock:
+            digest = self._hashes.get(cache_key)
+        if digest is None:
+            sha = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            with self._lock:
+                self._hashes[cache_key] = digest
+        return digest
+
+    def _get_files(self, compiler, src_path):
+        return [src_path] + sorted(compiler.get_dependencies(src_path))
+
+    def get_signature(self, compiler, src_path):
+        """Return the entry that compiling src_path now would produce.
+
+        Take the signature before compiling, so that a source edited while its
+        compiler is running is not recorded as up to date.
+        """
+        sha = hashlib.sha1()
+        files = {}
+        for path in self._get_files(compiler, src_path):
+            sha.update(path.encode('utf-8'))
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Deleted (eg a partial whose importers still refer to it),
+                # which is for the compiler to report. The entry stays stale
+                # until the file is back.
+                files[path] = None
+                continue
+            files[path] = [st.st_mtime, st.st_size]
+            sha.update(self._hash_file(path, st).encode('ascii'))
+        return {
+            'src': src_path,
+            'compiler': self._get_identity(compiler),
+            'digest': sha.hexdigest(),
+            'files': files,
+        }
+
+    def is_fresh(self, compiler, src_path, dst_path):
+        """Return whether dst_path is up to date with src_path.
+
+        Returns:
+            True or False if the index knows about dst_path, or None if it
+            does not, in which case the caller has to decide by other means.
+        """
+        with self._lock:
+            entry = self._entries.get(dst_path)
+        if entry is None or entry['src'] != src_path:
+            return None
+        if entry['compiler'] != self._get_identity(compiler):
+            return False
+        if not os.path.exists(dst_path):
+            return False
+        try:
+            files = self._get_files(compiler, src_path)
+            if sorted(entry['files']) == sorted(files) and all(
+                    entry['files'][path] == [st.st_mtime, st.st_size]
+                    for path, st in ((p, os.stat(p)) for p in files)):
+                # Untouched since the entry was recorded
+                return True
+            signature = self.get_signature(compiler, src_path)
+        except OSError:
+            return False
+        if signature['digest'] != entry['digest']:
+            return False
+        # Same content with new mtimes (e.g. after a checkout); remember the
+        # new mtimes so the next check does not need to hash the files again.
+        self.record(dst_path, signature)
+        return True
+
+    def record(self, dst_path, signature):
+        """Record that dst_path was compiled with the given signature."""
+        with self._lock:
+            self._entries[dst_path] = signature
+            self._dirty = True
+
+    def discard(self, dst_path):
+        """Forget about dst_path."""
+        with self._lock:
+            if self._entries.pop(dst_path, None) is not None:
+                self._dirty = True
+
+    def evict_stale(self):
+        """Remove entries whose source or output no longer exists.
+
+        Returns:
+            The number of entries removed.
+        """
+        with self._lock:
+            stale = [
+                dst for dst, entry in self._entries.items()
+                if not (os.path.exists(dst) and os.path.exists(entry['src']))]
+            for dst in stale:
+                del self._entries[dst]
+            if stale:
+                self._dirty = True
+            self._hashes.clear()
+        return len(stale)
+
+    def clear(self):
+        """Remove all entries, forcing everything to be recompiled."""
+        with self._lock:
+            self._entries = {}
+            self._hashes.clear()
+            self._dirty = True
@@ -0,0 +1,258 @@
+from __future__ import print_function
+from fnmatch import fnmatch
+import io
+import json
+import os
+import posixpath
+import re
+import sys
+import threading
+
+from django.conf import settings
+
+from civet.compile_queue import CompileQueue
+from civet.readiness import registry as readiness
+from civet.signals import asset_compiled
+from civet.stats import CompileStats
+from civet.util import write_file_atomically
+
+
+# Bundles to concatenate compiled files into, as a dict from the bundle's name
+# (its path relative to CIVET_PRECOMPILED_ASSET_DIR, eg 'js/app.js') to a list
+# of fnmatch patterns of compiled files (eg ['js/lib/*.js', 'js/*.js']).
+# Patterns match the paths of the outputs, not of the sources: 'coffee/*.js',
+# not 'coffee/*.coffee'.
+bundle_settings = getattr(
+    settings, 'CIVET_BUNDLES', {})
+
+# A sourceMappingURL comment on a line of its own, in JavaScript or CSS, and
+# the line break after it
+SOURCE_MAPPING_URL_RE = re.compile(
+    r'^[ \t]*(?://[#@]|/\*[#@])[ \t]*sourceMappingURL=(\S+?)'
+    r'(?:[ \t]*\*/)?[ \t]*$\n?', re.MULTILINE)
+
+ABSOLUTE_URL_RE = re.compile(r'^(?:[a-zA-Z][a-zA-Z0-9+.-]*:|/)')
+
+
+class Bundle(object):
+    """A file concatenating the compiled files whose names (relative to
+    CIVET_PRECOMPILED_ASSET_DIR) match any of patterns, with an index
+    sourcemap next to it.
+
+    Members are in the order of the first pattern they match, and by name
+    among the members matching the same pattern.
+    """
+
+    def __init__(self, name, patterns, precompiled_assets_dir):
+        self.name = name
+        self.patterns = list(patterns)
+        self.path = os.path.join(precompiled_assets_dir, *name.split('/'))
+        self.map_path = self.path + '.map'
+
+    def get_index(self, name):
+        """Return the index of the first pattern name matches, or None."""
+        for index, pattern in enumerate(self.patterns):
+            if fnmatch(name, pattern):
+                return index
+        return None
+
+    def get_source_mapping_comment(self):
+        url = os.path.basename(self.map_path)
+        if self.path.endswith('.css'):
+            return '/*# sourceMappingURL={0} */\n'.format(url)
+        return '//# sourceMappingURL={0}\n'.format(url)
+
+
+def load_bundles(precompiled_assets_dir):
+    """Return the Bundles of settings.CIVET_BUNDLES."""
+    return [Bundle(name, patterns, precompiled_assets_dir)
+            for name, patterns in sorted(bundle_settings.items())]
+
+
+def relocate_sourcemap(map_data, map_dir, bundle_dir):
+    """Return a copy of map_data whose sources are relative to bundle_dir
+    instead of map_dir, the directory of the sourcemap it was read from.
+    """
+    prefix = os.path.relpath(map_dir, bundle_dir).replace(os.sep, '/')
+    source_root = map_data.get('sourceRoot') or ''
+    sources = []
+    for source in map_data.get('sources', []):
+        if not ABSOLUTE_URL_RE.match(source):
+            if source_root:
+                source = posixpath.join(source_root, source)
+            if not ABSOLUTE_URL_RE.match(source):
+                source = posixpath.normpath(posixpath.join(prefix, source))
+        sources.append(source)
+    relocated = dict(map_data, sources=sources, sourceRoot='')
+    relocated.pop('file', None)
+    return relocated
+
+
+class BundleBuilder(object):
+    """Builds Bundles from the compiled files Civet knows about.
+
+    The content and sourcemap of each member are kept in memory until the
+    member changes, so rebuilding a bundle after one member was recompiled
+    only reads that member again. While watching, a bundle is rebuilt
+    shortly after any of its members was recompiled.
+    """
+
+    def __init__(self, precompiled_assets_dir, bundles, manifest=None):
+        self.root = precompiled_assets_dir
+        self.bundles = bundles
+        self.manifest = manifest
+        self._lock = threading.Lock()
+        self._outputs = set()
+        # Member path -> (key, map path, text, line count, map)
+        self._members = {}
+        self._queue = None
+
+    def add_outputs(self, dst_paths):
+        """Let members be chosen from dst_paths."""
+        with self._lock:
+            self._outputs.update(os.path.normpath(path) for path in dst_paths)
+
+    def get_name(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def get_members(self, bundle):
+        """Return the paths of the existing members of bundle, in order."""
+        with self._lock:
+            outputs = list(self._outputs)
+        members = []
+        for path in outputs:
+            index = bundle.get_index(self.get_name(path))
+            if index is not None and os.path.exists(path):
+                members.append((index, self.get_name(path), path))
+        return [path for _, _, path in sorted(members)]
+
+    def get_unmatched_patterns(self, bundle):
+        """Return the patterns of bundle that match none of the outputs."""
+        with self._lock:
+            names = [self.get_name(path) for path in self._outputs]
+        return [pattern for pattern in bundle.patterns
+                if not any(fnmatch(name, pattern) for name in names)]
+
+    def get_map_path(self, path, text):
+        urls = SOURCE_MAPPING_URL_RE.findall(text)
+        if urls and not urls[-1].startswith('data:'):
+            return os.path.join(
+                os.path.dirname(path), *urls[-1].split('/'))
+        return path + '.map'
+
+    def get_key(self, path, map_path):
+        """Return what tells whether a member has changed since it was read.
+        """
+        try:
+            map_mtime = os.path.getmtime(map_path)
+        except OSError:
+            map_mtime = None
+        return os.path.getmtime(path), map_mtime
+
+    def read_member(self, path):
+        """Return the text of the compiled file at path without its
+        sourceMappingURL comment, its number of lines, and its sourcemap
+        with sources relative to the root (or None).
+        """
+        cached = self._members.get(path)
+        if cached is not None:
+            map_path = cached[1]
+            # The sourcemap may still be rewritten (see civet.sourcemaps)
+            readiness.wait(map_path)
+            if cached[0] == self.get_key(path, map_path):
+                return cached[2:]
+
+        with io.open(path, encoding='utf-8') as f:
+            text = f.read()
+        map_path = self.get_map_path(path, text)
+        readiness.wait(map_path)
+        key = self.get_key(path, map_path)
+        text = SOURCE_MAPPING_URL_RE.sub('', text)
+        if not text.endswith('\n'):
+            text += '\n'
+        map_data = None
+        if key[1] is not None:
+            try:
+                with open(map_path) as f:
+                    map_data = json.load(f)
+            except ValueError as err:
+                print('Warning: ignoring unreadable sourcemap {0}: {1}'.format(
+                    map_path, err), file=sys.stderr)
+            if map_data is not None and 'sections' in map_data:
+                # Index maps cannot be nested
+                map_data = None
+            if map_data is not None:
+                map_data = relocate_sourcemap(
+                    map_data, os.path.dirname(map_path), self.root)
+        member = (text, text.count('\n'), map_data)
+        self._members[path] = (key, map_path) + member
+        return member
+
+    def build(self, bundle):
+        """Write bundle and its index sourcemap."""
+        try:
+            members = self.get_members(bundle)
+            bundle_dir = os.path.dirname(bundle.path)
+            parts = []
+            sections = []
+            line = 0
+            for path in members:
+                text, line_count, map_data = self.read_member(path)
+                if map_data is not None:
+                    # Member maps are relocated to the root in read_member()
+                    sections.append({
+                        'offset': {'line': line, 'column': 0},
+                        'map': relocate_sourcemap(
+                            map_data, self.root, bundle_dir),
+                    })
+                parts.append(text)
+                line += line_count
+            parts.append(bundle.get_source_mapping_comment())
+            index_map = {
+                'version': 3,
+                'file': os.path.basename(bundle.path),
+                'sections': sections,
+            }
+            write_file_atomically(
+                bundle.path, ''.join(parts).encode('utf-8'), 'wb')
+            write_file_atomically(bundle.map_path, json.dumps(index_map))
+            if self.manifest is not None:
+                self.manifest.add(bundle.path)
+                self.manifest.save()
+            print('Built bundle {0} from {1} files'.format(
+                bundle.name, len(members)))
+        finally:
+            readiness.end(bundle.path)
+            readiness.end(bundle.map_path)
+
+    def build_all(self):
+        for bundle in self.bundles:
+            readiness.begin(bundle.path)
+            readiness.begin(bundle.map_path)
+        for bundle in self.bundles:
+            for pattern in self.get_unmatched_patterns(bundle):
+                print('Warning: pattern {0} of bundle {1} matches no compiled '
+                      'file (patterns match outputs, eg coffee/*.js, not '
+                      'sources)'.format(pattern, bundle.name), file=sys.stderr)
+            self.build(bundle)
+
+    def schedule(self, bundle):
+        """Rebuild bundle soon, once for several members compiled at once."""
+        readiness.begin(bundle.path)
+        readiness.begin(bundle.map_path)
+        self._queue.put(('bundle', bundle.name), self.build, bundle)
+
+    def on_asset_compiled(self, sender, compiler, dst_path, outcome,
+                          **kwargs):
+        if outcome != CompileStats.COMPILED or not dst_path:
+            return
+        self.add_outputs([dst_path])
+        name = self.get_name(dst_path)
+        for bundle in self.bundles:
+            if bundle.get_index(name) is not None:
+                self.schedule(bundle)
+
+    def watch(self):
+        """Rebuild bundles when their members are recompiled."""
+        self._queue = CompileQueue(max_workers=1)
+        asset_compiled.connect(self.on_asset_compiled, weak=False)
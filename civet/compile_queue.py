@@ -0,0 +1,166 @@
+from __future__ import print_function
+import os
+import sys
+import threading
+import time
+import traceback
+
+from django.conf import settings
+
+from civet.pool import get_max_workers
+from civet.scheduler import CompileCancelled
+from civet.scheduler import scheduler
+
+
+# Seconds to wait after the last event for a file before compiling it. Editors
+# that save through temporary files and renames fire several events per save;
+# they all end up in one compile.
+debounce_seconds = getattr(
+    settings, 'CIVET_WATCH_DEBOUNCE', 0.1)
+
+
+class QueuedJob(object):
+    """A job waiting in a CompileQueue."""
+
+    def __init__(self, deadline, func, args, group=None, output=None):
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.group = group
+        self.output = output
+        self.requested = False
+
+    def get_order(self):
+        # Requested outputs first, then the most recently changed files
+        return not self.requested, -self.deadline
+
+
+class CompileQueue(object):
+    """A debouncing, deduplicating queue of watcher compile jobs.
+
+    Jobs are identified by a key (eg the source path). Putting a job whose key
+    is already pending replaces it and restarts its debounce timer, so a burst
+    of events for one file results in exactly one compile. A job is never run
+    while another job with the same key is running; it waits for its turn
+    instead. A running job compiling the same output is cancelled (see
+    civet.scheduler), since it compiles a version of the file that is
+    already out of date.
+
+    Jobs are run by a fixed number of worker threads, so a flood of events
+    (eg from a `git pull`) is compiled in parallel instead of one by one on
+    the watchdog observer thread. Of the jobs that are due, those whose
+    output is requested run first, then those put last, as the files changed
+    last are the ones most likely to be looked at next. Jobs of a compiler at
+    its limit (see civet.scheduler.compiler_max_workers) wait for one of its
+    jobs to finish.
+    """
+
+    def __init__(self, debounce=None, max_workers=None):
+        self.debounce = debounce_seconds if debounce is None else debounce
+        self._pending = {}
+        self._running = set()
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._threads = []
+        scheduler.add_listener(self)
+        for _ in range(max_workers or get_max_workers()):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, key, func, *args, **kwargs):
+        """Run func(*args) once no job for key has been put for a while.
+
+        Keyword Args:
+            group: The executable name of the compiler running the job, whose
+                limit it counts against, if any.
+            output: The path the job compiles to. Jobs still compiling it (on
+                this queue or elsewhere, eg on the pool of the initial
+                compile) are cancelled, and the job runs first when the output
+                is requested.
+        """
+        group = kwargs.pop('group', None)
+        output = kwargs.pop('output', None)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: {0}'.format(
+                ', '.join(sorted(kwargs))))
+        if output is not None:
+            output = os.path.normpath(output)
+        job = QueuedJob(time.time() + self.debounce, func, args, group, output)
+        with self._condition:
+            previous = self._pending.get(key)
+            job.requested = previous is not None and previous.requested
+            self._pending[key] = job
+            self._condition.notify()
+        if output is not None:
+            scheduler.cancel(output)
+
+    def wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def promote(self, path):
+        with self._condition:
+            for job in self._pending.values():
+                if job.output == path:
+                    job.requested = True
+            self._condition.notify_all()
+
+    def _next_job(self):
+        # Must be called with the condition held. Returns the key of the due
+        # job to run next, or the time to wait for one (None to wait until
+        # woken up).
+        now = time.time()
+        due = []
+        timeout = None
+        for key, job in self._pending.items():
+            if key in self._running:
+                continue
+            if job.deadline > now:
+                remaining = job.deadline - now
+                if timeout is None or remaining < timeout:
+                    timeout = remaining
+                continue
+            due.append((job.get_order(), key))
+        # Keys may not be comparable, so only orders are
+        for _, key in sorted(due, key=lambda item: item[0]):
+            if scheduler.acquire(self._pending[key].group):
+                return key, None
+        return None, timeout
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    key, timeout = self._next_job()
+                    if key is not None:
+                        break
+                    self._condition.wait(timeout)
+                job = self._pending.pop(key)
+                self._running.add(key)
+            try:
+                outputs = [job.output] if job.output is not None else []
+                with scheduler.running(outputs):
+                    job.func(*job.args)
+            except CompileCancelled:
+                # The job put since runs next
+                pass
+            except Exception:
+                print('Error running compile job for {0}:'.format(key),
+                      file=sys.stderr)
+                traceback.print_exc()
+            finally:
+                scheduler.release(job.group)
+                with self._condition:
+                    self._running.discard(key)
+                    self._condition.notify_all()
+
+    def stop(self):
+        """Stop the workers. Pending jobs are dropped."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        scheduler.remove_listener(self)
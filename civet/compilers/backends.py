@@ -0,0 +1,55 @@
+class BackendUnavailable(Exception):
+    """Raised when the library an in-process backend needs is not installed.
+    """
+
+
+class BackendCompileError(Exception):
+    """Raised by InProcessBackend.compile_source() when the source has an
+    error. The message is what the compiler reported.
+    """
+
+
+class InProcessBackend(object):
+    """Compiles sources inside the Python process.
+
+    A compiler selects a backend with its backend_setting (see Compiler). The
+    source is read once and handed to compile_source(), and the output and
+    sourcemap it returns are written by the compiler, so no process is started
+    and no intermediate files are written per compile.
+
+    Subclasses import their library in __init__() and raise
+    BackendUnavailable if it is missing, in which case the compiler falls back
+    to running its executable.
+    """
+
+    def __init__(self, compiler):
+        self.compiler = compiler
+
+    @property
+    def name(self):
+        """Name of the backend, as used in settings (eg "libsass")."""
+        raise NotImplementedError("Subclasses must implement name.")
+
+    def get_version(self):
+        """Return the version string of the library doing the compiling."""
+        raise NotImplementedError("Subclasses must implement get_version()")
+
+    def compile_source(self, source, src_path, dst_path):
+        """Compile the source text read from src_path.
+
+        Args:
+            source: The content of src_path, as text.
+            src_path: The path of the source, eg to resolve imports.
+            dst_path: The path the output will be written to.
+
+        Returns:
+            A (output, sourcemap) tuple. output is the compiled text, and
+            sourcemap is the JSON text or dict of its sourcemap, or None if
+            there is none. The output must already refer to the sourcemap,
+            which is written to compiler.get_map_path(dst_path).
+
+        Raises:
+            BackendCompileError: If the source fails to compile.
+        """
+        raise NotImplementedError(
+            "Subclasses must implement compile_source()")
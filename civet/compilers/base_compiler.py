@@ -1,16 +1,124 @@
 from __future__ import print_function
 import atexit
 from distutils.spawn import find_executable
+import io
+import json
 import os
 import subprocess
 import sys
+import time
+import zipfile
 
 from django.conf import settings
+from django.contrib.staticfiles.utils import matches_patterns
+from django.utils import six
+from watchdog.events import FileCreatedEvent
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
+from civet import sourcemaps
+from civet.artifacts import get_artifact_key
+from civet.artifacts import get_portable_path
+from civet.artifacts import pack_outputs
+from civet.artifacts import unpack_outputs
+from civet.compile_queue import CompileQueue
+from civet.compilers.backends import BackendCompileError
+from civet.compilers.backends import BackendUnavailable
+from civet.compilers.node_worker import NodeWorker
+from civet.compilers.node_worker import NodeWorkerUnavailable
+from civet.discovery import is_ignored_dir
+from civet.discovery import listdir
+from civet.pool import CompilePool
+from civet.pool import report_errors
+from civet.probe_cache import probe
+from civet.readiness import registry as readiness
+from civet.scheduler import CompileCancelled
+from civet.scheduler import get_cancellation
+from civet.signals import asset_compiled
+from civet.stats import CompileStats
 from civet.util import collect_src_dst_dir_mappings
+from civet.util import get_shortest_topmost_directories
+from civet.util import indent_messages
+from civet.util import mkdir_p
+from civet.util import move_files
+from civet.util import PathTrie
 from civet.util import raise_error_or_kill
+from civet.util import remove_file
+from civet.util import run_process
+from civet.util import temporary_sibling_directory
+from civet.util import write_file_atomically
+
+
+class RoutingEventHandler(FileSystemEventHandler):
+    """Route events from recursive watches to the compilers' event handlers.
+
+    Each compiler's handler is registered for the source directories it
+    found files in. An event is passed to every handler registered for the
+    directory it happened in or any of its ancestors, so files in directories
+    created after startup reach the right compiler too. Events in ignored
+    directories are dropped.
+    """
+
+    def __init__(self, ignore_patterns=(), ignore_dirs=(), excluded_dirs=()):
+        super(RoutingEventHandler, self).__init__()
+        self.routes = PathTrie()
+        self.ignore_patterns = list(ignore_patterns)
+        self.ignore_dirs = list(ignore_dirs)
+        # Directories never containing sources, eg the compilers' output
+        self.excluded_dirs = [os.path.join(d, '') for d in excluded_dirs]
+
+    def add_route(self, src_dir, handler):
+        handlers = self.routes.get(src_dir)
+        if handlers is None:
+            handlers = []
+            self.routes[src_dir] = handlers
+        if handler not in handlers:
+            handlers.append(handler)
+
+    def get_roots(self):
+        """Return the topmost directories that need to be watched."""
+        return get_shortest_topmost_directories(list(self.routes.keys()))
+
+    def is_ignored(self, path):
+        if any(path.startswith(d) for d in self.excluded_dirs):
+            return True
+        if is_ignored_dir(path, self.ignore_dirs):
+            return True
+        # Ignore patterns apply to the path below the topmost watched root
+        root, _ = next(self.routes.iter_ancestors(path), (None, None))
+        if root is None:
+            return True
+        relative_path = os.path.relpath(path, root)
+        return any(matches_patterns(part, self.ignore_patterns)
+                   for part in relative_path.split(os.sep))
+
+    def is_ignored_directory(self, path):
+        if os.path.join(path, '') in self.excluded_dirs:
+            return True
+        return self.is_ignored(path)
+
+    def get_handlers(self, path):
+        handlers = []
+        for _, route_handlers in self.routes.iter_ancestors(
+                os.path.dirname(path)):
+            for handler in route_handlers:
+                if handler not in handlers:
+                    handlers.append(handler)
+        return handlers
+
+    def dispatch(self, event):
+        paths = [event.src_path]
+        if hasattr(event, 'dest_path'):
+            paths.append(event.dest_path)
+        handlers = []
+        for path in paths:
+            if self.is_ignored(path):
+                continue
+            for handler in self.get_handlers(path):
+                if handler not in handlers:
+                    handlers.append(handler)
+        for handler in handlers:
+            handler.dispatch(event)
 
 
 class CompilerObserver(Observer):
@@ -28,36 +136,150 @@ class CompilerObserver(Observer):
        asking all our devs to remember to dial up the limit manually, but then
        again 1. makes it hard to work with. For details, see
        https://github.com/joyent/node/issues/2479
+
+    Compilers add routes for their source directories with add_route().
+    When started, the observer sets up one recursive watch per topmost
+    directory, shared by all compilers, and a RoutingEventHandler passes
+    each event on to the compilers it concerns.
+
+    A recursive watch covers every directory below it, and ignored ones
+    like node_modules can hold more than the OS lets us watch. So directories
+    with ignored subdirectories, and their ancestors, are watched on their
+    own, and only their other subdirectories recursively (see plan_watches).
     """
 
+    def __init__(self, ignore_patterns=(), ignore_dirs=(), excluded_dirs=(),
+                 *args, **kwargs):
+        super(CompilerObserver, self).__init__(*args, **kwargs)
+        # Event handlers hand their compile jobs to this queue, so that
+        # bursts of events are coalesced and compiled off the observer thread
+        self.compile_queue = CompileQueue()
+        self.router = RoutingEventHandler(
+            ignore_patterns, ignore_dirs, excluded_dirs)
+        self.split_dir_handler = SplitDirectoryEventHandler(self)
+
+    def add_route(self, src_dir, handler):
+        """Pass events in src_dir and its subdirectories on to handler."""
+        self.router.add_route(src_dir, handler)
+
+    def plan_watches(self, root):
+        """Return (directory, recursive) for the watches covering root and
+        everything below it that is not ignored.
+        """
+        # Directories with ignored subdirectories, and their ancestors
+        split_dirs = set()
+        for dirpath, dirnames, _ in os.walk(root):
+            kept = [name for name in dirnames
+                    if not self.router.is_ignored_directory(
+                        os.path.join(dirpath, name))]
+            if len(kept) < len(dirnames):
+                path = dirpath
+                while path not in split_dirs:
+                    split_dirs.add(path)
+                    if path == root:
+                        break
+                    path = os.path.dirname(path)
+            dirnames[:] = kept
+        if root not in split_dirs:
+            return [(root, True)]
+
+        watches = []
+        for split_dir in sorted(split_dirs):
+            watches.append((split_dir, False))
+            try:
+                dirnames, _ = listdir(split_dir)
+            except OSError:
+                # Deleted since the walk
+                continue
+            for name in dirnames:
+                path = os.path.join(split_dir, name)
+                if (path not in split_dirs and
+                        not self.router.is_ignored_directory(path)):
+                    watches.append((path, True))
+        return watches
+
+    def schedule_watches(self, root):
+        for path, recursive in self.plan_watches(root):
+            watch = self.schedule(self.router, path, recursive=recursive)
+            if not recursive:
+                # Directories created in it are not covered by any watch yet
+                self.add_handler_for_watch(self.split_dir_handler, watch)
+
+    def watch_new_directory(self, path):
+        """Watch a directory created in a directory watched on its own."""
+        if self.router.is_ignored_directory(path) or not os.path.isdir(path):
+            return
+        self.schedule_watches(path)
+        # Files may have been created before the watches were set up
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = [name for name in dirnames
+                           if not self.router.is_ignored_directory(
+                               os.path.join(dirpath, name))]
+            for filename in filenames:
+                self.router.dispatch(
+                    FileCreatedEvent(os.path.join(dirpath, filename)))
+
     def start(self):
+        for root in self.router.get_roots():
+            self.schedule_watches(root)
         super(CompilerObserver, self).start()
 
         # Stop the observer when Django's autoreload calls sys.exit() before
         # reloading
         def cleanup():
             self.stop()
+            self.compile_queue.stop()
 
         atexit.register(cleanup)
 
 
+class SplitDirectoryEventHandler(FileSystemEventHandler):
+    """Have the observer watch directories created or moved into directories
+    that it watches non-recursively.
+    """
+
+    def __init__(self, observer):
+        super(SplitDirectoryEventHandler, self).__init__()
+        self.observer = observer
+
+    def on_created(self, event):
+        if event.is_directory:
+            self.observer.watch_new_directory(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.observer.watch_new_directory(event.dest_path)
+
+
 class CompilerFSEventHandler(FileSystemEventHandler):
     """A watchdog FS event handler for watching file changes and compiling.
 
-    We don't handle directory creation events anywhere in our source dir. We
-    rarely add new directories, and when that happens, we can always re-start
-    the runserver command. Handling directory events correctly will require
-    more code than is practical.
+    Sources in directories created after startup are compiled to the matching
+    subdirectory of the destination of their nearest known ancestor.
     """
 
-    def __init__(self, compiler, src_dst_dir_map):
+    def __init__(self, compiler, src_dst_dir_map, compile_queue=None):
         self.compiler = compiler
         super(FileSystemEventHandler, self).__init__()
         self.src_dst_dir_map = src_dst_dir_map
+        self.compile_queue = compile_queue
+        self.src_dst_dirs = PathTrie()
+        for src_dir, dst_dir in src_dst_dir_map.items():
+            self.src_dst_dirs[src_dir] = dst_dir
+
+    def get_dst_dir(self, src_dir):
+        dst_dir = self.src_dst_dir_map.get(src_dir)
+        if dst_dir:
+            return dst_dir
+        ancestor, ancestor_dst_dir = self.src_dst_dirs.find_nearest(src_dir)
+        if ancestor is None:
+            return None
+        return os.path.join(
+            ancestor_dst_dir, os.path.relpath(src_dir, ancestor))
 
     def get_dst_path(self, src_path):
         src_dir, src_filename = os.path.split(src_path)
-        dst_dir = self.src_dst_dir_map.get(src_dir)
+        dst_dir = self.get_dst_dir(src_dir)
         if not dst_dir:
             return None
         dst_path = os.path.join(dst_dir, src_filename)
@@ -65,8 +287,48 @@ class CompilerFSEventHandler(FileSystemEventHandler):
             *os.path.splitext(dst_path))
         return dst_path
 
+    def schedule(self, src_path):
+        """Compile src_path through the compile queue, if there is one.
+
+        Its output is marked pending until the compile is done.
+        """
+        dst_path = self.get_dst_path(src_path)
+        if dst_path:
+            readiness.begin(dst_path)
+        if self.compile_queue is None:
+            self.run_job(src_path, dst_path)
+        else:
+            self.compile_queue.put(
+                (self, src_path), self.run_job, src_path, dst_path,
+                group=self.compiler.get_concurrency_group(), output=dst_path)
+
+    def run_job(self, src_path, dst_path):
+        self.run_compile(self.compile, src_path, dst_path)
+
+    def run_compile(self, compile, src_path, dst_path):
+        """Call compile(src_path) and mark dst_path as done, unless the
+        compile is cancelled, in which case the job compiling it again does.
+        """
+        cancelled = False
+        try:
+            compile(src_path)
+        except CompileCancelled:
+            cancelled = True
+            print('Cancelled compiling outdated {0} file {1}'.format(
+                self.compiler.name, src_path))
+        finally:
+            if dst_path and not cancelled:
+                readiness.end(dst_path)
+
     def compile(self, src_path):
         dst_path = self.get_dst_path(src_path)
+        if not os.path.exists(src_path):
+            # Deleted or renamed away, possibly while the job was queued
+            if dst_path and self.compiler.remove_outputs(dst_path):
+                print('Removed {0} output {1} of deleted source {2}'.format(
+                    self.compiler.name, dst_path, src_path))
+                self.save_caches()
+            return
         if not dst_path:
             print(
                 'Warning: No matching destination found for source {0}, and '
@@ -74,17 +336,31 @@ class CompilerFSEventHandler(FileSystemEventHandler):
         else:
             try:
                 self.compiler.compile(src_path, dst_path)
-            except subprocess.CalledProcessError:
-                # coffee already reported the actual error to stderr
-                pass
+            except subprocess.CalledProcessError as err:
+                report_errors([(src_path, err)])
+            self.save_caches()
+
+    def save_caches(self):
+        if self.compiler.build_cache is not None:
+            self.compiler.build_cache.save()
+        if self.compiler.manifest is not None:
+            self.compiler.manifest.save()
+
+    def schedule_directory(self, path):
+        """Compile all sources in a new directory. Files created before the
+        directory itself was being watched have no events of their own.
+        """
+        for dirpath, dirnames, filenames in os.walk(path):
+            for filename in filenames:
+                src_path = os.path.join(dirpath, filename)
+                if self.compiler.matches(*os.path.splitext(src_path)):
+                    self.schedule(src_path)
 
     def on_created(self, event):
         if event.is_directory:
-            print(
-                'Warning: New directory %s created but not watched' %
-                event.src_path, file=sys.stderr)
+            self.schedule_directory(event.src_path)
         elif self.compiler.matches(*os.path.splitext(event.src_path)):
-            self.compile(event.src_path)
+            self.schedule(event.src_path)
 
     def on_deleted(self, event):
         if event.is_directory:
@@ -92,34 +368,102 @@ class CompilerFSEventHandler(FileSystemEventHandler):
                 'Warning: Directory %s deleted' % event.src_path,
                 file=sys.stderr)
         elif self.compiler.matches(*os.path.splitext(event.src_path)):
-            print('Warning: File %s deleted' % event.src_path, file=sys.stderr)
+            # Removes the outputs, unless the file is back by then
+            self.schedule(event.src_path)
 
     def on_modified(self, event):
         if (not event.is_directory
                 and self.compiler.matches(*os.path.splitext(event.src_path))):
-            self.compile(event.src_path)
+            self.schedule(event.src_path)
 
     def on_moved(self, event):
         if event.is_directory:
             print(
                 'Warning: Directory %s deleted' % event.src_path,
                 file=sys.stderr)
-        elif (self.compiler.matches(*os.path.splitext(event.src_path))
-              and self.compiler.matches(*os.path.splitext(event.dest_path))):
-            print(
-                'Warning: File renamed {0} -> {1}'.format(
-                    event.src_path, event.dest_path), file=sys.stderr)
-            self.compile(event.dest_path)
+            self.schedule_directory(event.dest_path)
+            return
+        if self.compiler.matches(*os.path.splitext(event.src_path)):
+            # Removes the outputs of the old name
+            self.schedule(event.src_path)
+        # Editors often save by renaming a temporary file over the source,
+        # in which case only the destination is a source file.
+        if self.compiler.matches(*os.path.splitext(event.dest_path)):
+            self.schedule(event.dest_path)
 
 
 class Compiler(object):
+    # A civet.build_cache.BuildCache shared by all compilers, if enabled
+    build_cache = None
+
+    # A civet.manifest.AssetManifest shared by all compilers, if hashed
+    # filenames are enabled
+    manifest = None
+
+    # The watchdog event handler class used by watch()
+    event_handler_class = CompilerFSEventHandler
+
+    # File extensions (eg ".coffee") this compiler may match, used to avoid
+    # asking every compiler about every file. None means matches() has to be
+    # called for every file.
+    extensions = None
+
+    # Whether submit_all() can be called with files one at a time, as they
+    # are found, instead of once with all files
+    supports_streaming = True
+
+    # Node modules (tried in order) that a persistent worker can load to
+    # compile files in-process, and the kind of compiler they are (see
+    # node_worker.js). Compilers without these always use a process per file.
+    worker_modules = None
+    worker_kind = None
+
+    # The running NodeWorker, if persistent workers are enabled
+    worker = None
+
+    # Django settings name choosing how files are compiled: executable_name
+    # (the default) runs the executable, a key of backends compiles in-process
+    # with that civet.compilers.backends.InProcessBackend class.
+    backend_setting = None
+    backends = {}
+
+    # A civet.stats.CompileStats recording what happened to each file, if any
+    stats = None
+
+    # A civet.artifacts.ArtifactCache to fetch outputs from instead of
+    # compiling them, and to store them in, if any
+    artifact_cache = None
+
+    # Recompile files even if they are up to date
+    force = False
+
+    # Only print which files would be compiled
+    dry_run = False
+
+    # Compile the most recently modified sources first
+    prioritize_recent = False
+
+    # The name this compiler's jobs are limited by in
+    # settings.CIVET_COMPILER_MAX_WORKERS (see civet.scheduler), by default
+    # its executable_name
+    concurrency_group = None
+
+    # Whether the executable writes sourcemaps that refer to the source
+    # relative to where it wrote them, which civet.sourcemaps rewrites.
+    # Persistent workers and backends write usable sourcemaps themselves.
+    relative_sourcemaps = False
+
     def __init__(self, precompiled_assets_dir, kill_on_error):
         self.precompiled_assets_dir = precompiled_assets_dir
+        if not hasattr(self, 'backend'):
+            self.backend = self.load_backend(kill_on_error)
         if not hasattr(self, 'executable'):
             bin = getattr(
                 settings, self.executable_setting, self.executable_name)
-            self.executable = find_executable(bin)
-        if not self.executable:
+            self.executable = self.probe(
+                'executable:' + bin, lambda: find_executable(bin),
+                is_valid=os.path.exists)
+        if not self.executable and self.backend is None:
             if getattr(settings, self.executable_setting, None):
                 print(
                     'Your project uses {name}, but "{bin_path}" specified in '
@@ -178,38 +522,486 @@ class Compiler(object):
         """
         raise NotImplementedError("Subclasses must implement get_arguments()")
 
+    def get_map_path(self, dst_path):
+        """Return the path of the sourcemap written along with dst_path.
+        """
+        return dst_path + '.map'
+
+    def load_backend(self, kill_on_error):
+        """Return the in-process backend chosen in settings, or None if the
+        executable is to be run.
+
+        If the backend's library is not installed, a warning is printed and
+        None is returned.
+        """
+        if not self.backend_setting:
+            return None
+        choice = getattr(settings, self.backend_setting, self.executable_name)
+        if choice == self.executable_name:
+            return None
+        backend_class = self.backends.get(choice)
+        if backend_class is None:
+            print(
+                'Unknown settings.{setting} "{choice}", must be one of: '
+                '{choices}.'.format(
+                    setting=self.backend_setting,
+                    choice=choice,
+                    choices=', '.join(
+                        [self.executable_name] + sorted(self.backends))
+                ), file=sys.stderr)
+            raise_error_or_kill(kill_on_error)
+            return None
+        try:
+            return backend_class(self)
+        except BackendUnavailable as err:
+            print(
+                'Warning: settings.{setting} is "{choice}", but {err}. Using '
+                '"{executable_name}" instead.'.format(
+                    setting=self.backend_setting,
+                    choice=choice,
+                    err=err,
+                    executable_name=self.executable_name
+                ), file=sys.stderr)
+            return None
+
+    def get_worker_job(self, src_path, dst_path):
+        """Return the sourcemap path and compiler options for a worker job.
+        """
+        raise NotImplementedError(
+            "Subclasses with worker_modules must implement get_worker_job()")
+
+    def start_worker(self, node_executable):
+        """Start a persistent worker for this compiler, if it supports one.
+
+        If the worker cannot be started, the compiler keeps using one process
+        per file.
+        """
+        if not self.worker_modules or self.backend is not None:
+            return
+        # The compiler module is looked up from the executable's own package,
+        # eg node_modules/babel-cli for node_modules/.bin/babel.
+        search_dir = os.path.dirname(os.path.dirname(
+            os.path.realpath(self.executable)))
+        worker = NodeWorker(node_executable, self.worker_kind, search_dir,
+                            self.worker_modules, env=self.env)
+        try:
+            worker.start()
+        except NodeWorkerUnavailable as err:
+            print(
+                'Warning: could not start a persistent {0} worker, using one '
+                'process per file instead: {1}'.format(self.name, err),
+                file=sys.stderr)
+            return
+        self.worker = worker
+        atexit.register(worker.stop)
+        print('Started persistent {} worker'.format(self.name))
+
+    def run(self, src_path, dst_path):
+        """Compile src_path to dst_path, with the in-process backend if one is
+        used, the persistent worker if one is running, or else with a new
+        compiler process.
+
+        Returns:
+            What the compiler printed (eg warnings), as text.
+
+        Raises:
+            subprocess.CalledProcessError: If the source fails to compile. Its
+                output attribute is what the compiler printed.
+            civet.scheduler.CompileCancelled: If the compile job was
+                cancelled. Only compiler processes are interrupted.
+        """
+        cancellation = get_cancellation()
+        if cancellation is not None:
+            cancellation.check()
+        if self.backend is not None:
+            self.run_backend(src_path, dst_path)
+            return ''
+        elif self.worker is not None:
+            mkdir_p(os.path.dirname(dst_path))
+            map_path, options = self.get_worker_job(src_path, dst_path)
+            return self.worker.compile(src_path, dst_path, map_path, options)
+        else:
+            args = self.get_command_with_arguments(src_path, dst_path)
+            return run_process(args, env=self.env, cancellation=cancellation)
+
+    def run_atomically(self, src_path, dst_path):
+        """Run the compiler into a temporary directory next to the directory
+        of dst_path, and rename what it wrote into place once it succeeded.
+
+        A request never sees a missing or half-written output this way, and
+        sourcemaps written alongside the output are moved along with it.
+        """
+        dst_dir, dst_basename = os.path.split(dst_path)
+        mkdir_p(dst_dir)
+        with temporary_sibling_directory(
+                dst_dir, self.precompiled_assets_dir) as tmp_dir:
+            messages = self.run(src_path, os.path.join(tmp_dir, dst_basename))
+            move_files(tmp_dir, dst_dir)
+        return messages
+
+    def get_output_paths(self, dst_path):
+        """Return the paths of the files written when compiling to dst_path.
+        """
+        return [dst_path, self.get_map_path(dst_path)]
+
+    def remove_outputs(self, dst_path):
+        """Delete the outputs compiled to dst_path from a source that no
+        longer exists, and forget about them.
+
+        Returns:
+            True if any file was deleted.
+        """
+        removed = False
+        for path in self.get_output_paths(dst_path):
+            removed = remove_file(path) or removed
+        if self.build_cache is not None:
+            self.build_cache.discard(dst_path)
+        if self.manifest is not None:
+            self.manifest.discard(dst_path)
+        return removed
+
+    def run_backend(self, src_path, dst_path):
+        """Compile src_path to dst_path with the in-process backend.
+
+        Compile errors are reported like a failed compiler process, by
+        raising subprocess.CalledProcessError.
+        """
+        with io.open(src_path, encoding='utf-8') as f:
+            source = f.read()
+        try:
+            output, source_map = self.backend.compile_source(
+                source, src_path, dst_path)
+        except BackendCompileError as err:
+            raise subprocess.CalledProcessError(
+                1, [self.backend.name, src_path], output=six.text_type(err))
+        write_file_atomically(dst_path, output)
+        if source_map is not None:
+            if not isinstance(source_map, six.string_types):
+                source_map = json.dumps(source_map)
+            write_file_atomically(self.get_map_path(dst_path), source_map)
+
+    def get_version_command(self):
+        """Return the command that prints the compiler's version.
+        """
+        return [self.executable, '--version']
+
+    def get_version(self):
+        """Return the compiler's version string, or '' if it is unknown.
+        """
+        if self.backend is not None:
+            return self.backend.get_version()
+        if not hasattr(self, '_version'):
+            command = self.get_version_command()
+            try:
+                # A reinstalled compiler gets a new mtime, and a new version
+                mtime = os.path.getmtime(self.executable)
+            except (OSError, TypeError):
+                mtime = None
+            self._version = self.probe(
+                'version:' + json.dumps([command, mtime]),
+                lambda: self.run_version_command(command))
+        return self._version
+
+    def run_version_command(self, command):
+        try:
+            output = subprocess.check_output(
+                command, env=self.env, stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            return ''
+        return output.decode(
+            sys.getdefaultencoding(), errors='ignore').strip()
+
+    def probe(self, name, compute, is_valid=None):
+        """Return compute(), remembered under name between runs (see
+        civet.probe_cache).
+        """
+        return probe(self.precompiled_assets_dir, name, compute, is_valid)
+
+    def get_identity_command(self):
+        """Return get_command_with_arguments() for a placeholder source and
+        destination, without the executable if an in-process backend is used.
+        """
+        command = self.get_command_with_arguments('<src>', '<dst>')
+        if self.backend is not None:
+            # The backend's name and version stand in for the executable,
+            # which is not run, and may not be installed (ie None)
+            command = command[1:]
+        return command
+
+    def get_cache_identity(self):
+        """Return a JSON-serializable description of everything besides the
+        source that affects this compiler's output.
+        """
+        return [
+            type(self).__module__ + '.' + type(self).__name__,
+            self.executable if self.backend is None else None,
+            self.get_version(),
+            self.get_identity_command(),
+            self.worker is not None,
+            self.backend.name if self.backend is not None else None,
+        ]
+
+    def set_roots(self, roots):
+        """Get ready to compile sources found on demand, without the rest of
+        the project having been searched (see civet.finders).
+
+        Args:
+            roots: The static files directories sources are found in, in the
+                order they are searched.
+        """
+
+    def prepare_source(self, src_path):
+        """Get ready to compile src_path, a source found on demand (see
+        set_roots()).
+        """
+
+    def get_dependencies(self, src_path):
+        """Return the paths of other sources that src_path's output depends
+        on (eg Sass partials), which make it stale when they change.
+        """
+        return []
+
+    def is_stale(self, src_path, dst_path):
+        """Return True if dst_path needs to be (re)compiled from src_path.
+
+        The build cache, if enabled, is consulted first, so that unchanged
+        sources are not recompiled just because their mtime changed. Outputs
+        unknown to the cache fall back to comparing mtimes.
+        """
+        if self.force or not os.path.exists(dst_path):
+            return True
+        if self.build_cache is not None:
+            fresh = self.build_cache.is_fresh(self, src_path, dst_path)
+            if fresh is not None:
+                return not fresh
+        dst_mtime = os.path.getmtime(dst_path)
+        return any(
+            not os.path.exists(path) or dst_mtime < os.path.getmtime(path)
+            for path in [src_path] + list(self.get_dependencies(src_path)))
+
     def compile(self, src_path, dst_path):
         """Invoke the appropriate compiler to compile src_path to dst_path.
 
-        Upon any compiler error, dst will be deleted if it exists. This
-        prevents stale asset files from being served.
-        """
-        if os.path.exists(dst_path):
-            if os.path.getmtime(dst_path) >= os.path.getmtime(src_path):
-                return
-            else:
-                os.remove(dst_path)
+        The output replaces dst_path only once the compiler has succeeded
+        (see run_atomically()). Upon any compiler error, dst will be deleted
+        if it exists. This prevents stale asset files from being served.
 
-        args = self.get_command_with_arguments(src_path, dst_path)
+        Returns:
+            True if src_path was compiled, False if dst_path was up to date
+            (or would have been compiled in a dry run).
+        """
+        if not self.is_stale(src_path, dst_path):
+            self.record(src_path, CompileStats.SKIPPED, dst_path=dst_path)
+            return False
+        if self.dry_run:
+            print("Would compile {} file {}".format(self.name, src_path))
+            self.record(src_path, CompileStats.WOULD_COMPILE)
+            return False
+        signature = None
+        if self.build_cache is not None:
+            signature = self.build_cache.get_signature(self, src_path)
+        key = self.get_artifact_key(src_path, dst_path)
+
+        start = time.time()
+        if self.fetch_artifact(dst_path, key):
+            print("Fetched {} file {} from the artifact cache".format(
+                self.name, src_path))
+            self.finish(src_path, dst_path, time.time() - start, signature)
+            return True
         print("Compiling {} file {}".format(self.name, src_path))
-        subprocess.check_call(args, env=self.env)
+        try:
+            messages = self.run_atomically(src_path, dst_path)
+        except subprocess.CalledProcessError as err:
+            remove_file(dst_path)
+            self.record(src_path, CompileStats.FAILED, time.time() - start,
+                        dst_path, err.returncode, err.output)
+            raise
+        self.store_artifact(dst_path, key)
+        self.finish(src_path, dst_path, time.time() - start, signature,
+                    messages)
+        return True
+
+    def finish(self, src_path, dst_path, seconds, signature=None,
+               messages=None):
+        """Record that src_path was compiled to dst_path, after its outputs
+        were put in place.
+
+        Args:
+            signature: The build cache signature taken before compiling.
+            messages: What the compiler printed.
+        """
+        self.process_outputs(src_path, dst_path)
+        self.record(src_path, CompileStats.COMPILED, seconds, dst_path, 0,
+                    messages)
+        if messages:
+            print('{0} messages for {1}:\n{2}'.format(
+                self.name, src_path, indent_messages(messages)))
+        if signature is not None:
+            self.build_cache.record(dst_path, signature)
+        if self.manifest is not None:
+            self.manifest.add(dst_path)
+
+    def get_artifact_identity(self):
+        """Return get_cache_identity() as it would be on any machine, with
+        paths made portable (see civet.artifacts.get_portable_path()).
+        """
+        return [
+            type(self).__module__ + '.' + type(self).__name__,
+            self.get_version(),
+            [get_portable_path(arg) for arg in self.get_identity_command()],
+            self.worker is not None,
+            self.backend.name if self.backend is not None else None,
+        ]
+
+    def get_artifact_key(self, src_path, dst_path):
+        """Return the artifact cache key of compiling src_path to dst_path,
+        or None if no artifact cache is used.
+        """
+        if self.artifact_cache is None:
+            return None
+        return get_artifact_key(self, src_path, dst_path)
+
+    def fetch_artifact(self, dst_path, key):
+        """Put the outputs stored under key in the artifact cache in place of
+        compiling them to dst_path.
+
+        Returns:
+            True if they were found.
+        """
+        if key is None or self.force:
+            return False
+        data = self.artifact_cache.get(key)
+        if data is None:
+            return False
+        dst_dir = os.path.dirname(dst_path)
+        mkdir_p(dst_dir)
+        try:
+            with temporary_sibling_directory(
+                    dst_dir, self.precompiled_assets_dir) as tmp_dir:
+                unpack_outputs(data, tmp_dir)
+                move_files(tmp_dir, dst_dir)
+        except zipfile.BadZipfile as err:
+            print('Warning: ignoring broken artifact {0}: {1}'.format(
+                key, err), file=sys.stderr)
+            return False
+        return True
+
+    def store_artifact(self, dst_path, key):
+        """Store the outputs just compiled to dst_path in the artifact cache
+        under key.
+        """
+        if key is not None:
+            self.artifact_cache.set(
+                key, pack_outputs(self.get_output_paths(dst_path)))
+
+    def process_outputs(self, src_path, dst_path):
+        """Queue the post-processing of the outputs freshly compiled from
+        src_path to dst_path, on the sourcemap pipeline.
+        """
+        if (not self.relative_sourcemaps or not sourcemaps.rewrite_sourcemaps
+                or self.worker is not None or self.backend is not None):
+            return
+        map_path = self.get_map_path(dst_path)
+        if os.path.exists(map_path):
+            sourcemaps.pipeline.submit(map_path, src_path)
+
+    def record(self, src_path, outcome, seconds=0.0, dst_path=None,
+               returncode=None, messages=None):
+        """Report what happened to src_path to the stats, if any, and to
+        receivers of the civet.signals.asset_compiled signal, and mark
+        dst_path as done.
+        """
+        output_size = None
+        if outcome == CompileStats.COMPILED and dst_path is not None:
+            try:
+                output_size = os.path.getsize(dst_path)
+            except OSError:
+                pass
+        if self.stats is not None:
+            self.stats.record(self, src_path, outcome, seconds, dst_path,
+                              returncode, output_size, messages)
+        asset_compiled.send(
+            sender=type(self), compiler=self, src_path=src_path,
+            dst_path=dst_path, outcome=outcome, seconds=seconds,
+            returncode=returncode, output_size=output_size,
+            messages=messages)
+        if dst_path is not None:
+            readiness.end(dst_path)
+
+    def submit_all(self, src_dest_tuples, pool):
+        """Queue compile jobs for given (src, dest) file path tuples on pool.
+
+        Subclasses that compile several files with one process should override
+        this instead of compile_all().
+        """
+        for src, dst in src_dest_tuples:
+            self.submit(src, dst, pool)
+
+    def submit(self, src_path, dst_path, pool):
+        """Queue compiling src_path to dst_path on pool."""
+        pool.submit_job(
+            self.get_priority(src_path), src_path, self.compile,
+            (src_path, dst_path), group=self.get_concurrency_group(),
+            outputs=[dst_path])
+
+    def get_concurrency_group(self):
+        """Return the name this compiler's jobs are limited by (see
+        civet.scheduler).
+        """
+        return self.concurrency_group or self.executable_name
+
+    def get_priority(self, src_path):
+        """Return the pool priority of compiling src_path. With
+        prioritize_recent, the most recently modified sources come first.
+        """
+        if not self.prioritize_recent:
+            return 0
+        try:
+            return -os.path.getmtime(src_path)
+        except OSError:
+            return 0
 
     def compile_all(self, src_dest_tuples):
         """Pre-compile given (src, dest) file path tuples.
+
+        All errors are reported, and the first one is raised once every file
+        has been attempted.
         """
         # Block and compile non-existent or newer files first
         print('Start precompiling {} files'.format(self.name))
-        for src, dst in src_dest_tuples:
-            self.compile(src, dst)
+        pool = CompilePool()
+        self.submit_all(src_dest_tuples, pool)
+        errors = pool.shutdown()
+        sourcemaps.pipeline.wait()
+        if errors:
+            report_errors(errors)
+            raise errors[0][1]
         print('End precompiling {} files'.format(self.name))
 
-    def watch(self, files, observer):
-        # Watch for changes in directories containing source files.
-        src_dst_dir_map = collect_src_dst_dir_mappings(files)
-        event_handler = CompilerFSEventHandler(self, src_dst_dir_map)
+    def watch(self, files, observer, roots=()):
+        """Compile the sources in files, (src, dst) tuples, when they change.
 
+        Args:
+            roots: The static files directories, which are watched for
+                sources in new directories. Those are compiled to the same
+                path below the precompiled asset directory, like discovery
+                does.
+        """
+        src_dst_dir_map = collect_src_dst_dir_mappings(files)
+        for root in roots:
+            src_dst_dir_map.setdefault(root, self.precompiled_assets_dir)
+        event_handler = self.event_handler_class(
+            self, src_dst_dir_map,
+            compile_queue=getattr(observer, 'compile_queue', None))
+
+        if hasattr(observer, 'add_sources'):
+            # The polling observer checks the sources found by discovery
+            observer.add_sources(src for src, dst in files)
         for src_dir in src_dst_dir_map:
-            observer.schedule(event_handler, src_dir, recursive=False)
+            if hasattr(observer, 'add_route'):
+                observer.add_route(src_dir, event_handler)
+            else:
+                observer.schedule(event_handler, src_dir, recursive=False)
 
         # The observer will start its own thread. We don't care about cleaning
         # it up since it goes down with the server's process. See
@@ -1,16 +1,74 @@
 from __future__ import print_function
-import json
+from collections import defaultdict
 import os
+import subprocess
+import time
 
 from django.conf import settings
 
+from civet.compilers.backends import BackendCompileError
+from civet.compilers.backends import BackendUnavailable
+from civet.compilers.backends import InProcessBackend
 from civet.compilers.base_compiler import Compiler
+from civet.scheduler import CompileCancelled
+from civet.scheduler import get_cancellation
+from civet.stats import CompileStats
+from civet.util import indent_messages
+from civet.util import mkdir_p
+from civet.util import move_files
+from civet.util import run_process
+from civet.util import temporary_sibling_directory
+
+
+# Maximum number of sources passed to a single `coffee` process by
+# compile_all(). Larger batches mean fewer process starts, smaller ones let
+# more processes run in parallel.
+batch_size = getattr(
+    settings, 'CIVET_COFFEE_BATCH_SIZE', 50)
+
+
+class DukpyCoffeeBackend(InProcessBackend):
+    """Compile CoffeeScript with the CoffeeScript compiler bundled with dukpy
+    (https://pypi.org/project/dukpy/), an embedded JavaScript interpreter.
+
+    dukpy compiles with the default options and writes no sourcemap.
+    """
+    name = 'dukpy'
+
+    def __init__(self, compiler):
+        super(DukpyCoffeeBackend, self).__init__(compiler)
+        try:
+            import dukpy
+        except ImportError:
+            raise BackendUnavailable('the dukpy package is not installed')
+        if not hasattr(dukpy, 'coffee_compile'):
+            raise BackendUnavailable(
+                'the installed dukpy does not include CoffeeScript')
+        self.dukpy = dukpy
+
+    def get_version(self):
+        return 'dukpy {0}'.format(getattr(self.dukpy, '__version__', ''))
+
+    def compile_source(self, source, src_path, dst_path):
+        try:
+            return self.dukpy.coffee_compile(source), None
+        except self.dukpy.JSRuntimeError as err:
+            raise BackendCompileError(str(err))
 
 
 class CoffeescriptCompiler(Compiler):
     name = "CoffeeScript"
     executable_name = 'coffee'
     executable_setting = 'CIVET_COFFEE_BIN'
+    worker_modules = ('coffeescript', 'coffee-script')
+    worker_kind = 'coffee'
+    extensions = ('.coffee',)
+    # Needs all files at once to batch the sources of each directory into one
+    # `coffee` invocation (see submit_all())
+    supports_streaming = False
+    backend_setting = 'CIVET_COFFEE_BACKEND'
+    backends = {'dukpy': DukpyCoffeeBackend}
+    relative_sourcemaps = True
 
     def __init__(self, precompiled_assets_dir, kill_on_error):
         super(CoffeescriptCompiler, self).__init__(precompiled_assets_dir,
@@ -33,58 +91,111 @@ class CoffeescriptCompiler(Compiler):
         args.append(src_path)
         return args
 
-    def compile(self, src_path, dst_path):
-        super(CoffeescriptCompiler, self).compile(src_path, dst_path)
-
-        # check_call raises an exception if the exit status is not 0, so the
-        # fact that we reach here means we can safely massage the map file.
-        #
-        # The reason we need to massage the map is that when `coffee -o` is
-        # used, the sourceRoot and sources keys in the map become relative path
-        # references, which are not valid paths from Django static file
-        # finder's point of view.
-        #
-        # For example, if the JS file is at
-        #
-        #     /static/myapp/js/foo.js
-        #
-        # And the actual coffee source lives in
-        #
-        #     <source root>/myapp/static/myapp/js/foo.coffee
-        #
-        # Without the massaging, sourceRoot and sources in the map are:
-        #
-        #     {
-        #         "sourceRoot": "../../..",
-        #         "sources": ["myapp/static/myapp/js/foo.coffee"]
-        #     }
-        #
-        # Which would make the browser want to fetch this:
-        #
-        #     /myapp/static/myapp/js/foo.coffee
-        #
-        # Which we know is wrong.
-        #
-        # By removing the relative references, the browser will correctly fetch
-        #
-        #     /static_files/myapp/js/foo.coffee
-        #
-        # Which will be found by Django's static finder correctly.
-        dst_dir, dst_basename = os.path.split(dst_path)
-        map_filename = os.path.splitext(dst_basename)[0] + '.map'
-        map_path = os.path.join(dst_dir, map_filename)
-
-        if os.path.exists(map_path):
-            with open(map_path) as f:
-                try:
-                    map_data = json.load(f)
-                except ValueError as err:
-                    f.seek(0)
-                    print("Warning: could not read valid sourcemap JSON from "
-                          "{}. Exception is:\n{}\n\nContents are:\n{}"
-                          .format(map_path, err, f.read()))
-                    return
-            map_data['sourceRoot'] = ''
-            map_data['sources'] = [os.path.basename(src_path)]
-            with open(map_path, 'w') as f:
-                json.dump(map_data, f)
+    def get_map_path(self, dst_path):
+        return os.path.splitext(dst_path)[0] + '.map'
+
+    def get_worker_job(self, src_path, dst_path):
+        map_path = None
+        if '--map' in self.args or '-m' in self.args:
+            map_path = self.get_map_path(dst_path)
+        options = {
+            'bare': '--bare' in self.args or '-b' in self.args,
+            'header': '--no-header' not in self.args,
+        }
+        return map_path, options
+
+    def compile_batch(self, src_dst_tuples, pool=None):
+        """Compile sources sharing one destination directory with a single
+        `coffee` process.
+
+        If the batch fails, each file is compiled on its own (as new jobs on
+        pool, if given), so that every error is reported against the file that
+        caused it. So is every file of a batch cancelled because one of them
+        changed again (see civet.scheduler).
+        """
+        dst_dir = os.path.dirname(src_dst_tuples[0][1])
+        signatures = {}
+        if self.build_cache is not None:
+            for src, dst in src_dst_tuples:
+                signatures[dst] = self.build_cache.get_signature(self, src)
+
+        keys = {}
+        remaining = []
+        for src, dst in src_dst_tuples:
+            keys[dst] = self.get_artifact_key(src, dst)
+            start = time.time()
+            if self.fetch_artifact(dst, keys[dst]):
+                print("Fetched {} file {} from the artifact cache".format(
+                    self.name, src))
+                self.finish(src, dst, time.time() - start,
+                            signatures.get(dst))
+            else:
+                remaining.append((src, dst))
+        if not remaining:
+            return
+        src_dst_tuples = remaining
+
+        print("Compiling {} CoffeeScript files into {}".format(
+            len(src_dst_tuples), dst_dir))
+        start = time.time()
+        mkdir_p(dst_dir)
+        try:
+            # Like run_atomically(), the outputs only replace the old ones
+            # once the whole batch has succeeded
+            with temporary_sibling_directory(
+                    dst_dir, self.precompiled_assets_dir) as tmp_dir:
+                args = [self.executable, '-o', tmp_dir]
+                args.extend(self.args)
+                args.extend(src for src, dst in src_dst_tuples)
+                messages = run_process(
+                    args, env=self.env, cancellation=get_cancellation())
+                move_files(tmp_dir, dst_dir)
+        except (subprocess.CalledProcessError, CompileCancelled) as err:
+            # Discard the messages, the files report their own errors
+            if pool is None:
+                if isinstance(err, CompileCancelled):
+                    raise
+                for src, dst in src_dst_tuples:
+                    self.compile(src, dst)
+            else:
+                for src, dst in src_dst_tuples:
+                    self.submit(src, dst, pool)
+            return
+
+        if messages:
+            print('{0} messages for {1}:\n{2}'.format(
+                self.name, ', '.join(src for src, dst in src_dst_tuples),
+                indent_messages(messages)))
+        # Split the time of the batch evenly between its files
+        seconds = (time.time() - start) / len(src_dst_tuples)
+        for src, dst in src_dst_tuples:
+            self.store_artifact(dst, keys[dst])
+            self.finish(src, dst, seconds, signatures.get(dst))
+
+    def submit_all(self, src_dest_tuples, pool):
+        """Queue stale sources in batches grouped by destination directory.
+        """
+        if (self.worker is not None or self.backend is not None
+                or self.dry_run):
+            # The worker and the backend are cheap per file already
+            super(CoffeescriptCompiler, self).submit_all(src_dest_tuples, pool)
+            return
+        batches = defaultdict(list)
+        for src, dst in src_dest_tuples:
+            if self.is_stale(src, dst):
+                batches[os.path.dirname(dst)].append(
+                    (self.get_priority(src), src, dst))
+            else:
+                self.record(src, CompileStats.SKIPPED, dst_path=dst)
+        for dst_dir, batch in sorted(batches.items()):
+            # With prioritize_recent, the most recently modified sources of
+            # the directory go in its first batch
+            batch.sort()
+            for i in range(0, len(batch), batch_size):
+                chunk = batch[i:i + batch_size]
+                pool.submit_job(
+                    chunk[0][0], ', '.join(src for _, src, _ in chunk),
+                    self.compile_batch,
+                    ([(src, dst) for _, src, dst in chunk], pool),
+                    group=self.get_concurrency_group(),
+                    outputs=[dst for _, _, dst in chunk])
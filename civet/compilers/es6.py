@@ -1,8 +1,10 @@
-import errno
 import os
 
 from django.conf import settings
 
+from civet.compilers.backends import BackendCompileError
+from civet.compilers.backends import BackendUnavailable
+from civet.compilers.backends import InProcessBackend
 from civet.compilers.base_compiler import Compiler
 
 
@@ -10,14 +12,36 @@ es6_extension = getattr(settings, 'CIVET_ES6_EXTENSION', '.js')
 node_path = getattr(settings, 'CIVET_ES6_NODE_PATH', None)
 
 
-def mkdir_p(path):
-    try:
-        os.makedirs(path)
-    except OSError as exc:
-        if exc.errno == errno.EEXIST and os.path.isdir(path):
-            pass
-        else:
-            raise
+class DukpyBabelBackend(InProcessBackend):
+    """Compile ES6 with the Babel bundled with dukpy
+    (https://pypi.org/project/dukpy/), an embedded JavaScript interpreter.
+    """
+    name = 'dukpy'
+
+    def __init__(self, compiler):
+        super(DukpyBabelBackend, self).__init__(compiler)
+        try:
+            import dukpy
+        except ImportError:
+            raise BackendUnavailable('the dukpy package is not installed')
+        if not hasattr(dukpy, 'babel_compile'):
+            raise BackendUnavailable(
+                'the installed dukpy does not include Babel')
+        self.dukpy = dukpy
+
+    def get_version(self):
+        return 'dukpy {0}'.format(getattr(self.dukpy, '__version__', ''))
+
+    def compile_source(self, source, src_path, dst_path):
+        try:
+            result = self.dukpy.babel_compile(
+                source, filename=os.path.basename(src_path), sourceMaps=True)
+        except self.dukpy.JSRuntimeError as err:
+            raise BackendCompileError(str(err))
+        map_path = self.compiler.get_map_path(dst_path)
+        output = result['code'] + '\n//# sourceMappingURL={0}\n'.format(
+            os.path.basename(map_path))
+        return output, result['map']
 
 
 class ES6Compiler(Compiler):
@@ -26,6 +50,12 @@ class ES6Compiler(Compiler):
     name = "ECMAScript 6"
     executable_name = 'babel'
     executable_setting = 'CIVET_BABEL_BIN'
+    worker_modules = ('babel-core', '@babel/core')
+    worker_kind = 'babel'
+    extensions = (es6_extension,)
+    backend_setting = 'CIVET_BABEL_BACKEND'
+    backends = {'dukpy': DukpyBabelBackend}
+    relative_sourcemaps = True
 
     def __init__(self, precompiled_assets_dir, kill_on_error):
         super(ES6Compiler, self).__init__(precompiled_assets_dir,
@@ -49,7 +79,5 @@ class ES6Compiler(Compiler):
             src_path,
         ]
 
-    def compile(self, src_path, dst_path):
-        dst_dir, dst_basename = os.path.split(dst_path)
-        mkdir_p(dst_dir)
-        super(ES6Compiler, self).compile(src_path, dst_path)
+    def get_worker_job(self, src_path, dst_path):
+        return self.get_map_path(dst_path), {}
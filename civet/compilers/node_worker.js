@@ -0,0 +1,116 @@
+// A long-lived compile worker for Civet.
+//
+// Usage: node node_worker.js <coffee|babel> <search dir> <module> [<module>...]
+//
+// Loads the first of the given modules that can be found from the search
+// directory (the compiler's own package), then reads one JSON job per line on
+// stdin and answers each with one JSON line on stdout:
+//
+//     {"id": 1, "src": "a.coffee", "dst": "a.js", "map": "a.map",
+//      "options": {...}}
+//     {"id": 1, "ok": true, "output": "..."}
+//     {"id": 1, "ok": false, "error": "...", "output": "..."}
+//
+// Once the module is loaded, {"ready": true} is written before any job is
+// read. What the compiler prints to stdout or stderr while compiling a job is
+// returned as the job's output.
+'use strict';
+
+var fs = require('fs');
+var path = require('path');
+var readline = require('readline');
+
+var kind = process.argv[2];
+var searchDir = process.argv[3];
+var moduleNames = process.argv.slice(4);
+
+function loadCompiler() {
+  var errors = [];
+  for (var i = 0; i < moduleNames.length; i++) {
+    try {
+      return require(require.resolve(moduleNames[i], {paths: [searchDir]}));
+    } catch (err) {
+      errors.push(err.message);
+    }
+  }
+  throw new Error('Cannot load any of ' + moduleNames.join(', ') + ':\n' +
+                  errors.join('\n'));
+}
+
+function compileCoffee(compiler, job) {
+  var source = fs.readFileSync(job.src, 'utf8');
+  var options = job.options || {};
+  var result = compiler.compile(source, {
+    filename: job.src,
+    bare: !!options.bare,
+    header: !!options.header,
+    sourceMap: !!job.map
+  });
+  if (!job.map) {
+    fs.writeFileSync(job.dst, typeof result === 'string' ? result : result.js);
+    return;
+  }
+  var map = JSON.parse(result.v3SourceMap);
+  // Same rewriting as civet.sourcemaps does for the coffee CLI's maps
+  map.sourceRoot = '';
+  map.sources = [path.basename(job.src)];
+  map.file = path.basename(job.dst);
+  fs.writeFileSync(job.dst, result.js + '\n//# sourceMappingURL=' +
+                   path.basename(job.map) + '\n');
+  fs.writeFileSync(job.map, JSON.stringify(map));
+}
+
+function compileBabel(compiler, job) {
+  var result = compiler.transformFileSync(job.src, {
+    sourceMaps: !!job.map,
+    sourceFileName: path.basename(job.src)
+  });
+  var code = result.code;
+  if (job.map) {
+    result.map.file = path.basename(job.dst);
+    code += '\n//# sourceMappingURL=' + path.basename(job.map) + '\n';
+    fs.writeFileSync(job.map, JSON.stringify(result.map));
+  }
+  fs.writeFileSync(job.dst, code);
+}
+
+var writeStdout = process.stdout.write;
+var writeStderr = process.stderr.write;
+
+function respond(message) {
+  writeStdout.call(process.stdout, JSON.stringify(message) + '\n');
+}
+
+var compiler;
+try {
+  compiler = loadCompiler();
+} catch (err) {
+  process.stderr.write(err.message + '\n');
+  process.exit(2);
+}
+var compile = kind === 'coffee' ? compileCoffee : compileBabel;
+
+respond({ready: true});
+
+readline.createInterface({input: process.stdin}).on('line', function(line) {
+  if (!line) {
+    return;
+  }
+  var job = JSON.parse(line);
+  var output = [];
+  var response = {id: job.id, ok: true};
+  process.stdout.write = process.stderr.write = function(chunk) {
+    output.push(String(chunk));
+    return true;
+  };
+  try {
+    compile(compiler, job);
+  } catch (err) {
+    response = {id: job.id, ok: false, error: String(err.stack || err)};
+  } finally {
+    process.stdout.write = writeStdout;
+    process.stderr.write = writeStderr;
+  }
+  response.output = output.join('');
+  respond(response);
+});
@@ -0,0 +1,230 @@
+from __future__ import print_function
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.utils.six.moves import queue
+
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), 'node_worker.js')
+
+# Seconds a worker may take to start or to compile one file before it is
+# considered hung, killed and restarted for the next file.
+worker_timeout = getattr(
+    settings, 'CIVET_WORKER_TIMEOUT', 60)
+
+
+class NodeWorkerUnavailable(Exception):
+    """Raised when a worker process cannot be started."""
+
+
+class NodeWorkerTimeout(Exception):
+    """Raised when a worker does not respond within its timeout. The message
+    is what the worker printed to stdout in the meantime.
+    """
+
+
+class NodeWorker(object):
+    """A long-lived Node process that compiles files sent to it.
+
+    Instead of paying for Node startup and module loading on every file, the
+    worker loads the compiler module once and compiles jobs sent to it as
+    line-delimited JSON over stdin/stdout (see node_worker.js). Jobs are sent
+    one at a time. If the process dies, it is restarted and the job is tried
+    once more. If it hangs for longer than timeout seconds, it is killed and
+    the job fails, and the next job starts a new process.
+
+    What the compiler prints while compiling a job is returned with its
+    result, like run_process() returns what a compiler process printed:
+    the output the worker captured itself, lines on stdout that are not
+    responses, and whatever reached the worker's stderr in the meantime.
+    """
+
+    def __init__(self, node_executable, kind, search_dir, module_names,
+                 env=None):
+        self.args = [node_executable, WORKER_SCRIPT, kind, search_dir]
+        self.args.extend(module_names)
+        self.env = env
+        self.timeout = worker_timeout
+        self.process = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # The lines the worker wrote to stdout, and None once it closed it
+        self._stdout = None
+        self._stdout_thread = None
+        # What the worker wrote to stderr and nobody has taken yet
+        self._stderr = []
+        self._stderr_lock = threading.Lock()
+        self._stderr_thread = None
+
+    def start(self):
+        """Start the worker process and wait until it is ready.
+
+        Raises:
+            NodeWorkerUnavailable: If the process fails to load the compiler.
+        """
+        self.stop()
+        try:
+            self.process = subprocess.Popen(
+                self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, env=self.env, close_fds=True)
+        except OSError as err:
+            raise NodeWorkerUnavailable(str(err))
+        # Read by threads, so that waiting for a response can time out
+        self._stdout = queue.Queue()
+        self._stdout_thread = threading.Thread(
+            target=self._read_stdout,
+            args=(self.process.stdout, self._stdout))
+        self._stdout_thread.daemon = True
+        self._stdout_thread.start()
+        self._stderr_thread = threading.Thread(
+            target=self._read_stderr, args=(self.process.stderr,))
+        self._stderr_thread.daemon = True
+        self._stderr_thread.start()
+        try:
+            response, messages = self._read_response()
+        except NodeWorkerTimeout:
+            self.stop()
+            raise NodeWorkerUnavailable(
+                'Worker {0} did not start within {1} seconds'.format(
+                    ' '.join(self.args), self.timeout))
+        if response == {'ready': True}:
+            # Printed while loading, eg by plugins, not about any file
+            sys.stdout.write(messages)
+        else:
+            self.stop()
+            messages = (messages + self._take_stderr()).strip()
+            raise NodeWorkerUnavailable('Worker {0} failed to start{1}'.format(
+                ' '.join(self.args), ':\n' + messages if messages else ''))
+
+    def stop(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process = None
+        for thread in (self._stdout_thread, self._stderr_thread):
+            if thread is not None:
+                # Done once the pipe is closed, ie the process is gone
+                thread.join(1)
+        self._stdout_thread = self._stderr_thread = None
+
+    def _read_stdout(self, stream, lines):
+        for line in iter(stream.readline, b''):
+            lines.put(line)
+        lines.put(None)
+        stream.close()
+
+    def _read_stderr(self, stream):
+        for line in iter(stream.readline, b''):
+            with self._stderr_lock:
+                self._stderr.append(line.decode('utf-8', 'replace'))
+        stream.close()
+
+    def _take_stderr(self):
+        with self._stderr_lock:
+            text = ''.join(self._stderr)
+            del self._stderr[:]
+        return text
+
+    def _read_response(self, job_id=None):
+        """Return the next response (None if the worker exited) and what was
+        printed to stdout before it.
+
+        Responses to other jobs than job_id are skipped.
+
+        Raises:
+            NodeWorkerTimeout: If there is no response within self.timeout
+                seconds.
+        """
+        messages = []
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                line = self._stdout.get(
+                    timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                raise NodeWorkerTimeout(''.join(messages))
+            if line is None:
+                return None, ''.join(messages)
+            text = line.decode('utf-8', 'replace')
+            try:
+                response = json.loads(text)
+            except ValueError:
+                response = None
+            if not isinstance(response, dict):
+                # Printed by the compiler or one of its plugins, not a
+                # response
+                messages.append(text)
+            elif job_id is None or response.get('id') == job_id:
+                return response, ''.join(messages)
+
+    def _send(self, job):
+        self.process.stdin.write((json.dumps(job) + '\n').encode('utf-8'))
+        self.process.stdin.flush()
+        return self._read_response(job['id'])
+
+    def compile(self, src_path, dst_path, map_path=None, options=None):
+        """Compile src_path to dst_path (and the sourcemap to map_path).
+
+        Returns:
+            What the compiler printed (eg warnings), as text.
+
+        Raises:
+            subprocess.CalledProcessError: If the source fails to compile,
+                the worker keeps dying or it times out. Its output attribute
+                is the error and what the compiler printed.
+        """
+        job = {
+            'id': next(self._ids),
+            'src': src_path,
+            'dst': dst_path,
+            'map': map_path,
+            'options': options or {},
+        }
+        with self._lock:
+            response = None
+            messages = ''
+            error = ''
+            for attempt in range(2):
+                if self.process is None or self.process.poll() is not None:
+                    if attempt or self.process is not None:
+                        print('Restarting crashed compile worker {0}'.format(
+                            ' '.join(self.args)), file=sys.stderr)
+                    try:
+                        self.start()
+                    except NodeWorkerUnavailable as err:
+                        print(err, file=sys.stderr)
+                        break
+                # Left over from between jobs, eg a crash
+                self._take_stderr()
+                try:
+                    response, messages = self._send(job)
+                except (IOError, OSError):
+                    response, messages = None, ''
+                except NodeWorkerTimeout as err:
+                    # Hung, rather than crashed, and likely to hang on the
+                    # same file again
+                    self.stop()
+                    error = 'Compile worker timed out after {0} seconds'
+                    error = error.format(self.timeout)
+                    messages = err.args[0] + self._take_stderr()
+                    break
+                messages = (response or {}).get('output', '') + messages
+                messages += self._take_stderr()
+                if response is not None:
+                    break
+                self.stop()
+        messages = messages.strip()
+        if response is None or not response.get('ok'):
+            if response is not None:
+                error = response.get('error', '')
+            raise subprocess.CalledProcessError(
+                1, self.args + [src_path],
+                output='\n'.join(text for text in (error, messages) if text))
+        return messages
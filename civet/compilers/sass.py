@@ -1,5 +1,5 @@
+from __future__ import absolute_import
 from __future__ import print_function
-import atexit
 import os
 import re
 import subprocess
@@ -8,7 +8,15 @@ import sys
 from distutils.spawn import find_executable
 from django.conf import settings
 
+from civet.compilers.backends import BackendCompileError
+from civet.compilers.backends import BackendUnavailable
+from civet.compilers.backends import InProcessBackend
 from civet.compilers.base_compiler import Compiler
+from civet.compilers.base_compiler import CompilerFSEventHandler
+from civet.compilers.sass_dependencies import is_partial
+from civet.compilers.sass_dependencies import SassDependencyGraph
+from civet.probe_cache import probe
+from civet.readiness import registry as readiness
 from civet.util import collect_src_dst_dir_mappings
 from civet.util import get_shortest_topmost_directories
 from civet.util import raise_error_or_kill
@@ -33,12 +41,125 @@ sass_arguments = getattr(
     settings, 'CIVET_SASS_ARGUMENTS', ())
 
 
+def get_load_paths(args):
+    """Return the directories given with -I/--load-path in sass arguments.
+    """
+    load_paths = []
+    args = list(args)
+    for i, arg in enumerate(args):
+        if arg in ('-I', '--load-path') and i + 1 < len(args):
+            load_paths.append(args[i + 1])
+        elif arg.startswith('--load-path='):
+            load_paths.append(arg.split('=', 1)[1])
+        elif arg.startswith('-I') and len(arg) > 2:
+            load_paths.append(arg[2:])
+    return load_paths
+
+
+def get_output_style(args):
+    """Return the output style given with -t/--style in sass arguments, or
+    None.
+    """
+    output_style = None
+    args = list(args)
+    for i, arg in enumerate(args):
+        if arg in ('-t', '--style') and i + 1 < len(args):
+            output_style = args[i + 1]
+        elif arg.startswith('--style='):
+            output_style = arg.split('=', 1)[1]
+    return output_style
+
+
+class LibsassBackend(InProcessBackend):
+    """Compile stylesheets with the libsass Python package
+    (https://pypi.org/project/libsass/).
+
+    Only the load paths and the output style are taken from
+    settings.CIVET_SASS_ARGUMENTS.
+    """
+    name = 'libsass'
+
+    def __init__(self, compiler):
+        super(LibsassBackend, self).__init__(compiler)
+        try:
+            import sass as libsass
+        except ImportError:
+            raise BackendUnavailable('the libsass package is not installed')
+        self.libsass = libsass
+        self.output_style = get_output_style(sass_arguments)
+
+    def get_version(self):
+        return 'libsass-python {0} (libsass {1})'.format(
+            self.libsass.__version__, self.libsass.libsass_version)
+
+    def compile_source(self, source, src_path, dst_path):
+        # Compiled from the file rather than the source text, since libsass
+        # only writes sourcemaps for files and needs src_path to resolve
+        # relative imports anyway
+        kwargs = {}
+        if self.output_style:
+            kwargs['output_style'] = self.output_style
+        try:
+            return self.libsass.compile(
+                filename=src_path,
+                include_paths=list(
+                    self.compiler.dependency_graph.load_paths),
+                source_map_filename=self.compiler.get_map_path(dst_path),
+                output_filename_hint=dst_path,
+                **kwargs)
+        except (self.libsass.CompileError, IOError, OSError) as err:
+            raise BackendCompileError(str(err))
+
+
+class SassFSEventHandler(CompilerFSEventHandler):
+    """Recompile the entry stylesheets affected by a changed Sass source.
+
+    A change to a partial recompiles every stylesheet that imports it,
+    directly or through other partials, according to the compiler's
+    dependency graph.
+    """
+
+    def compile(self, src_path):
+        # src_path may have been deleted, in which case it is removed from the
+        # graph, but the stylesheets that imported it are still recompiled.
+        self.compiler.dependency_graph.add(src_path)
+        for entry_path in self.compiler.dependency_graph.get_affected_entries(
+                src_path):
+            if self.compile_queue is None or entry_path == src_path:
+                super(SassFSEventHandler, self).compile(entry_path)
+            else:
+                # Queued, so that changes to several partials imported by the
+                # same stylesheet compile it once
+                dst_path = self.get_dst_path(entry_path)
+                if dst_path:
+                    readiness.begin(dst_path)
+                self.compile_queue.put(
+                    (self, 'entry', entry_path), self.compile_entry,
+                    entry_path, dst_path,
+                    group=self.compiler.get_concurrency_group(),
+                    output=dst_path)
+
+    def compile_entry(self, entry_path, dst_path):
+        self.run_compile(
+            super(SassFSEventHandler, self).compile, entry_path, dst_path)
+
+
 class SassCompiler(Compiler):
     name = "Sass"
     executable_setting = 'CIVET_SASS_BIN'
     executable_name = 'sass'
+    event_handler_class = SassFSEventHandler
+    extensions = ('.sass', '.scss')
+    # Needs all files at once to batch them or build the import graph
+    supports_streaming = False
+
+    backend_setting = 'CIVET_SASS_BACKEND'
+    backends = {'libsass': LibsassBackend}
 
     def __init__(self, precompiled_assets_dir, kill_on_error):
+        # Bundler is not needed if Sass is compiled in-process
+        self.backend = self.load_backend(kill_on_error)
+
         # Make sure that CIVET_SASS_BIN and CIVET_BUNDLE_GEMFILE are not both
         # set in settings.
         if (getattr(settings, 'CIVET_SASS_BIN', None) and
@@ -48,36 +169,22 @@ class SassCompiler(Compiler):
                 'at the same time in settings.', file=sys.stderr)
             raise_error_or_kill(kill_on_error)
 
-        if bundle_gemfile:
-            if not find_executable(bundle_bin):
+        if bundle_gemfile and self.backend is None:
+            if not probe(precompiled_assets_dir, 'executable:' + bundle_bin,
+                         lambda: find_executable(bundle_bin),
+                         is_valid=os.path.exists):
                 print(
                     'Your project uses Sass and you have specified a Gemfile '
                     'to be used with Bundler, but "bundle" is not found in '
                     'your PATH.', file=sys.stderr)
                 raise_error_or_kill(kill_on_error)
 
-            # Now, look for the gem `sass`.
-            args = (bundle_bin, 'list')
             env = os.environ.copy()
             env['BUNDLE_GEMFILE'] = bundle_gemfile
-            process = subprocess.Popen(args, stdout=subprocess.PIPE, env=env)
-            stdout, _ = process.communicate()
-            stdout = stdout.decode(sys.getdefaultencoding(), errors='ignore')
-
-            if process.returncode != 0:
-                lines = stdout.split('\n')
-                messages = '\n'.join("    %s" % ln for ln in lines)
-                print(
-                    '"bundle list" failed, exit code = %d, messages:\n%s' % (
-                        process.returncode, messages), file=sys.stderr)
-                raise_error_or_kill(kill_on_error)
-
-            match = BUNDLE_LIST_SASS_FINDER.search(stdout)
-            if not match:
-                print(
-                    'You have specified to use Bundler to run Sass, but '
-                    '"sass" is not included in your bundle.', file=sys.stderr)
-                raise_error_or_kill(kill_on_error)
+            # `bundle list` is slow, so only run it again when the bundle
+            # changes (the probe cache is keyed by the Gemfile.lock mtime)
+            probe(precompiled_assets_dir, 'bundled-sass:' + bundle_gemfile,
+                  lambda: self.check_bundle(env, kill_on_error))
             self.args = [bundle_bin, 'exec', 'sass']
             self.env = env
 
@@ -87,7 +194,11 @@ class SassCompiler(Compiler):
         if not hasattr(self, 'args'):
             self.args = [self.executable]
             self.env = None
+        # The bare command, without arguments
+        self.command = list(self.args)
         self.args.extend(sass_arguments)
+        self.dependency_graph = SassDependencyGraph(
+            get_load_paths(sass_arguments))
 
     def matches(self, base, ext):
         return ext == '.sass' or ext == '.scss'
@@ -95,42 +206,82 @@ class SassCompiler(Compiler):
     def get_dest_path(self, base, ext):
         return os.path.join(self.precompiled_assets_dir, base + '.css')
 
-    def _get_dir_pairs(self, sass_files):
-        # Collect the directories we want to watch
-        dir_map = collect_src_dst_dir_mappings(sass_files)
+    def get_version_command(self):
+        return self.command + ['--version']
+
+    def get_command_with_arguments(self, src_path, dst_path):
+        args = list(self.args)
+        for load_path in self.dependency_graph.load_paths:
+            args.extend(['--load-path', load_path])
+        args.extend([src_path, dst_path])
+        return args
 
-        # sass watch directories recursively, so we can remove children dirs.
-        topmost_dirs = get_shortest_topmost_directories(dir_map)
-        dir_map = {k: dir_map[k] for k in topmost_dirs}
+    def get_dependencies(self, src_path):
+        return self.dependency_graph.get_dependencies(src_path)
 
-        # sass can update and monitor multiple directories with the arguments
-        # in the form of <src_dir_1>:<dst_dir_1> <src_dir_2>:<dst_dir_2> ...
-        return [':'.join(item) for item in dir_map.items()]
+    def check_bundle(self, env, kill_on_error):
+        """Make sure the gem `sass` is in the bundle.
+
+        Returns:
+            True, since it raises or exits otherwise.
+        """
+        args = (bundle_bin, 'list')
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, env=env)
+        stdout, _ = process.communicate()
+        stdout = stdout.decode(sys.getdefaultencoding(), errors='ignore')
 
-    def compile_all(self, sass_files):
-        """Pre-compile Sass source files and watch for changes."""
-        # Block and compile non-existent or newer files first
-        print('Start precompiling Sass files')
-        args = list(self.args)
-        args.append('--update')
-        args.extend(self._get_dir_pairs(sass_files))
-        process = subprocess.Popen(args, env=self.env)
-        process.wait()
         if process.returncode != 0:
-            raise subprocess.CalledProcessError(args[0], process.returncode)
-        print('End precompiling Sass files')
+            lines = stdout.split('\n')
+            messages = '\n'.join("    %s" % ln for ln in lines)
+            print(
+                '"bundle list" failed, exit code = %d, messages:\n%s' % (
+                    process.returncode, messages), file=sys.stderr)
+            raise_error_or_kill(kill_on_error)
 
-    def watch(self, files, observer):
-        # Start watching with a separate process
-        args = list(self.args)
-        args.append('--watch')
-        args.extend(self._get_dir_pairs(files))
-        process = subprocess.Popen(args, env=self.env, close_fds=True)
+        match = BUNDLE_LIST_SASS_FINDER.search(stdout)
+        if not match:
+            print(
+                'You have specified to use Bundler to run Sass, but '
+                '"sass" is not included in your bundle.', file=sys.stderr)
+            raise_error_or_kill(kill_on_error)
+        return True
+
+    def set_sources(self, sass_files):
+        """Build the dependency graph for the given (src, dst) tuples.
+
+        Besides the directories given in settings.CIVET_SASS_ARGUMENTS, the
+        topmost source directories are used as load paths, like
+        `sass --update` does for the directories it is given.
+        """
+        dir_map = collect_src_dst_dir_mappings(sass_files)
+        self.dependency_graph.load_paths = (
+            get_load_paths(sass_arguments) +
+            get_shortest_topmost_directories(list(dir_map)))
+        for src, dst in sass_files:
+            self.dependency_graph.update(src)
+
+    def set_roots(self, roots):
+        # Without the topmost source directories, the static files directories
+        # stand in as load paths
+        self.dependency_graph.load_paths = (
+            get_load_paths(sass_arguments) + list(roots))
+
+    def prepare_source(self, src_path):
+        self.dependency_graph.update_tree(src_path)
+
+    def compile(self, src_path, dst_path):
+        # Partials are only compiled as part of the stylesheets importing them
+        if is_partial(src_path):
+            return False
+        return super(SassCompiler, self).compile(src_path, dst_path)
 
-        # Django's autoreload calls sys.exit() before reloading, and we want to
-        # kill the Sass process we've spawned at that point.
-        def cleanup():
-            process.kill()
+    def submit_all(self, sass_files, pool):
+        self.set_sources(sass_files)
+        super(SassCompiler, self).submit_all(
+            [(src, dst) for src, dst in sass_files if not is_partial(src)],
+            pool)
 
-        atexit.register(cleanup)
-        print("Watching for Sass changes")
+    def watch(self, files, observer, roots=()):
+        if not self.dependency_graph.load_paths:
+            self.set_sources(files)
+        super(SassCompiler, self).watch(files, observer, roots)
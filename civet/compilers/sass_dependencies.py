@@ -0,0 +1,178 @@
+from collections import defaultdict
+import os
+import re
+import threading
+
+
+# Matches the body of @import, @use and @forward rules, up to the end of the
+# statement (`;` in SCSS, end of line in the indented syntax).
+IMPORT_RULE_FINDER = re.compile(r'@(?:import|use|forward)\s+([^;\n]+)')
+
+# Matches the quoted URLs in the body of a rule
+QUOTED_URL_FINDER = re.compile(r'"([^"]+)"|\'([^\']+)\'')
+
+# Matches /* block */ and // line comments. Line comments must be preceded by
+# whitespace so that the // in "http://..." is left alone.
+COMMENT_FINDER = re.compile(r'/\*.*?\*/|(?:^|(?<=\s))//[^\n]*', re.DOTALL)
+
+SASS_EXTENSIONS = ('.scss', '.sass')
+
+
+def is_partial(path):
+    """Return True if path is a Sass partial, which is never compiled alone.
+    """
+    return os.path.basename(path).startswith('_')
+
+
+def parse_imports(source, indented_syntax=False):
+    """Return the names of the stylesheets imported by the given Sass source.
+
+    Plain CSS imports (URLs, url(), media queries and .css files) are left
+    out, since sass does not inline those.
+    """
+    source = COMMENT_FINDER.sub('', source)
+    names = []
+    for match in IMPORT_RULE_FINDER.finditer(source):
+        body = match.group(1).strip()
+        urls = [a or b for a, b in QUOTED_URL_FINDER.findall(body)]
+        if not urls and indented_syntax:
+            # The indented syntax allows unquoted imports
+            urls = [url.strip() for url in body.split(',')]
+        for url in urls:
+            if (not url or url.endswith('.css') or url.startswith('url(')
+                    or '://' in url or url.startswith('sass:')):
+                continue
+            names.append(url)
+    return names
+
+
+class SassDependencyGraph(object):
+    """The @import/@use/@forward graph between Sass sources.
+
+    The graph is kept up to date by calling update() whenever a source is
+    created or modified and remove() when it is deleted. It can then tell
+    which entry stylesheets need recompiling when a partial changes.
+    """
+
+    def __init__(self, load_paths=()):
+        # Directories searched for imports not found next to the importer
+        self.load_paths = list(load_paths)
+        self._lock = threading.Lock()
+        # path -> set of resolved paths it imports
+        self._imports = {}
+        # path -> set of paths that import it
+        self._importers = defaultdict(set)
+        # path -> list of import names that could not be resolved
+        self._unresolved = {}
+
+    def _resolve(self, name, importer_dir):
+        dirname, basename = os.path.split(name)
+        base, ext = os.path.splitext(basename)
+        if ext in SASS_EXTENSIONS:
+            candidates = [basename, '_' + basename]
+        else:
+            candidates = []
+            for extension in SASS_EXTENSIONS:
+                candidates.extend([basename + extension,
+                                   '_' + basename + extension])
+            for extension in SASS_EXTENSIONS:
+                candidates.extend([
+                    os.path.join(basename, 'index' + extension),
+                    os.path.join(basename, '_index' + extension)])
+        for search_dir in [importer_dir] + self.load_paths:
+            for candidate in candidates:
+                path = os.path.join(search_dir, dirname, candidate)
+                if os.path.isfile(path):
+                    return os.path.realpath(path)
+        return None
+
+    def update(self, path):
+        """(Re)parse path and update its outgoing edges.
+        """
+        if not os.path.exists(path):
+            self.remove(path)
+            return
+        with open(path, 'rb') as f:
+            source = f.read().decode('utf-8', 'replace')
+        names = parse_imports(source, path.endswith('.sass'))
+        importer_dir = os.path.dirname(path)
+        imports = set()
+        unresolved = []
+        for name in names:
+            resolved = self._resolve(name, importer_dir)
+            if resolved is None:
+                unresolved.append(name)
+            else:
+                imports.add(resolved)
+        with self._lock:
+            for imported in self._imports.get(path, ()):
+                self._importers[imported].discard(path)
+            self._imports[path] = imports
+            for imported in imports:
+                self._importers[imported].add(path)
+            if unresolved:
+                self._unresolved[path] = unresolved
+            else:
+                self._unresolved.pop(path, None)
+
+    def add(self, path):
+        """Add a newly created source.
+
+        Sources whose imports could not be resolved before are parsed again,
+        in case the new file is what they were looking for.
+        """
+        with self._lock:
+            retry = list(self._unresolved)
+        self.update(path)
+        for importer in retry:
+            if importer != path:
+                self.update(importer)
+
+    def update_tree(self, path):
+        """(Re)parse path and every source it imports, directly or
+        indirectly.
+        """
+        seen = set()
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            self.update(current)
+            with self._lock:
+                pending.extend(self._imports.get(current, ()))
+
+    def remove(self, path):
+        """Remove a deleted source. Its importers keep their edge to it, so
+        that they are still recompiled (and fail) when it goes away.
+        """
+        with self._lock:
+            for imported in self._imports.pop(path, ()):
+                self._importers[imported].discard(path)
+            self._unresolved.pop(path, None)
+
+    def get_dependencies(self, path):
+        """Return every source path imports, directly or indirectly."""
+        with self._lock:
+            return self._walk(path, self._imports)
+
+    def get_affected_entries(self, path):
+        """Return the entry (non-partial) stylesheets that need recompiling
+        when path changes, including path itself if it is an entry.
+        """
+        with self._lock:
+            affected = self._walk(path, self._importers)
+        affected.add(path)
+        return sorted(p for p in affected if not is_partial(p))
+
+    def _walk(self, path, edges):
+        seen = set()
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            for neighbor in edges.get(current, ()):
+                if neighbor not in seen and neighbor != path:
+                    seen.add(neighbor)
+                    pending.append(neighbor)
+        return seen
@@ -0,0 +1,97 @@
+import os
+import threading
+
+from django.conf import settings
+from django.dispatch import receiver
+
+from civet.signals import asset_compiled
+from civet.stats import CompileStats
+from civet.util import JSONFile
+from civet.util import read_json_file
+
+
+ERRORS_FILENAME = '.civet-errors.json'
+
+
+def get_errors_path():
+    return os.path.join(
+        settings.CIVET_PRECOMPILED_ASSET_DIR, ERRORS_FILENAME)
+
+
+def read_compile_errors(path=None):
+    """Return the errors saved by CompileErrorLog, as a dict from source path
+    to a dict with the compiler, returncode, seconds and messages.
+    """
+    return read_json_file(
+        path or get_errors_path(), CompileErrorLog.description) or {}
+
+
+class CompileErrorLog(JSONFile):
+    """The sources that failed the last time they were compiled, with what
+    their compilers printed.
+
+    The log is kept up to date from the asset_compiled signal by whichever
+    process compiles, and saved whenever it changes, so that another process
+    (eg the server next to the runserver sidecar) can show the errors (see
+    civet.middleware.ErrorOverlayMiddleware).
+    """
+
+    description = 'compile errors'
+    dump_options = {'indent': 2, 'sort_keys': True}
+    create_directory = False
+
+    def __init__(self, path):
+        super(CompileErrorLog, self).__init__(path)
+        self._errors = self.load() or {}
+
+    def record(self, src_path, outcome, compiler=None, seconds=0.0,
+               returncode=None, messages=None):
+        with self._lock:
+            if outcome == CompileStats.FAILED:
+                error = {
+                    'compiler': compiler.name if compiler else None,
+                    'returncode': returncode,
+                    'seconds': seconds,
+                    'messages': messages or '',
+                }
+                changed = self._errors.get(src_path) != error
+                self._errors[src_path] = error
+            else:
+                changed = self._errors.pop(src_path, None) is not None
+        if changed:
+            self.save()
+
+    def evict_stale(self):
+        """Forget errors of sources that no longer exist."""
+        with self._lock:
+            stale = [src_path for src_path in self._errors
+                     if not os.path.exists(src_path)]
+            for src_path in stale:
+                del self._errors[src_path]
+        if stale:
+            self.save()
+
+    def get_data(self):
+        return self._errors
+
+
+_error_log = None
+_error_log_lock = threading.Lock()
+
+
+def get_error_log():
+    """Return the CompileErrorLog of this process."""
+    global _error_log
+    with _error_log_lock:
+        if _error_log is None:
+            _error_log = CompileErrorLog(get_errors_path())
+        return _error_log
+
+
+@receiver(asset_compiled, dispatch_uid='civet.diagnostics.record_errors')
+def record_errors(sender, compiler, src_path, outcome, seconds=0.0,
+                  returncode=None, messages=None, **kwargs):
+    if compiler.dry_run:
+        return
+    get_error_log().record(
+        src_path, outcome, compiler, seconds, returncode, messages)
@@ -0,0 +1,108 @@
+import os
+
+from django.contrib.staticfiles.utils import matches_patterns
+
+from civet.util import JSONFile
+
+
+LISTING_CACHE_FILENAME = '.civet-listing.json'
+
+
+class DirectoryListingCache(JSONFile):
+    """Directory listings saved between runs, keyed by directory mtime.
+
+    A directory's mtime changes whenever an entry is added to, removed from or
+    renamed in it, so a saved listing is valid for as long as the mtime is
+    unchanged. Checking it costs one stat() instead of a listdir() plus a
+    stat() for every entry.
+    """
+
+    description = 'listing cache'
+    dump_options = {}
+
+    def __init__(self, precompiled_assets_dir):
+        super(DirectoryListingCache, self).__init__(
+            os.path.join(precompiled_assets_dir, LISTING_CACHE_FILENAME))
+        self._listings = self.load() or {}
+        self._dirty = False
+
+    def listdir(self, path):
+        """Return (dirnames, filenames) in path, like os.walk() does."""
+        mtime = os.stat(path).st_mtime
+        with self._lock:
+            listing = self._listings.get(path)
+        if listing is not None and listing['mtime'] == mtime:
+            return list(listing['dirs']), list(listing['files'])
+        dirnames, filenames = listdir(path)
+        with self._lock:
+            self._listings[path] = {
+                'mtime': mtime,
+                'dirs': dirnames,
+                'files': filenames,
+            }
+            self._dirty = True
+        return list(dirnames), list(filenames)
+
+    def get_data(self):
+        if not self._dirty:
+            return None
+        self._dirty = False
+        return self._listings
+
+
+def listdir(path):
+    """Return (dirnames, filenames) in path. Symlinks to directories are
+    listed as directories, like Django's FileSystemStorage does.
+    """
+    dirnames = []
+    filenames = []
+    for name in sorted(os.listdir(path)):
+        if os.path.isdir(os.path.join(path, name)):
+            dirnames.append(name)
+        else:
+            filenames.append(name)
+    return dirnames, filenames
+
+
+def is_ignored_dir(path, ignore_dirs):
+    """Return True if path contains any of the CIVET_IGNORE_DIRS substrings.
+    """
+    return any(ignored in path for ignored in ignore_dirs)
+
+
+def walk_storage(location, ignore_patterns, ignore_dirs, listing_cache=None):
+    """Yield (relative path, full path) of every file under location.
+
+    This is what django.contrib.staticfiles.utils.get_files() does, except
+    that directories matching ignore_patterns or ignore_dirs are pruned
+    before being descended into, and listings can come from listing_cache.
+    """
+    if is_ignored_dir(location, ignore_dirs):
+        return
+    list_dir = listing_cache.listdir if listing_cache else listdir
+    pending = ['']
+    while pending:
+        relative_dir = pending.pop()
+        full_dir = os.path.join(location, relative_dir)
+        try:
+            dirnames, filenames = list_dir(full_dir)
+        except OSError:
+            # Deleted while we were walking
+            continue
+        for filename in filenames:
+            if matches_patterns(filename, ignore_patterns):
+                continue
+            relative_path = os.path.join(relative_dir, filename)
+            if relative_dir and matches_patterns(
+                    relative_path, ignore_patterns):
+                continue
+            full_path = os.path.join(full_dir, filename)
+            if is_ignored_dir(full_path, ignore_dirs):
+                continue
+            yield relative_path, full_path
+        for dirname in reversed(dirnames):
+            if matches_patterns(dirname, ignore_patterns):
+                continue
+            if is_ignored_dir(os.path.join(full_dir, dirname), ignore_dirs):
+                continue
+            pending.append(os.path.join(relative_dir, dirname))
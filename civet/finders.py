@@ -0,0 +1,169 @@
+from __future__ import print_function
+from collections import defaultdict
+import os
+import subprocess
+import sys
+import threading
+
+from django.contrib.staticfiles import finders
+
+from civet import asset_precompiler
+from civet.asset_precompiler import precompiled_assets_dir
+from civet.build_cache import BuildCache
+from civet.discovery import is_ignored_dir
+from civet.pool import report_errors
+from civet.readiness import registry as readiness
+from civet.scheduler import scheduler
+from civet.util import is_same_path
+
+
+def wait_until_ready(path):
+    """Block while the compiled file at path (or the output a sourcemap at
+    path belongs to) is pending, up to settings.CIVET_READY_TIMEOUT.
+
+    Pending outputs are compiled before the other queued files.
+    """
+    candidates = [path]
+    if path.endswith('.map'):
+        candidates.append(path[:-len('.map')])
+    for candidate in candidates:
+        if readiness.is_pending(candidate):
+            scheduler.request(candidate)
+        if not readiness.wait(candidate):
+            print(
+                'Warning: timed out waiting for {0} to be compiled, serving '
+                'the current file'.format(candidate), file=sys.stderr)
+
+
+class FileSystemFinder(finders.FileSystemFinder):
+    """Django's FileSystemFinder, except that finding a precompiled asset that
+    is about to be (re)compiled waits for the compile to finish.
+
+    Use it instead of django.contrib.staticfiles.finders.FileSystemFinder in
+    settings.STATICFILES_FINDERS, so that a page loaded while Civet is
+    compiling never gets a stale or missing asset.
+    """
+
+    def find_location(self, root, path, prefix=None):
+        if is_same_path(root, precompiled_assets_dir):
+            wait_until_ready(os.path.join(root, os.path.normpath(path)))
+        return super(FileSystemFinder, self).find_location(root, path, prefix)
+
+
+class LazyCompileFinder(finders.BaseFinder):
+    """Compile assets the first time they are requested.
+
+    Given the path of a compiled file (eg js/foo.js), the other finders are
+    asked for a source the compilers would compile to it (eg js/foo.coffee),
+    and the source is compiled if its output is missing or stale. Requests
+    for sourcemaps compile the file they belong to.
+
+    Add it to settings.STATICFILES_FINDERS and set CIVET_LAZY_COMPILE = True,
+    so that runserver does not compile everything on start. List it before
+    the other finders: they would serve a stale output from
+    CIVET_PRECOMPILED_ASSET_DIR, or with the default CIVET_ES6_EXTENSION of
+    '.js', the ES6 source itself, without it being asked.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LazyCompileFinder, self).__init__(*args, **kwargs)
+        self._compilers = None
+        self._lock = threading.Lock()
+        # Output path -> lock, so that concurrent requests compile it once
+        self._compile_locks = defaultdict(threading.Lock)
+
+    def get_compilers(self):
+        with self._lock:
+            if self._compilers is None:
+                build_cache = None
+                if asset_precompiler.use_build_cache:
+                    build_cache = BuildCache(precompiled_assets_dir)
+                compilers = asset_precompiler.create_compilers(
+                    build_cache=build_cache)
+                roots = self.get_roots()
+                for compiler in compilers:
+                    compiler.set_roots(roots)
+                self._compilers = compilers
+            return self._compilers
+
+    def get_other_finders(self):
+        return [finder for finder in finders.get_finders()
+                if not isinstance(finder, LazyCompileFinder)]
+
+    def get_roots(self):
+        """Return the static files directories of the other finders, in the
+        order they search them.
+        """
+        return asset_precompiler.get_source_roots(self.get_other_finders())
+
+    def find_source(self, path):
+        """Return the path of the source at path as found by the other
+        finders, or None.
+        """
+        for finder in self.get_other_finders():
+            for src_path in finder.find(path, all=True):
+                if src_path.startswith(
+                        os.path.join(precompiled_assets_dir, '')):
+                    continue
+                if is_ignored_dir(src_path, asset_precompiler.ignore_dirs):
+                    continue
+                return os.path.realpath(src_path)
+        return None
+
+    def compile(self, path):
+        """Compile the source of the output at path (relative to
+        CIVET_PRECOMPILED_ASSET_DIR) if there is one.
+
+        Returns:
+            True if a source was found and the output is up to date.
+        """
+        base = os.path.splitext(path)[0]
+        dst_path = os.path.join(precompiled_assets_dir, os.path.normpath(path))
+        for compiler in self.get_compilers():
+            # Compilers without extensions cannot be mapped in reverse
+            for src_ext in compiler.extensions or ():
+                if not compiler.matches(base, src_ext):
+                    continue
+                if os.path.normpath(
+                        compiler.get_dest_path(base, src_ext)) != dst_path:
+                    continue
+                src_path = self.find_source(base + src_ext)
+                if src_path is None:
+                    continue
+                with self._compile_locks[dst_path]:
+                    compiler.prepare_source(src_path)
+                    try:
+                        compiler.compile(src_path, dst_path)
+                    except subprocess.CalledProcessError as err:
+                        report_errors([(src_path, err)])
+                        return False
+                    finally:
+                        if compiler.build_cache is not None:
+                            compiler.build_cache.save()
+                return True
+        return False
+
+    def find(self, path, all=False):
+        candidates = [path]
+        if path.endswith('.map'):
+            # eg foo.js.map or foo.css.map, or foo.map for foo.js
+            base = path[:-len('.map')]
+            candidates = [base, os.path.splitext(base)[0] + '.js']
+        matched_path = None
+        for candidate in candidates:
+            if self.compile(candidate):
+                full_path = os.path.join(
+                    precompiled_assets_dir, os.path.normpath(path))
+                # Sourcemaps are rewritten after the compile
+                wait_until_ready(full_path)
+                if os.path.exists(full_path):
+                    matched_path = full_path
+                break
+        if matched_path is None:
+            return []
+        return [matched_path] if all else matched_path
+
+    def list(self, ignore_patterns):
+        # Nothing is compiled ahead of time; collectstatic and
+        # precompile_assets() find the sources through the other finders.
+        return []
@@ -0,0 +1,99 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from civet.asset_precompiler import background_precompile
+from civet.asset_precompiler import compiler_classes
+from civet.asset_precompiler import precompile_assets
+from civet.sidecar import wait_while_parent_runs
+from civet.stats import CompileStats
+
+
+def find_compiler_class(name):
+    """Find a configured Compiler class by class name, display name or
+    executable name (eg "SassCompiler", "Sass" or "sass").
+    """
+    for compiler_class in compiler_classes:
+        names = (compiler_class.__name__, compiler_class.name,
+                 compiler_class.executable_name)
+        if name.lower() in [n.lower() for n in names]:
+            return compiler_class
+    raise CommandError(
+        'Unknown compiler "{0}". Configured compilers are: {1}'.format(
+            name, ', '.join(c.__name__ for c in compiler_classes)))
+
+
+class Command(BaseCommand):
+    help = ('Precompile all Sass, CoffeeScript and ES6 assets, then exit, '
+            'or with --watch keep compiling changed sources.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Number of files to compile at the same time (defaults to '
+                 'settings.CIVET_MAX_WORKERS or the number of CPUs).')
+        parser.add_argument(
+            '--compiler', action='append', dest='compilers', default=[],
+            help='Only run the given compiler (eg "sass", "coffee", '
+                 '"babel"). Can be given more than once.')
+        parser.add_argument(
+            '--dry-run', action='store_true', default=False,
+            help='Only print which files would be compiled.')
+        parser.add_argument(
+            '--force', action='store_true', default=False,
+            help='Recompile all files, even if they are up to date.')
+        parser.add_argument(
+            '--watch', action='store_true', default=False,
+            help='Keep watching for changes and compiling them until '
+                 'interrupted, or until the process that started this one '
+                 'exits. This is how runserver runs Civet.')
+        parser.add_argument(
+            '--profile', type=int, default=0, metavar='N',
+            help='Print the N files that took longest to compile.')
+        parser.add_argument(
+            '--report', default=None, metavar='PATH',
+            help='Write compile times of every file to PATH, as CSV if it '
+                 'ends with .csv or else as JSON (defaults to '
+                 'settings.CIVET_PROFILE_REPORT).')
+
+    def handle(self, *args, **options):
+        classes = [find_compiler_class(name) for name in options['compilers']]
+        start = time.time()
+        try:
+            stats = precompile_assets(
+                watch=options['watch'],
+                classes=classes or None,
+                max_workers=options['workers'],
+                force=options['force'],
+                dry_run=options['dry_run'],
+                report_path=options['report'],
+                background=background_precompile)
+        except AssertionError as err:
+            raise CommandError(str(err))
+        except KeyboardInterrupt:
+            return
+
+        if options['profile']:
+            self.stdout.write('Slowest files:')
+            for record in stats.get_slowest(options['profile']):
+                self.stdout.write(
+                    '{seconds:8.2f}s  {compiler}  {src_path}'.format(
+                        **record._asdict()))
+        for line in stats.get_summary_lines(options['dry_run']):
+            self.stdout.write(line)
+        self.stdout.write(
+            '{verb} {compiled} files, {skipped} up to date, in {seconds:.2f}s'
+            .format(
+                verb='Would compile' if options['dry_run'] else 'Compiled',
+                compiled=stats.total(
+                    CompileStats.WOULD_COMPILE if options['dry_run']
+                    else CompileStats.COMPILED),
+                skipped=stats.total(CompileStats.SKIPPED),
+                seconds=time.time() - start))
+
+        if options['watch']:
+            try:
+                wait_while_parent_runs()
+            except KeyboardInterrupt:
+                pass
@@ -1,10 +1,27 @@
 from django.contrib.staticfiles.management.commands import runserver
 
+from civet import sidecar
+from civet.asset_precompiler import add_precompiled_assets_dir
+from civet.asset_precompiler import lazy_compile
 from civet.asset_precompiler import precompile_and_watch_assets
 
 
 class Command(runserver.Command):
 
+    def run(self, **options):
+        # The autoreloader's process lives as long as runserver, unlike the
+        # server processes it restarts on every change of Python code, so
+        # the sidecar is started there, once.
+        if (sidecar.use_sidecar and not lazy_compile and
+                options['use_reloader'] and
+                sidecar.is_autoreloader_parent() and
+                not sidecar.is_sidecar_running()):
+            sidecar.start_sidecar(options)
+        super(Command, self).run(**options)
+
     def get_handler(self, *args, **options):
-        precompile_and_watch_assets()
+        if sidecar.is_sidecar_running():
+            add_precompiled_assets_dir()
+        else:
+            precompile_and_watch_assets()
         return super(Command, self).get_handler(*args, **options)
@@ -0,0 +1,134 @@
+import hashlib
+import os
+
+from civet.util import JSONFile
+from civet.util import write_file_atomically
+
+
+# The name and format Django's ManifestStaticFilesStorage reads
+MANIFEST_FILENAME = 'staticfiles.json'
+MANIFEST_VERSION = '1.0'
+
+
+class AssetManifest(JSONFile):
+    """Content-hashed copies of compiled assets, and a manifest of them.
+
+    Next to every compiled output (eg js/foo.js) a copy is written whose name
+    includes a hash of its content (eg js/foo.5f1a8c3b9e02.js), the same way
+    Django's ManifestStaticFilesStorage names files. The manifest maps each
+    output's name, relative to CIVET_PRECOMPILED_ASSET_DIR, to its hashed
+    name, and is written in ManifestStaticFilesStorage's format. When an
+    output changes, the copy of its previous content is deleted.
+
+    The manifest is kept in memory and only written by save().
+    """
+
+    description = 'manifest'
+    dump_options = {'indent': 2, 'sort_keys': True}
+
+    def __init__(self, precompiled_assets_dir):
+        super(AssetManifest, self).__init__(
+            os.path.join(precompiled_assets_dir, MANIFEST_FILENAME))
+        self.root = precompiled_assets_dir
+        self._paths = self._load()
+        self._dirty = False
+
+    def _load(self):
+        data = self.load()
+        if not data or data.get('version') != MANIFEST_VERSION:
+            return {}
+        return data.get('paths', {})
+
+    def get_data(self):
+        if not self._dirty:
+            return None
+        self._dirty = False
+        return {
+            'paths': self._paths,
+            'version': MANIFEST_VERSION,
+        }
+
+    def get_name(self, dst_path):
+        """Return the manifest name (a URL path) of an output."""
+        return os.path.relpath(dst_path, self.root).replace(os.sep, '/')
+
+    def get_path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def get_hashed_name(self, name, content):
+        # Same as ManifestStaticFilesStorage.hashed_name()
+        base, ext = os.path.splitext(name)
+        return '{0}.{1}{2}'.format(
+            base, hashlib.md5(content).hexdigest()[:12], ext)
+
+    def get_hashed_names(self):
+        """Return the names of all hashed copies."""
+        with self._lock:
+            return set(self._paths.values())
+
+    def lookup(self, name):
+        """Return the hashed name for an output name, or None."""
+        with self._lock:
+            return self._paths.get(name)
+
+    def add(self, dst_path):
+        """Write the hashed copy of a freshly compiled output and record it.
+        """
+        with open(dst_path, 'rb') as f:
+            content = f.read()
+        name = self.get_name(dst_path)
+        hashed_name = self.get_hashed_name(name, content)
+        hashed_path = self.get_path(hashed_name)
+        if not os.path.exists(hashed_path):
+            write_file_atomically(hashed_path, content, 'wb')
+        with self._lock:
+            previous = self._paths.get(name)
+            self._paths[name] = hashed_name
+            self._dirty = True
+        if previous and previous != hashed_name:
+            self._remove(previous)
+
+    def update(self, dst_paths):
+        """Add the outputs in dst_paths that have no up to date hashed copy,
+        eg because they were compiled before hashing was enabled.
+        """
+        for dst_path in dst_paths:
+            if not os.path.exists(dst_path):
+                continue
+            hashed_name = self.lookup(self.get_name(dst_path))
+            if hashed_name is not None:
+                hashed_path = self.get_path(hashed_name)
+                # Hashed copies are written after their output
+                if (os.path.exists(hashed_path) and
+                        os.path.getmtime(hashed_path) >=
+                        os.path.getmtime(dst_path)):
+                    continue
+            self.add(dst_path)
+
+    def discard(self, dst_path):
+        """Forget an output and delete its hashed copy."""
+        with self._lock:
+            hashed_name = self._paths.pop(self.get_name(dst_path), None)
+            if hashed_name is not None:
+                self._dirty = True
+        if hashed_name is not None:
+            self._remove(hashed_name)
+
+    def evict_stale(self):
+        """Forget outputs that no longer exist and delete their copies."""
+        with self._lock:
+            stale = [(name, hashed_name)
+                     for name, hashed_name in self._paths.items()
+                     if not os.path.exists(self.get_path(name))]
+            for name, _ in stale:
+                del self._paths[name]
+            if stale:
+                self._dirty = True
+        for _, hashed_name in stale:
+            self._remove(hashed_name)
+
+    def _remove(self, hashed_name):
+        try:
+            os.remove(self.get_path(hashed_name))
+        except OSError:
+            pass
@@ -0,0 +1,90 @@
+import os
+import re
+
+from django.conf import settings
+from django.utils.html import escape
+
+from civet.diagnostics import get_errors_path
+from civet.diagnostics import read_compile_errors
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    # Django 1.9 and before
+    MiddlewareMixin = object
+
+
+OVERLAY_TEMPLATE = (
+    '<div id="civet-errors" style="position:fixed;top:0;left:0;right:0;'
+    'max-height:60%;overflow:auto;z-index:2147483647;margin:0;padding:1em;'
+    'background:#300;color:#fdd;font:13px/1.4 monospace;'
+    'box-shadow:0 2px 8px rgba(0,0,0,.5)">'
+    '<button type="button" onclick="this.parentNode.style.display=\'none\'" '
+    'style="float:right">Dismiss</button>'
+    '<strong>{count} asset(s) failed to compile</strong>{errors}</div>'
+)
+
+ERROR_TEMPLATE = (
+    '<p style="margin:1em 0 .25em;color:#fff">{compiler}: {src_path} '
+    '(exit status {returncode})</p>'
+    '<pre style="margin:0;white-space:pre-wrap">{messages}</pre>'
+)
+
+BODY_END_RE = re.compile(br'</body\s*>', re.IGNORECASE)
+
+
+class ErrorOverlayMiddleware(MiddlewareMixin):
+    """Show the assets that currently fail to compile, with what their
+    compilers printed, on top of every HTML page while settings.DEBUG is on.
+
+    The errors are read from the file the compiling process (eg the
+    runserver sidecar) keeps up to date, see civet.diagnostics.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ErrorOverlayMiddleware, self).__init__(*args, **kwargs)
+        self._mtime = None
+        self._errors = {}
+
+    def get_errors(self):
+        path = get_errors_path()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return {}
+        if mtime != self._mtime:
+            self._errors = read_compile_errors(path)
+            self._mtime = mtime
+        return self._errors
+
+    def render_overlay(self, errors):
+        return OVERLAY_TEMPLATE.format(
+            count=len(errors),
+            errors=''.join(
+                ERROR_TEMPLATE.format(
+                    compiler=escape(error.get('compiler') or ''),
+                    src_path=escape(src_path),
+                    returncode=escape(error.get('returncode')),
+                    messages=escape(error.get('messages') or ''))
+                for src_path, error in sorted(errors.items())))
+
+    def process_response(self, request, response):
+        if (not settings.DEBUG or getattr(response, 'streaming', False) or
+                'html' not in response.get('Content-Type', '') or
+                response.has_header('Content-Encoding')):
+            return response
+        errors = self.get_errors()
+        if not errors:
+            return response
+        overlay = self.render_overlay(errors).encode(response.charset)
+        content = response.content
+        matches = list(BODY_END_RE.finditer(content))
+        if matches:
+            index = matches[-1].start()
+            content = content[:index] + overlay + content[index:]
+        else:
+            content += overlay
+        response.content = content
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
+        return response
@@ -0,0 +1,365 @@
+from __future__ import print_function
+import atexit
+import heapq
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from watchdog.events import DirCreatedEvent
+from watchdog.events import DirDeletedEvent
+from watchdog.events import FileCreatedEvent
+from watchdog.events import FileDeletedEvent
+from watchdog.events import FileModifiedEvent
+
+from civet.compile_queue import CompileQueue
+from civet.compilers.base_compiler import RoutingEventHandler
+from civet.discovery import listdir
+
+
+# Seconds between checks of a file or directory that just changed. Checks of
+# entries that do not change back off up to polling_max_interval.
+polling_min_interval = getattr(
+    settings, 'CIVET_POLLING_MIN_INTERVAL', 0.25)
+
+polling_max_interval = getattr(
+    settings, 'CIVET_POLLING_MAX_INTERVAL', 4.0)
+
+# The most entries checked in one pass. When more are due, the rest wait for
+# the next passes, which stretches their intervals instead of taking a core.
+BATCH_SIZE = 500
+
+# Entries modified less than this many seconds before watching starts are
+# assumed to be worked on, and are checked at polling_min_interval from the
+# start
+HOT_AGE = 60 * 60
+
+# Seconds between reports of the poller's CPU use while settings.DEBUG is on
+REPORT_INTERVAL = 5 * 60
+
+# CPU seconds used by the calling thread, where Python can tell (3.7 and up)
+thread_time = getattr(time, 'thread_time', None)
+
+
+class PolledEntry(object):
+    """A file or directory the poller checks, and when to check it next."""
+
+    def __init__(self, path, is_dir, stat_result, interval):
+        self.path = path
+        self.is_dir = is_dir
+        self.signature = get_signature(stat_result)
+        self.interval = interval
+        # When the entry is next checked. Schedule items with another time
+        # are stale.
+        self.due = None
+        # (dirnames, filenames) when last listed, for directories
+        self.listing = None
+
+
+def get_signature(stat_result):
+    # Editors that save by renaming a new file over the old one change the
+    # inode, even when the mtime is too coarse to (eg on some bind mounts)
+    return (stat_result.st_mtime, stat_result.st_size, stat_result.st_ino)
+
+
+class PollingCompilerObserver(object):
+    """Watch source files by polling them, for file systems that do not
+    report changes (eg Docker bind mounts and network file systems).
+
+    Unlike watchdog's PollingObserver, which lists and stats every file under
+    every watched directory once a second, this only checks what discovery
+    found: the sources themselves (for changes to their content) and the
+    directories under the watched roots (for files being added and removed).
+    Each entry is checked at its own interval, from polling_min_interval
+    right after it changed up to polling_max_interval, doubling every time
+    it is found unchanged, so the few files being worked on are picked up
+    quickly while the rest cost little. Due entries are checked together, in
+    path order, in passes at most BATCH_SIZE entries large and at least
+    polling_min_interval apart.
+
+    Changes are dispatched as watchdog events through the same
+    RoutingEventHandler as CompilerObserver's, so compilers see no
+    difference.
+    """
+
+    def __init__(self, ignore_patterns=(), ignore_dirs=(), excluded_dirs=(),
+                 listing_cache=None, min_interval=None, max_interval=None):
+        self.compile_queue = CompileQueue()
+        self.router = RoutingEventHandler(
+            ignore_patterns, ignore_dirs, excluded_dirs)
+        self.listing_cache = listing_cache
+        self.min_interval = min_interval or polling_min_interval
+        self.max_interval = max(
+            max_interval or polling_max_interval, self.min_interval)
+        self._sources = set()
+        self._entries = {}
+        # Heap of (due time, path), see PolledEntry.due
+        self._schedule = []
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stat_count = 0
+
+    def add_route(self, src_dir, handler):
+        """Pass events in src_dir and its subdirectories on to handler."""
+        self.router.add_route(src_dir, handler)
+
+    def add_sources(self, src_paths):
+        """Poll src_paths for changes, as found by discovery."""
+        self._sources.update(src_paths)
+
+    def is_source(self, path):
+        """Return True if a compiler handling path's directory matches it."""
+        return any(
+            handler.compiler.matches(*os.path.splitext(path))
+            for handler in self.router.get_handlers(path))
+
+    def get_initial_interval(self, stat_result, now):
+        if now - stat_result.st_mtime < HOT_AGE:
+            return self.min_interval
+        return self.max_interval
+
+    def track(self, path, is_dir, stat_result, now, interval=None):
+        if interval is None:
+            interval = self.get_initial_interval(stat_result, now)
+            # Spread the first checks of cold entries, so that they do not all
+            # come due at once
+            due = now + random.uniform(0, interval)
+        else:
+            due = now + interval
+        entry = PolledEntry(path, is_dir, stat_result, interval)
+        self._entries[path] = entry
+        self.schedule(entry, due)
+        return entry
+
+    def schedule(self, entry, due):
+        entry.due = due
+        heapq.heappush(self._schedule, (due, entry.path))
+
+    def untrack(self, path):
+        """Stop polling path and, if it is a directory, everything under it.
+        Return the paths of the files that were polled.
+        """
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return []
+        if not entry.is_dir:
+            return [path]
+        prefix = os.path.join(path, '')
+        file_paths = []
+        for other in [p for p in self._entries if p.startswith(prefix)]:
+            if not self._entries.pop(other).is_dir:
+                file_paths.append(other)
+        return sorted(file_paths)
+
+    def remove_directory(self, path):
+        """Stop polling a deleted directory, and tell the handlers about it
+        and the sources in it, like native observers do.
+        """
+        for file_path in self.untrack(path):
+            self.router.dispatch(FileDeletedEvent(file_path))
+        self.router.dispatch(DirDeletedEvent(path))
+
+    def list_directory(self, path, use_cache=False):
+        if use_cache and self.listing_cache is not None:
+            return self.listing_cache.listdir(path)
+        return listdir(path)
+
+    def track_tree(self, root, now, use_cache=False, interval=None):
+        """Track root and the directories under it that are not ignored, and
+        the sources in them.
+        """
+        pending = [root]
+        while pending:
+            path = pending.pop()
+            try:
+                stat_result = os.stat(path)
+                dirnames, filenames = self.list_directory(path, use_cache)
+            except OSError:
+                # Deleted while we were walking
+                continue
+            self.stat_count += 1
+            entry = self.track(path, True, stat_result, now, interval)
+            entry.listing = (dirnames, filenames)
+            for filename in filenames:
+                file_path = os.path.join(path, filename)
+                if self.router.is_ignored(file_path):
+                    continue
+                if file_path in self._sources or self.is_source(file_path):
+                    self.track_file(file_path, now, interval)
+            for dirname in dirnames:
+                dir_path = os.path.join(path, dirname)
+                if not self.router.is_ignored(dir_path):
+                    pending.append(dir_path)
+
+    def track_file(self, path, now, interval=None):
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return
+        self.stat_count += 1
+        self.track(path, False, stat_result, now, interval)
+
+    def start(self):
+        now = time.time()
+        for root in self.router.get_roots():
+            self.track_tree(root, now, use_cache=True)
+        if self.listing_cache is not None:
+            self.listing_cache.save()
+        # Sources outside of the roots' directories are still polled
+        for src_path in self._sources:
+            if src_path not in self._entries:
+                self.track_file(src_path, now)
+        directory_count = sum(
+            1 for entry in self._entries.values() if entry.is_dir)
+        print('Polling {0} files and {1} directories for changes every '
+              '{2} to {3} seconds'.format(
+                  len(self._entries) - directory_count, directory_count,
+                  self.min_interval, self.max_interval))
+
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+        # Stop the poller when Django's autoreload calls sys.exit() before
+        # reloading
+        def cleanup():
+            self.stop()
+            self.compile_queue.stop()
+
+        atexit.register(cleanup)
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        last_report = time.time()
+        last_cpu = thread_time() if thread_time else None
+        last_stat_count = self.stat_count
+        while not self._stopped.is_set():
+            started = time.time()
+            try:
+                self.poll_due()
+            except Exception:
+                # Keep polling, like the compile queue keeps compiling
+                print('Error polling for changes:', file=sys.stderr)
+                traceback.print_exc()
+            now = time.time()
+            if settings.DEBUG and now - last_report >= REPORT_INTERVAL:
+                cpu = thread_time() if thread_time else None
+                self.report(now - last_report, self.stat_count -
+                            last_stat_count, last_cpu, cpu)
+                last_report, last_cpu = now, cpu
+                last_stat_count = self.stat_count
+            if self._schedule:
+                delay = self._schedule[0][0] - time.time()
+            else:
+                delay = self.max_interval
+            # Passes are at least min_interval apart, so that entries coming
+            # due in between are checked together
+            delay = max(delay, started + self.min_interval - time.time())
+            if delay > 0:
+                self._stopped.wait(min(delay, self.max_interval))
+
+    def report(self, seconds, stat_count, start_cpu, end_cpu):
+        cpu = ''
+        if start_cpu is not None:
+            cpu = ', using {0:.2%} of a CPU'.format(
+                (end_cpu - start_cpu) / seconds)
+        print('Checked {0} polled paths in the last {1:.0f} seconds{2}'.format(
+            stat_count, seconds, cpu))
+
+    def poll_due(self):
+        """Check the entries that are due, at most BATCH_SIZE of them."""
+        now = time.time()
+        due = []
+        while (self._schedule and self._schedule[0][0] <= now
+               and len(due) < BATCH_SIZE):
+            due_time, path = heapq.heappop(self._schedule)
+            entry = self._entries.get(path)
+            # Skip entries untracked or rescheduled since
+            if entry is not None and entry.due == due_time:
+                due.append(entry)
+        # Neighbouring entries one after the other, which is kinder to the
+        # caches of network file systems
+        for entry in sorted(due, key=lambda entry: entry.path):
+            path = entry.path
+            if self._entries.get(path) is not entry:
+                # Untracked by the check of its directory
+                continue
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                stat_result = None
+            self.stat_count += 1
+            if entry.is_dir:
+                changed = self.check_directory(entry, stat_result, now)
+            else:
+                changed = self.check_file(entry, stat_result, now)
+            if self._entries.get(path) is not entry:
+                continue
+            if changed:
+                entry.interval = self.min_interval
+            else:
+                entry.interval = min(entry.interval * 2, self.max_interval)
+            self.schedule(entry, now + entry.interval)
+
+    def check_file(self, entry, stat_result, now):
+        if stat_result is None:
+            # Deleted or renamed away: its directory tells which
+            self.untrack(entry.path)
+            self.check_parent_soon(entry.path, now)
+            return True
+        signature = get_signature(stat_result)
+        if signature == entry.signature:
+            return False
+        entry.signature = signature
+        self.router.dispatch(FileModifiedEvent(entry.path))
+        return True
+
+    def check_parent_soon(self, path, now):
+        parent = self._entries.get(os.path.dirname(path))
+        if parent is not None:
+            self.schedule(parent, now)
+
+    def check_directory(self, entry, stat_result, now):
+        if stat_result is None:
+            self.remove_directory(entry.path)
+            self.check_parent_soon(entry.path, now)
+            return True
+        signature = get_signature(stat_result)
+        if signature == entry.signature:
+            return False
+        entry.signature = signature
+        try:
+            dirnames, filenames = self.list_directory(entry.path)
+        except OSError:
+            return True
+        old_dirnames, old_filenames = entry.listing
+        entry.listing = (dirnames, filenames)
+
+        for filename in sorted(set(old_filenames) - set(filenames)):
+            path = os.path.join(entry.path, filename)
+            self.untrack(path)
+            self.router.dispatch(FileDeletedEvent(path))
+        for dirname in sorted(set(old_dirnames) - set(dirnames)):
+            path = os.path.join(entry.path, dirname)
+            if path in self._entries:
+                self.remove_directory(path)
+        for filename in sorted(set(filenames) - set(old_filenames)):
+            path = os.path.join(entry.path, filename)
+            if self.router.is_ignored(path):
+                continue
+            if self.is_source(path):
+                self.track_file(path, now, self.min_interval)
+            self.router.dispatch(FileCreatedEvent(path))
+        for dirname in sorted(set(dirnames) - set(old_dirnames)):
+            path = os.path.join(entry.path, dirname)
+            if self.router.is_ignored(path):
+                continue
+            self.track_tree(path, now, interval=self.min_interval)
+            # Handlers compile the sources already in it
+            self.router.dispatch(DirCreatedEvent(path))
+        return True
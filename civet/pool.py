@@ -0,0 +1,212 @@
+from __future__ import print_function
+from collections import defaultdict
+import heapq
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+
+from django.conf import settings
+
+from civet.scheduler import CompileCancelled
+from civet.scheduler import scheduler
+from civet.util import indent_messages
+
+
+def get_max_workers():
+    """Return the number of compile jobs allowed to run at the same time.
+
+    Uses settings.CIVET_MAX_WORKERS if given, otherwise the CPU count.
+    """
+    max_workers = getattr(settings, 'CIVET_MAX_WORKERS', None)
+    if max_workers is None:
+        try:
+            max_workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            max_workers = 1
+    return max(1, int(max_workers))
+
+
+class PoolJob(object):
+    """A job queued on a CompilePool."""
+
+    def __init__(self, description, func, args, kwargs, group, outputs):
+        self.description = description
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.group = group
+        self.outputs = [os.path.normpath(path) for path in outputs]
+        # Set once a worker took the job, since a promoted job is in its
+        # group's queue twice
+        self.taken = False
+
+
+class CompilePool(object):
+    """A bounded pool of threads running compile jobs.
+
+    Compilers spend nearly all of their time waiting on a `coffee`, `babel` or
+    `sass` subprocess, so plain threads are enough to keep every core busy.
+    Errors raised by jobs are collected instead of aborting the pool, so that
+    every failing file can be reported at the end of the run.
+
+    Jobs with a lower priority run first, jobs with the same priority in the
+    order they were submitted. Jobs compiling to an output requested through
+    civet.scheduler run before all others, and jobs of a compiler that is
+    at its limit (see civet.scheduler.compiler_max_workers) wait for one of
+    its jobs to finish while the jobs of other compilers run.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or get_max_workers()
+        # Group -> heap of (priority, order, PoolJob)
+        self._queues = defaultdict(list)
+        # Output path -> queued PoolJobs compiling to it
+        self._jobs_by_output = defaultdict(list)
+        self._order = itertools.count()
+        self._unfinished = 0
+        self._stopping = False
+        self._errors = []
+        self._condition = threading.Condition()
+        self._threads = []
+        scheduler.add_listener(self)
+        for _ in range(self.max_workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, description, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) to run on one of the workers.
+
+        Args:
+            description: What the job is working on (usually the source path),
+                used when reporting errors.
+        """
+        self.submit_with_priority(0, description, func, *args, **kwargs)
+
+    def submit_with_priority(self, priority, description, func, *args,
+                             **kwargs):
+        """Queue func(*args, **kwargs) to run before the queued jobs with a
+        higher priority.
+        """
+        self.submit_job(priority, description, func, args, kwargs)
+
+    def submit_job(self, priority, description, func, args=(), kwargs=None,
+                   group=None, outputs=()):
+        """Queue func(*args, **kwargs) like submit_with_priority().
+
+        Args:
+            group: The executable name of the compiler running the job, whose
+                limit it counts against, if any.
+            outputs: The paths the job compiles to. The job runs first when
+                any of them is requested, and can be cancelled by compiling
+                any of them again (see civet.scheduler).
+        """
+        job = PoolJob(description, func, args, kwargs or {}, group, outputs)
+        with self._condition:
+            heapq.heappush(
+                self._queues[group], (priority, next(self._order), job))
+            for path in job.outputs:
+                self._jobs_by_output[path].append(job)
+            self._unfinished += 1
+            self._condition.notify()
+
+    def wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def promote(self, path):
+        with self._condition:
+            for job in self._jobs_by_output.get(path, ()):
+                heapq.heappush(self._queues[job.group], (
+                    float('-inf'), next(self._order), job))
+            self._condition.notify()
+
+    def _next_job(self):
+        # Must be called with the condition held. Returns the first queued
+        # job whose group has a free slot, or None.
+        heads = []
+        for group, jobs in self._queues.items():
+            while jobs and jobs[0][2].taken:
+                heapq.heappop(jobs)
+            if jobs:
+                heads.append((jobs[0], group))
+        for (_, _, job), group in sorted(heads, key=lambda head: head[0][:2]):
+            if scheduler.acquire(group):
+                heapq.heappop(self._queues[group])
+                job.taken = True
+                for path in job.outputs:
+                    self._jobs_by_output[path].remove(job)
+                    if not self._jobs_by_output[path]:
+                        del self._jobs_by_output[path]
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    if self._stopping and not self._unfinished:
+                        return
+                    self._condition.wait()
+            try:
+                with scheduler.running(job.outputs):
+                    job.func(*job.args, **job.kwargs)
+            except CompileCancelled:
+                # Whoever compiles the outputs again reports them
+                print('Cancelled compiling {0}'.format(job.description))
+            except Exception as err:
+                with self._condition:
+                    self._errors.append((job.description, err))
+            finally:
+                scheduler.release(job.group)
+                with self._condition:
+                    self._unfinished -= 1
+                    self._condition.notify_all()
+
+    def wait(self):
+        """Block until all queued jobs are done.
+
+        Returns:
+            A list of (description, exception) tuples for the jobs that failed
+            since the last call to wait().
+        """
+        with self._condition:
+            while self._unfinished:
+                self._condition.wait()
+            errors, self._errors = self._errors, []
+        return errors
+
+    def shutdown(self):
+        """Wait for queued jobs and stop the worker threads.
+
+        Returns:
+            The same as wait().
+        """
+        errors = self.wait()
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        scheduler.remove_listener(self)
+        return errors
+
+
+def report_errors(errors):
+    """Print every (description, exception) tuple returned by a CompilePool,
+    sorted by description, each followed by what the compiler printed.
+    """
+    for description, err in sorted(errors, key=lambda error: error[0]):
+        print('Error compiling {0}: {1}'.format(description, err),
+              file=sys.stderr)
+        # Set on subprocess.CalledProcessError by civet.util.run_process()
+        output = getattr(err, 'output', None)
+        if output:
+            print(indent_messages(output), file=sys.stderr)
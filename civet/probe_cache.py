@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import threading
+
+from django.conf import settings
+
+from civet.util import JSONFile
+
+
+PROBE_CACHE_FILENAME = '.civet-probe.json'
+
+# Whether to remember executable lookups, `bundle list` and compiler versions
+# between runs, so that autoreload restarts do not repeat them.
+use_probe_cache = getattr(
+    settings, 'CIVET_PROBE_CACHE', True)
+
+
+def get_environment_key():
+    """Return a hash of everything a probe result may depend on besides its
+    own name: PATH and the Gemfile.lock of CIVET_BUNDLE_GEMFILE.
+    """
+    environment = [os.environ.get('PATH', '')]
+    gemfile = getattr(settings, 'CIVET_BUNDLE_GEMFILE', None)
+    if gemfile:
+        try:
+            lock_mtime = os.path.getmtime(gemfile + '.lock')
+        except OSError:
+            lock_mtime = None
+        environment.extend([gemfile, lock_mtime])
+    return hashlib.sha1(json.dumps(environment).encode('utf-8')).hexdigest()
+
+
+class ProbeCache(JSONFile):
+    """Results of probing the environment, saved between runs.
+
+    Each result is stored under a name that includes whatever the probe was
+    given (eg the executable name looked up, or the version command and the
+    executable's mtime). All results are dropped when the environment key
+    changes. Empty results (eg an executable that was not found) are not
+    stored, so that fixing the environment takes effect right away.
+    """
+
+    description = 'probe cache'
+    create_directory = False
+
+    def __init__(self, precompiled_assets_dir):
+        super(ProbeCache, self).__init__(
+            os.path.join(precompiled_assets_dir, PROBE_CACHE_FILENAME))
+        self.environment_key = get_environment_key()
+        self._results = self._load()
+
+    def _load(self):
+        data = self.load()
+        if not data or data.get('environment') != self.environment_key:
+            return {}
+        return data.get('results', {})
+
+    def get_data(self):
+        return {
+            'environment': self.environment_key,
+            'results': self._results,
+        }
+
+    def get(self, name, compute, is_valid=None):
+        """Return the saved result for name, or call compute() for it.
+
+        Args:
+            name: A string identifying the probe and its inputs.
+            compute: A callable returning a JSON-serializable result.
+            is_valid: An optional callable telling whether a saved result can
+                still be used (eg whether an executable still exists).
+        """
+        with self._lock:
+            result = self._results.get(name)
+        if result and (is_valid is None or is_valid(result)):
+            return result
+        result = compute()
+        if result:
+            with self._lock:
+                self._results[name] = result
+            self.save()
+        return result
+
+
+_probe_caches = {}
+_probe_caches_lock = threading.Lock()
+
+
+def probe(precompiled_assets_dir, name, compute, is_valid=None):
+    """Return ProbeCache.get(name, compute, is_valid) of the probe cache kept
+    in precompiled_assets_dir, or just compute() if the cache is disabled.
+
+    The cache is loaded once per process.
+    """
+    if not use_probe_cache:
+        return compute()
+    with _probe_caches_lock:
+        cache = _probe_caches.get(precompiled_assets_dir)
+        if cache is None:
+            cache = ProbeCache(precompiled_assets_dir)
+            _probe_caches[precompiled_assets_dir] = cache
+    return cache.get(name, compute, is_valid)
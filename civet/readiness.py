@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+# Seconds a request for a compiled asset waits for a pending compile of it to
+# finish before the current (stale or missing) file is served.
+ready_timeout = getattr(
+    settings, 'CIVET_READY_TIMEOUT', 30)
+
+
+class ReadinessRegistry(object):
+    """The compiled files that are about to be (re)written.
+
+    precompile_assets() marks every output it is going to look at as pending
+    before compiling, and the watcher does the same for the outputs of changed
+    sources while their compile is queued. Compilers mark outputs done as they
+    report them (see Compiler.record()). Requests for pending outputs wait
+    until they are done (see civet.finders).
+
+    Marks can be given an owner, so that whoever began them can end those
+    that nobody reported on (see end_owned()).
+    """
+
+    def __init__(self):
+        # Pending path -> owners of its marks
+        self._pending = {}
+        self._condition = threading.Condition()
+
+    def begin(self, dst_path, owner=None):
+        """Mark dst_path as pending."""
+        with self._condition:
+            self._pending.setdefault(
+                os.path.normpath(dst_path), set()).add(owner)
+
+    def end(self, dst_path):
+        """Mark dst_path as done, whoever began it."""
+        with self._condition:
+            self._pending.pop(os.path.normpath(dst_path), None)
+            self._condition.notify_all()
+
+    def end_owned(self, owner):
+        """Drop the marks begun by owner, and mark the paths nobody else
+        began as done.
+        """
+        with self._condition:
+            for dst_path, owners in list(self._pending.items()):
+                owners.discard(owner)
+                if not owners:
+                    del self._pending[dst_path]
+            self._condition.notify_all()
+
+    def is_pending(self, dst_path):
+        with self._condition:
+            return os.path.normpath(dst_path) in self._pending
+
+    def wait(self, dst_path, timeout=None):
+        """Block until dst_path is not pending, for at most timeout seconds
+        (settings.CIVET_READY_TIMEOUT by default).
+
+        Returns:
+            True if dst_path is done, False if the wait timed out.
+        """
+        dst_path = os.path.normpath(dst_path)
+        deadline = time.time() + (ready_timeout if timeout is None
+                                  else timeout)
+        with self._condition:
+            while dst_path in self._pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+
+# The registry shared by all compilers and finders in the process
+registry = ReadinessRegistry()
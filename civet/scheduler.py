@@ -0,0 +1,202 @@
+import atexit
+from collections import defaultdict
+from contextlib import contextmanager
+import os
+import signal
+import threading
+
+from django.conf import settings
+
+
+# The most compile jobs of a compiler that run at the same time, by executable
+# name (eg {'babel': 2}), on top of CIVET_MAX_WORKERS. Useful for compilers
+# that take a lot of memory per process.
+compiler_max_workers = getattr(
+    settings, 'CIVET_COMPILER_MAX_WORKERS', {})
+
+
+class CompileCancelled(Exception):
+    """Raised in a compile job whose output is being compiled again, eg
+    because its source changed while it was compiling.
+    """
+
+
+class Cancellation(object):
+    """Lets another thread cancel a running compile job, killing the compiler
+    processes it waits on (see civet.util.run_process()).
+
+    Jobs compiling in-process or with a persistent worker cannot be
+    interrupted, and run to the end.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            processes = list(self._processes)
+        for process in processes:
+            kill(process)
+
+    def attach(self, process):
+        """Kill process if the job is cancelled before process is done."""
+        with self._lock:
+            if not self.cancelled:
+                self._processes.add(process)
+                return
+        kill(process)
+
+    def detach(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def check(self):
+        """Raise CompileCancelled if the job was cancelled."""
+        if self.cancelled:
+            raise CompileCancelled()
+
+
+def kill(process):
+    """Kill process and, where there are process groups, the processes it
+    started (civet.util.run_process() starts it in a session of its own).
+    """
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        # Already exited
+        pass
+
+
+class CompileScheduler(object):
+    """What the compile pools and queues of a process share.
+
+    - Slots limiting how many jobs of each compiler run at the same time
+      across all of them (see compiler_max_workers).
+    - The Cancellations of running jobs by output path, so that compiling an
+      output again cancels the job still compiling its old source.
+    - Requests for outputs (eg by civet.finders while a browser waits for
+      them), which pools and queues run before their other jobs.
+
+    Pools and queues register themselves with add_listener(), to be woken
+    up when a slot is released and told about requested outputs.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(compiler_max_workers if limits is None
+                           else limits)
+        self._lock = threading.Lock()
+        self._running_counts = defaultdict(int)
+        # Output path -> Cancellations of the jobs compiling it
+        self._cancellations = defaultdict(list)
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Call listener.wake() when a slot is released, and
+        listener.promote(path) when the output at path is requested.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def get_listeners(self):
+        with self._lock:
+            return list(self._listeners)
+
+    def acquire(self, group):
+        """Take a slot for a job of group (an executable name, or None for
+        jobs without a limit) if one is free.
+
+        Returns:
+            True if the job may run, False if it has to wait for a slot.
+        """
+        limit = self.limits.get(group)
+        with self._lock:
+            if limit is not None and self._running_counts[group] >= limit:
+                return False
+            self._running_counts[group] += 1
+        return True
+
+    def release(self, group):
+        with self._lock:
+            self._running_counts[group] -= 1
+            limited = group in self.limits
+        if limited:
+            for listener in self.get_listeners():
+                listener.wake()
+
+    @contextmanager
+    def running(self, outputs):
+        """Run a job compiling to outputs in the calling thread, so that it
+        can be cancelled through cancel() on any of them.
+        """
+        cancellation = Cancellation()
+        outputs = [os.path.normpath(path) for path in outputs]
+        with self._lock:
+            for path in outputs:
+                self._cancellations[path].append(cancellation)
+        previous = get_cancellation()
+        _local.cancellation = cancellation
+        try:
+            yield cancellation
+        finally:
+            _local.cancellation = previous
+            with self._lock:
+                for path in outputs:
+                    cancellations = self._cancellations[path]
+                    cancellations.remove(cancellation)
+                    if not cancellations:
+                        del self._cancellations[path]
+
+    def cancel(self, path):
+        """Cancel the running jobs compiling to path."""
+        with self._lock:
+            cancellations = list(
+                self._cancellations.get(os.path.normpath(path), ()))
+        for cancellation in cancellations:
+            cancellation.cancel()
+
+    def cancel_all(self):
+        """Cancel every running job.
+
+        Called when the process exits (eg on Ctrl-C), since the compiler
+        processes run in sessions of their own, which do not get the signals
+        of the terminal, and would keep running otherwise.
+        """
+        with self._lock:
+            cancellations = set(
+                cancellation
+                for cancellations in self._cancellations.values()
+                for cancellation in cancellations)
+        for cancellation in cancellations:
+            cancellation.cancel()
+
+    def request(self, path):
+        """Run the queued job compiling to path before the others."""
+        path = os.path.normpath(path)
+        for listener in self.get_listeners():
+            listener.promote(path)
+
+
+_local = threading.local()
+
+
+def get_cancellation():
+    """Return the Cancellation of the job running in the calling thread, or
+    None.
+    """
+    return getattr(_local, 'cancellation', None)
+
+
+# The scheduler shared by all pools and queues in the process
+scheduler = CompileScheduler()
+atexit.register(scheduler.cancel_all)
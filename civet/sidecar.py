@@ -0,0 +1,126 @@
+from __future__ import print_function
+import atexit
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from civet.util import raise_error_or_kill
+
+
+# Set in the environment of runserver's processes while a sidecar compiles
+# their assets, to the sidecar's process id.
+SIDECAR_PID_ENV = 'CIVET_SIDECAR_PID'
+
+# Set by Django's autoreloader in the server processes it starts, and not in
+# the autoreloader itself.
+RUN_MAIN_ENV = 'RUN_MAIN'
+
+# Whether `runserver` compiles and watches assets in a process of its own,
+# started once by the autoreloader, instead of in the server process, which
+# starts over on every change of Python code. Off by default, since the
+# server process then cannot wait for compiles (civet.finders) or have the
+# assets it is asked for compiled first.
+use_sidecar = getattr(
+    settings, 'CIVET_SIDECAR', False)
+
+
+def is_autoreloader_parent():
+    """Return whether this is the process of Django's autoreloader that
+    starts and restarts the server processes.
+    """
+    return os.environ.get(RUN_MAIN_ENV) != 'true'
+
+
+def is_sidecar_running():
+    """Return whether assets are compiled by a sidecar for this process."""
+    return SIDECAR_PID_ENV in os.environ
+
+
+def get_sidecar_command(options):
+    """Return the command running `civet_precompile --watch` with the same
+    settings as the runserver command given options.
+
+    The command starts Django the way this process was started, like the
+    autoreloader's child processes are (eg `python -m django`, or
+    `django-admin` on Windows, where it is an .exe).
+    """
+    args = [sys.executable]
+    args.extend('-W%s' % o for o in sys.warnoptions)
+    command = ['civet_precompile', '--watch']
+    if options.get('settings'):
+        command.append('--settings=%s' % options['settings'])
+    if options.get('pythonpath'):
+        command.append('--pythonpath=%s' % options['pythonpath'])
+
+    import __main__
+    spec = getattr(__main__, '__spec__', None)
+    script = sys.argv[0]
+    if spec is not None:
+        # Started with `python -m`
+        name = spec.name
+        if (name == '__main__' or name.endswith('.__main__')) and spec.parent:
+            name = spec.parent
+        return args + ['-m', name] + command
+    if not os.path.exists(script):
+        # Entry points on Windows
+        exe_entrypoint = os.path.splitext(script)[0] + '.exe'
+        if os.path.exists(exe_entrypoint):
+            return [exe_entrypoint] + command
+        script_entrypoint = script + '-script.py'
+        if os.path.exists(script_entrypoint):
+            return args + [script_entrypoint] + command
+        raise RuntimeError('Script {0} does not exist.'.format(script))
+    return args + [script] + command
+
+
+def start_sidecar(options):
+    """Start `civet_precompile --watch` next to the server processes.
+
+    The sidecar is told about in the environment the server processes inherit
+    (see is_sidecar_running()), stopped when this process exits, and if it
+    fails (eg the first compile has errors), this process is stopped too.
+
+    Args:
+        options: The options of the runserver command.
+    """
+    process = subprocess.Popen(get_sidecar_command(options))
+    os.environ[SIDECAR_PID_ENV] = str(process.pid)
+    stopping = []
+
+    def stop():
+        stopping.append(True)
+        if process.poll() is None:
+            process.terminate()
+            process.wait()
+    atexit.register(stop)
+
+    def monitor():
+        returncode = process.wait()
+        if stopping or returncode == 0:
+            return
+        print(
+            'Asset compiler exited with code {0}, stopping runserver'.format(
+                returncode), file=sys.stderr)
+        raise_error_or_kill(True)
+
+    thread = threading.Thread(target=monitor)
+    thread.daemon = True
+    thread.start()
+    return process
+
+
+def wait_while_parent_runs(interval=1):
+    """Block until the process that started this one exits, or forever if
+    its exit cannot be told.
+    """
+    get_ppid = getattr(os, 'getppid', None)
+    parent_pid = get_ppid() if get_ppid else None
+    while True:
+        time.sleep(interval)
+        # Orphans are adopted by another process
+        if parent_pid is not None and get_ppid() != parent_pid:
+            return
@@ -0,0 +1,17 @@
+from django.dispatch import Signal
+
+
+# Sent by a Compiler for every source file it has looked at, from whichever
+# thread handled the file. Arguments (besides sender, the Compiler class):
+#
+#     compiler: The Compiler instance
+#     src_path: The source file
+#     dst_path: The compiled file (which may not exist if compiling failed)
+#     outcome: One of civet.stats.CompileStats.COMPILED, SKIPPED or FAILED,
+#         or WOULD_COMPILE for stale files in a dry run
+#     seconds: Wall time spent compiling the file
+#     returncode: The compiler's exit status, or None if it was not run
+#     output_size: Size of the compiled file in bytes, or None
+#     messages: What the compiler printed (eg errors or warnings) as text, or
+#         None if it was not run
+asset_compiled = Signal()
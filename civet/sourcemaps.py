@@ -0,0 +1,181 @@
+from __future__ import print_function
+import json
+import os
+import re
+import sys
+import threading
+
+from django.conf import settings
+from django.utils.six.moves import queue
+
+from civet.readiness import registry as readiness
+from civet.util import open_atomically
+
+
+# Whether to rewrite the sourcemaps written by the `coffee` and `babel`
+# executables, so that they refer to their sources the way staticfiles serves
+# them (see rewrite_sourcemap()).
+rewrite_sourcemaps = getattr(
+    settings, 'CIVET_REWRITE_SOURCEMAPS', True)
+
+# The sourceRoot and sources keys come before the (large) mappings and
+# sourcesContent in the maps of coffee and babel, so only this much of a map
+# is parsed, and the rest is copied.
+HEAD_SIZE = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+_JSON_STRING = br'"(?:[^"\\]|\\.)*"'
+SOURCE_ROOT_RE = re.compile(
+    br'"sourceRoot"\s*:\s*(?:' + _JSON_STRING + br'|null)')
+SOURCES_RE = re.compile(
+    br'"sources"\s*:\s*\[\s*(?:' + _JSON_STRING + br'\s*,?\s*)*\]')
+
+# Keys that, found after the head, mean the head cannot be rewritten alone.
+# Quotes inside JSON strings are escaped, so these only match keys.
+LATE_KEYS = (b'"sourceRoot"', b'"sources"', b'"sections"')
+OVERLAP_SIZE = max(len(key) for key in LATE_KEYS) - 1
+
+
+class SourcemapRewriteError(Exception):
+    """Raised when the head of a sourcemap cannot be rewritten on its own."""
+
+
+def rewrite_head(head, sources):
+    """Return head with sourceRoot set to "" and sources set to the JSON
+    array sources.
+
+    Raises:
+        SourcemapRewriteError: If head does not contain the sources key.
+    """
+    if b'"sections"' in head:
+        raise SourcemapRewriteError('index maps are not rewritten in place')
+    head, count = SOURCES_RE.subn(b'"sources":' + sources, head, count=1)
+    if not count:
+        raise SourcemapRewriteError('no sources key in the head')
+    head, count = SOURCE_ROOT_RE.subn(b'"sourceRoot":""', head, count=1)
+    if not count and b'"sourceRoot"' in head:
+        raise SourcemapRewriteError('sourceRoot is cut off by the head')
+    return head
+
+
+def copy_checking_keys(src, dst, overlap=b''):
+    """Copy the rest of file src to file dst, making sure none of LATE_KEYS
+    is in it.
+
+    Args:
+        overlap: The end of what was read from src before (as much as the
+            longest key but one byte), so that keys split between it and the
+            rest are found.
+    """
+    keep = len(overlap)
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        window = overlap + chunk
+        for key in LATE_KEYS:
+            if key in window:
+                raise SourcemapRewriteError(
+                    '{0} after the head'.format(key.decode('ascii')))
+        dst.write(chunk)
+        overlap = window[-keep:]
+
+
+def rewrite_sourcemap(map_path, src_path):
+    """Make the sourcemap at map_path refer to src_path by basename.
+
+    Compilers that write to a directory other than their source's write
+    sourceRoot and sources relative to it, which are not valid paths from
+    Django static file finder's point of view. For example, if the JS file is
+    at
+
+        /static/myapp/js/foo.js
+
+    and the actual source lives in
+
+        <source root>/myapp/static/myapp/js/foo.coffee
+
+    sourceRoot and sources in the map are:
+
+        {
+            "sourceRoot": "../../..",
+            "sources": ["myapp/static/myapp/js/foo.coffee"]
+        }
+
+    which would make the browser fetch /myapp/static/myapp/js/foo.coffee.
+    Without the relative references, the browser fetches
+    /static/myapp/js/foo.coffee, which Django's static finders find.
+
+    The sourceRoot and sources keys are replaced in the head of the map, and
+    the rest is copied as is, without parsing the whole map. Maps whose keys
+    are not all in the head are parsed and written back as JSON.
+    """
+    sources = json.dumps([os.path.basename(src_path)]).encode('utf-8')
+    with open(map_path, 'rb') as f:
+        head = f.read(HEAD_SIZE)
+        try:
+            with open_atomically(map_path, 'wb') as out:
+                out.write(rewrite_head(head, sources))
+                copy_checking_keys(f, out, head[-OVERLAP_SIZE:])
+            return
+        except SourcemapRewriteError:
+            f.seek(0)
+            content = f.read()
+    try:
+        map_data = json.loads(content.decode('utf-8'))
+    except ValueError as err:
+        print("Warning: could not read valid sourcemap JSON from "
+              "{}. Exception is:\n{}\n\nContents are:\n{}"
+              .format(map_path, err, content.decode('utf-8', 'replace')),
+              file=sys.stderr)
+        return
+    map_data['sourceRoot'] = ''
+    map_data['sources'] = [os.path.basename(src_path)]
+    with open_atomically(map_path) as out:
+        json.dump(map_data, out)
+
+
+class SourcemapPipeline(object):
+    """Rewrites sourcemaps on a thread of its own, so that compile threads
+    can go on with the next file.
+
+    Maps are marked as pending in the readiness registry until they are
+    rewritten, so that requests for them wait (see civet.finders).
+    """
+
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, map_path, src_path):
+        """Queue rewriting the sourcemap at map_path (see
+        rewrite_sourcemap()).
+        """
+        readiness.begin(map_path)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work)
+                self._thread.daemon = True
+                self._thread.start()
+        self._jobs.put((map_path, src_path))
+
+    def _work(self):
+        while True:
+            map_path, src_path = self._jobs.get()
+            try:
+                rewrite_sourcemap(map_path, src_path)
+            except (IOError, OSError) as err:
+                print('Warning: could not rewrite sourcemap {0}: {1}'.format(
+                    map_path, err), file=sys.stderr)
+            finally:
+                readiness.end(map_path)
+                self._jobs.task_done()
+
+    def wait(self):
+        """Block until every queued sourcemap is rewritten."""
+        self._jobs.join()
+
+
+# The pipeline shared by all compilers in the process
+pipeline = SourcemapPipeline()
@@ -0,0 +1,92 @@
+from collections import defaultdict
+from collections import namedtuple
+import csv
+import json
+import threading
+
+
+CompileRecord = namedtuple('CompileRecord', [
+    'compiler', 'src_path', 'dst_path', 'outcome', 'seconds', 'returncode',
+    'output_size', 'messages'])
+
+
+class CompileStats(object):
+    """Counts and timings of compiled, skipped and failed files per compiler.
+
+    Compilers report every file they look at through Compiler.record(), from
+    whichever thread compiled it. Besides the totals, a CompileRecord is kept
+    for every file that was compiled or failed, for profiling reports.
+    """
+
+    COMPILED = 'compiled'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+    # Stale files in a dry run, which were not compiled
+    WOULD_COMPILE = 'would compile'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # compiler name -> outcome -> number of files
+        self.counts = defaultdict(lambda: defaultdict(int))
+        # compiler name -> seconds spent compiling
+        self.seconds = defaultdict(float)
+        self.records = []
+
+    def record(self, compiler, src_path, outcome, seconds=0.0, dst_path=None,
+               returncode=None, output_size=None, messages=None):
+        with self._lock:
+            self.counts[compiler.name][outcome] += 1
+            self.seconds[compiler.name] += seconds
+            if outcome != self.SKIPPED:
+                self.records.append(CompileRecord(
+                    compiler.name, src_path, dst_path, outcome, seconds,
+                    returncode, output_size, messages))
+
+    def total(self, outcome):
+        with self._lock:
+            return sum(counts[outcome] for counts in self.counts.values())
+
+    def get_summary_lines(self, dry_run=False):
+        """Return one human readable line per compiler."""
+        if dry_run:
+            compiled_format, outcome = '{0} would compile', self.WOULD_COMPILE
+        else:
+            compiled_format, outcome = '{0} compiled', self.COMPILED
+        with self._lock:
+            return [
+                '{name}: {compiled}, {skipped} up to date, '
+                '{failed} failed ({seconds:.2f}s compiling)'.format(
+                    name=name,
+                    compiled=compiled_format.format(counts[outcome]),
+                    skipped=counts[self.SKIPPED],
+                    failed=counts[self.FAILED],
+                    seconds=self.seconds[name])
+                for name, counts in sorted(self.counts.items())]
+
+    def get_failures(self):
+        """Return the CompileRecords of the files that failed, by path."""
+        with self._lock:
+            return sorted(
+                (r for r in self.records if r.outcome == self.FAILED),
+                key=lambda r: r.src_path)
+
+    def get_slowest(self, count):
+        """Return the CompileRecords of the count slowest files."""
+        with self._lock:
+            return sorted(
+                self.records, key=lambda r: r.seconds, reverse=True)[:count]
+
+    def write_report(self, path):
+        """Write the per-file records to path, as CSV if path ends with .csv,
+        or else as JSON.
+        """
+        with self._lock:
+            records = sorted(self.records, key=lambda r: r.seconds,
+                             reverse=True)
+        with open(path, 'w') as f:
+            if path.endswith('.csv'):
+                writer = csv.writer(f)
+                writer.writerow(CompileRecord._fields)
+                writer.writerows(records)
+            else:
+                json.dump([r._asdict() for r in records], f, indent=2)
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles import storage
+from django.contrib.staticfiles.utils import matches_patterns
+
+from civet.manifest import AssetManifest
+from civet.manifest import MANIFEST_FILENAME
+
+
+class CompiledFilesMixin(object):
+    """Reuses Civet's hashed copies of compiled files (see
+    CIVET_HASHED_FILENAMES) in collectstatic's post-processing.
+
+    They are collected from CIVET_PRECOMPILED_ASSET_DIR like any other static
+    file, and a hashing storage would otherwise hash them again (eg
+    js/foo.5f1a8c3b9e02.js into js/foo.5f1a8c3b9e02.0c5d4e7a1f3b.js), along
+    with Civet's manifest. Instead, they are left out, and the compiled files
+    get the names of their hashed copies without being read and hashed again.
+    Compiled files whose URLs the storage rewrites (eg url() in CSS) are
+    post-processed as usual, since rewriting changes their content.
+    """
+
+    def get_civet_names(self, paths):
+        """Return the names, among the collected paths, of the files Civet
+        hashed already, and a dict from the names of the compiled files they
+        are copies of to their hashed names.
+        """
+        root = os.path.realpath(settings.CIVET_PRECOMPILED_ASSET_DIR)
+        manifest = AssetManifest(root)
+        hashed_names = manifest.get_hashed_names()
+        relative_paths = {}
+        for name, (source_storage, path) in paths.items():
+            try:
+                full_path = os.path.realpath(source_storage.path(path))
+            except NotImplementedError:
+                # Not on the local file system
+                continue
+            if not full_path.startswith(os.path.join(root, '')):
+                continue
+            relative_paths[name] = os.path.relpath(
+                full_path, root).replace(os.sep, '/')
+
+        collected = set(relative_paths.values())
+        names = set()
+        compiled_names = {}
+        for name, relative_path in relative_paths.items():
+            if (relative_path in hashed_names or
+                    relative_path == MANIFEST_FILENAME):
+                names.add(name)
+                continue
+            hashed_name = manifest.lookup(relative_path)
+            if hashed_name is None or hashed_name not in collected:
+                continue
+            if matches_patterns(name, getattr(self, '_patterns', {})):
+                # Rewritten, so hashed again
+                continue
+            # The hashed copy is collected under the same prefix, if any
+            compiled_names[name] = (
+                name[:len(name) - len(relative_path)] + hashed_name)
+        return names, compiled_names
+
+    def post_process(self, paths, dry_run=False, **options):
+        civet_names, compiled_names = self.get_civet_names(paths)
+        hashed_files = getattr(self, 'hashed_files', None)
+        if dry_run or hashed_files is None:
+            # Not a storage keeping hashed names
+            compiled_names = {}
+        paths = OrderedDict(
+            (name, value) for name, value in paths.items()
+            if name not in civet_names and name not in compiled_names)
+        processed = super(CompiledFilesMixin, self).post_process(
+            paths, dry_run=dry_run, **options)
+        for result in processed:
+            yield result
+        if not compiled_names:
+            return
+        for name, hashed_name in sorted(compiled_names.items()):
+            self.hashed_files[self.hash_key(name)] = hashed_name
+            yield name, hashed_name, True
+        if hasattr(self, 'save_manifest'):
+            self.save_manifest()
+
+
+class ManifestStaticFilesStorage(CompiledFilesMixin,
+                                 storage.ManifestStaticFilesStorage):
+    """Django's ManifestStaticFilesStorage, for use with
+    CIVET_HASHED_FILENAMES.
+    """
@@ -1,6 +1,201 @@
+from __future__ import print_function
+import binascii
+from contextlib import contextmanager
+import errno
+import json
 import os
+import shutil
 import signal
+import subprocess
 import sys
+import tempfile
+import threading
+
+
+def mkdir_p(path):
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else:
+            raise
+
+
+def create_temporary_file(dirname, prefix):
+    """Create a new file with a unique name in dirname, and return its file
+    descriptor and path.
+
+    Unlike the files mkstemp() creates, which only their owner can read, the
+    file gets the mode of any new file: 0666, less the process umask.
+    """
+    while True:
+        path = os.path.join(dirname, '{0}.{1}'.format(
+            prefix, binascii.hexlify(os.urandom(6)).decode('ascii')))
+        try:
+            fd = os.open(
+                path,
+                os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                getattr(os, 'O_BINARY', 0),
+                0o666)
+        except OSError as exc:
+            if exc.errno == errno.EEXIST:
+                continue
+            raise
+        return fd, path
+
+
+@contextmanager
+def open_atomically(path, mode='w'):
+    """Open a file to write path with, so that readers never see a partial
+    file.
+
+    The file is a temporary file in the same directory, which is renamed over
+    path once the block exits without an error, or deleted otherwise. Use mode
+    'wb' to write bytes instead of text.
+    """
+    dirname, basename = os.path.split(path)
+    mkdir_p(dirname)
+    fd, tmp_path = create_temporary_file(dirname, '.' + basename)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def write_file_atomically(path, data, mode='w'):
+    """Write data to path so that readers never see a partial file (see
+    open_atomically()).
+    """
+    with open_atomically(path, mode) as f:
+        f.write(data)
+
+
+def read_json_file(path, description):
+    """Return the JSON content of path, or None if there is no such file.
+
+    A file that cannot be parsed is ignored with a warning, and None is
+    returned.
+
+    Args:
+        description: What the file is, for the warning (eg "build cache").
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError as err:
+        print('Warning: ignoring unreadable {0} {1}: {2}'.format(
+            description, path, err), file=sys.stderr)
+        return None
+
+
+class JSONFile(object):
+    """Base class for the state Civet keeps in a JSON file, eg the build
+    cache in CIVET_PRECOMPILED_ASSET_DIR.
+
+    Subclasses guard their state with self._lock, read the file with load()
+    and implement get_data(). save() is serialized from taking the snapshot
+    to renaming it into place, so that a thread saving an older snapshot
+    cannot write over a newer one.
+    """
+
+    # What the file is, for warnings (eg "build cache")
+    description = 'file'
+
+    # Keyword arguments of json.dumps()
+    dump_options = {'sort_keys': True}
+
+    # Whether save() creates the file's directory if needed. If not, nothing
+    # is written while the directory does not exist (yet), eg for state that
+    # is not worth creating CIVET_PRECOMPILED_ASSET_DIR for.
+    create_directory = True
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def load(self):
+        """Return the content of the file, or None if it does not exist or
+        cannot be read.
+        """
+        return read_json_file(self.path, self.description)
+
+    def get_data(self):
+        """Return the JSON-serializable content to save, or None if there is
+        nothing new to write (eg if nothing changed since the last save), in
+        which case the file is left as it is. Called with self._lock held.
+        """
+        raise NotImplementedError("Subclasses must implement get_data()")
+
+    def save(self):
+        """Write the content returned by get_data(), if any."""
+        with self._save_lock:
+            with self._lock:
+                data = self.get_data()
+                if data is None:
+                    return
+                text = json.dumps(data, **self.dump_options)
+            if (self.create_directory or
+                    os.path.isdir(os.path.dirname(self.path))):
+                write_file_atomically(self.path, text)
+
+
+@contextmanager
+def temporary_sibling_directory(path, root=None):
+    """Create a temporary directory next to path, and delete it when done.
+
+    The directory is at the same depth and on the same filesystem as path, so
+    relative references (eg in sourcemaps) written into it stay valid, and its
+    files can be renamed into path.
+
+    Args:
+        root: A directory the temporary directory has to stay in (eg
+            CIVET_PRECOMPILED_ASSET_DIR). If path is root itself, the
+            temporary directory is created in path instead.
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    if root is not None and path == os.path.abspath(root):
+        parent = path
+    tmp_dir = tempfile.mkdtemp(prefix='.civet-tmp-', dir=parent)
+    try:
+        yield tmp_dir
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def move_files(src_dir, dst_dir):
+    """Rename every file in src_dir into dst_dir, replacing existing files.
+    """
+    mkdir_p(dst_dir)
+    replace = getattr(os, 'replace', os.rename)
+    for name in os.listdir(src_dir):
+        replace(os.path.join(src_dir, name), os.path.join(dst_dir, name))
+
+
+def remove_file(path):
+    """Delete path if it exists. Returns True if it did."""
+    try:
+        os.remove(path)
+    except OSError as exc:
+        if exc.errno == errno.ENOENT:
+            return False
+        raise
+    return True
+
+
+def is_same_path(path, other):
+    """Return whether path and other name the same file or directory,
+    regardless of trailing slashes or of either being relative.
+    """
+    return (os.path.normpath(os.path.abspath(path)) ==
+            os.path.normpath(os.path.abspath(other)))
 
 
 def collect_src_dst_dir_mappings(src_dst_tuples):
@@ -53,6 +248,57 @@ def get_shortest_topmost_directories(dirs):
     return results
 
 
+def run_process(args, env=None, cancellation=None):
+    """Run a compiler process, capturing what it prints instead of letting it
+    mix with the output of other compilers running at the same time.
+
+    Args:
+        cancellation: The civet.scheduler.Cancellation of the compile job
+            running the process, if any, which kills the process when the job
+            is cancelled.
+
+    Returns:
+        What the process printed to stdout and stderr, as text.
+
+    Raises:
+        subprocess.CalledProcessError: If the exit status is not 0. Its output
+            attribute is what the process printed, as text.
+        civet.scheduler.CompileCancelled: If the job was cancelled.
+    """
+    kwargs = {}
+    if cancellation is not None and hasattr(os, 'setsid'):
+        # In a session of its own, so that cancelling the job kills whatever
+        # the compiler started too (eg when it is a shell script wrapper).
+        # The session does not get the terminal's Ctrl-C, so running jobs
+        # are cancelled when Civet exits instead (see civet.scheduler).
+        if sys.version_info[0] == 2:
+            kwargs['preexec_fn'] = os.setsid
+        else:
+            kwargs['start_new_session'] = True
+    process = subprocess.Popen(
+        args, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        **kwargs)
+    if cancellation is None:
+        output, _ = process.communicate()
+    else:
+        cancellation.attach(process)
+        try:
+            output, _ = process.communicate()
+        finally:
+            cancellation.detach(process)
+        cancellation.check()
+    output = output.decode(sys.getdefaultencoding(), errors='ignore').strip()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(
+            process.returncode, args, output=output)
+    return output
+
+
+def indent_messages(messages, prefix='    '):
+    """Return the lines of compiler messages, indented below a heading."""
+    return '\n'.join(prefix + line for line in messages.splitlines())
+
+
 def raise_error_or_kill(kill_on_error):
     """Either raise an error or terminate runserver.
     """
@@ -64,3 +310,74 @@ def raise_error_or_kill(kill_on_error):
         sys.exit(1)
     else:
         raise AssertionError('Asset precompilation failed.')
+
+
+class PathTrie(object):
+    """A map from directory paths to values that can find the values stored
+    for a path's ancestors, one path component at a time.
+    """
+
+    def __init__(self):
+        # Each node is a dict of child name -> node. A node's value, if any,
+        # is stored under the key None.
+        self._root = {}
+
+    def _split(self, path):
+        return [part for part in path.split(os.sep) if part]
+
+    def __contains__(self, path):
+        node = self._root
+        for part in self._split(path):
+            node = node.get(part)
+            if node is None:
+                return False
+        return None in node
+
+    def __setitem__(self, path, value):
+        node = self._root
+        for part in self._split(path):
+            node = node.setdefault(part, {})
+        node[None] = value
+
+    def get(self, path, default=None):
+        node = self._root
+        for part in self._split(path):
+            node = node.get(part)
+            if node is None:
+                return default
+        return node.get(None, default)
+
+    def keys(self):
+        pending = [(os.sep, self._root)]
+        while pending:
+            path, node = pending.pop()
+            if None in node:
+                yield path
+            for part, child in node.items():
+                if part is not None:
+                    pending.append((os.path.join(path, part), child))
+
+    def iter_ancestors(self, path):
+        """Yield (ancestor, value) for every stored ancestor of path,
+        including path itself, from the topmost down.
+        """
+        node = self._root
+        current = os.sep
+        if None in node:
+            yield current, node[None]
+        for part in self._split(path):
+            node = node.get(part)
+            if node is None:
+                return
+            current = os.path.join(current, part)
+            if None in node:
+                yield current, node[None]
+
+    def find_nearest(self, path):
+        """Return (ancestor, value) for the nearest stored ancestor of path
+        (or path itself), or (None, None) if there is none.
+        """
+        nearest = (None, None)
+        for nearest in self.iter_ancestors(path):
+            pass
+        return nearest
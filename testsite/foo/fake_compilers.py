@@ -0,0 +1,113 @@
+"""Stand-ins for the `sass`, `coffee` and `babel` executables, so that the
+tests run without any of the compilers installed.
+
+The fake compilers copy each source into its output, behind a comment. A
+source containing "@error" fails to compile, and so does a Sass source
+importing a partial that is neither next to it nor in a --load-path. Every
+command line is appended, as JSON, to the log next to the executable (see
+read_log()).
+"""
+import json
+import os
+import stat
+import sys
+
+
+FAKE_COMPILER = r'''#!{python}
+import json
+import os
+import re
+import sys
+
+KIND = {kind!r}
+args = sys.argv[1:]
+with open(__file__ + '.log', 'a') as log:
+    log.write(json.dumps(args) + '\n')
+if '--version' in args:
+    print('fake-' + KIND + ' 1.0')
+    sys.exit(0)
+
+
+def compile(src):
+    with open(src) as f:
+        source = f.read()
+    if '@error' in source:
+        print('Error: @error in ' + src)
+        sys.exit(1)
+    if KIND == 'sass':
+        load_paths = [os.path.dirname(src)] + [
+            args[i + 1] for i, arg in enumerate(args) if arg == '--load-path']
+        for name in re.findall(r'@import "([^"]+)"', source):
+            if not any(os.path.exists(os.path.join(d, '_' + name + '.scss'))
+                       for d in load_paths):
+                print('Error: File to import not found: ' + name)
+                sys.exit(1)
+    return '/* compiled from ' + os.path.basename(src) + ' */\n' + source
+
+
+def write(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def write_map(map_path, src, dst):
+    write(map_path, json.dumps({{
+        'version': 3,
+        'file': os.path.basename(dst),
+        'sourceRoot': '',
+        'sources': [os.path.relpath(src, os.path.dirname(map_path))],
+        'mappings': '',
+    }}))
+
+
+if KIND == 'sass':
+    src, dst = args[-2:]
+    write(dst, compile(src))
+elif KIND == 'coffee':
+    dst_dir = args[args.index('-o') + 1]
+    srcs = [arg for arg in args if arg.endswith('.coffee')]
+    # All or nothing, like coffee
+    outputs = [(src, compile(src)) for src in srcs]
+    for src, output in outputs:
+        base = os.path.splitext(os.path.basename(src))[0]
+        dst = os.path.join(dst_dir, base + '.js')
+        if '--map' in args:
+            output += '\n//# sourceMappingURL=' + base + '.map\n'
+            write_map(os.path.join(dst_dir, base + '.map'), src, dst)
+        write(dst, output)
+    if any('warn' in src for src in srcs):
+        print('Warning: be careful')
+else:
+    dst = args[args.index('-o') + 1]
+    src = args[-1]
+    output = compile(src)
+    if 'true' in args:
+        output += '\n//# sourceMappingURL=' + os.path.basename(dst) + '.map\n'
+        write_map(dst + '.map', src, dst)
+    write(dst, output)
+'''
+
+
+def write_fake_compiler(directory, kind):
+    """Write a fake compiler of the given kind ("sass", "coffee" or "babel")
+    into directory, and return its path.
+    """
+    path = os.path.join(directory, 'fake-' + kind)
+    with open(path, 'w') as f:
+        f.write(FAKE_COMPILER.format(python=sys.executable, kind=kind))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def read_log(executable):
+    """Return the argument lists the fake compiler at executable was run
+    with, except for --version.
+    """
+    log_path = executable + '.log'
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path) as f:
+        runs = [json.loads(line) for line in f]
+    return [args for args in runs if '--version' not in args]
@@ -0,0 +1,168 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+from django.test import SimpleTestCase
+from django.utils import six
+from django.utils.six.moves import BaseHTTPServer
+
+from civet.artifacts import HTTPArtifactCache
+from civet.artifacts import pack_outputs
+from civet.compilers.base_compiler import Compiler
+from foo.testcases import FileSystemTestCase
+
+
+class StoreHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the artifacts in server.artifacts by path, like a plain HTTP
+    store would.
+    """
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path, self.headers))
+        if self.path.endswith('/slow.zip'):
+            time.sleep(1)
+        if self.path.endswith('/broken.zip'):
+            self.send_response(500)
+            self.end_headers()
+            return
+        data = self.server.artifacts.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        self.server.requests.append(('PUT', self.path, self.headers))
+        length = int(self.headers['Content-Length'])
+        self.server.artifacts[self.path] = self.rfile.read(length)
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class StoreTestCase(SimpleTestCase):
+    """Runs a StoreHandler server on localhost for the test."""
+
+    def setUp(self):
+        super(StoreTestCase, self).setUp()
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StoreHandler)
+        self.server.artifacts = {}
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.location = 'http://127.0.0.1:{0}/civet/'.format(
+            self.server.server_address[1])
+        self.stderr, sys.stderr = sys.stderr, six.StringIO()
+        self.addCleanup(setattr, sys, 'stderr', self.stderr)
+
+    def make_cache(self, location=None, **options):
+        options.setdefault('TIMEOUT', 0.5)
+        return HTTPArtifactCache(location or self.location, options)
+
+    def get_warnings(self):
+        return [line for line in sys.stderr.getvalue().splitlines()
+                if line.startswith('Warning')]
+
+
+class HTTPArtifactCacheTest(StoreTestCase):
+    def test_hit(self):
+        self.server.artifacts['/civet/abc.zip'] = b'artifact'
+        cache = self.make_cache(HEADERS={'Authorization': 'Bearer token'})
+        self.assertEqual(cache.get('abc'), b'artifact')
+        method, path, headers = self.server.requests[0]
+        self.assertEqual((method, path), ('GET', '/civet/abc.zip'))
+        self.assertEqual(headers['Authorization'], 'Bearer token')
+
+    def test_miss(self):
+        cache = self.make_cache()
+        self.assertIsNone(cache.get('missing'))
+        # A miss is not an error
+        self.assertTrue(cache.available)
+        self.assertEqual(self.get_warnings(), [])
+
+    def test_put_round_trip(self):
+        cache = self.make_cache()
+        cache.set('abc', b'compiled')
+        method, path, headers = self.server.requests[0]
+        self.assertEqual((method, path), ('PUT', '/civet/abc.zip'))
+        self.assertEqual(headers['Content-Type'], 'application/zip')
+        self.assertEqual(cache.get('abc'), b'compiled')
+
+    def test_read_only(self):
+        cache = HTTPArtifactCache(self.location, read_only=True)
+        cache.set('abc', b'compiled')
+        self.assertEqual(self.server.requests, [])
+
+    def test_timeout_disables_cache_once(self):
+        cache = self.make_cache(TIMEOUT=0.2)
+        self.assertIsNone(cache.get('slow'))
+        self.assertFalse(cache.available)
+        self.assertIsNone(cache.get('slow'))
+        cache.set('abc', b'compiled')
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(self.get_warnings()), 1)
+
+    def test_connection_refused_disables_cache_once(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        cache = self.make_cache('http://127.0.0.1:{0}/'.format(port))
+        self.assertIsNone(cache.get('abc'))
+        self.assertIsNone(cache.get('def'))
+        cache.set('abc', b'compiled')
+        self.assertFalse(cache.available)
+        self.assertEqual(len(self.get_warnings()), 1)
+
+    def test_server_error_disables_cache(self):
+        cache = self.make_cache()
+        self.assertIsNone(cache.get('broken'))
+        self.assertFalse(cache.available)
+        self.assertEqual(len(self.get_warnings()), 1)
+
+
+class FetchArtifactTest(StoreTestCase, FileSystemTestCase):
+    def setUp(self):
+        super(FetchArtifactTest, self).setUp()
+        # Only what fetch_artifact() uses, without looking for executables
+        self.compiler = Compiler.__new__(Compiler)
+        self.compiler.precompiled_assets_dir = self.root
+        self.compiler.force = False
+        self.compiler.artifact_cache = self.make_cache()
+        self.dst_path = self.path('js/foo.js')
+
+    def test_outputs_are_unpacked(self):
+        paths = [self.write('src/foo.js', 'foo.js'),
+                 self.write('src/foo.js.map', 'foo.js.map')]
+        self.server.artifacts['/civet/abc.zip'] = pack_outputs(paths)
+
+        self.assertTrue(self.compiler.fetch_artifact(self.dst_path, 'abc'))
+        for name in ('foo.js', 'foo.js.map'):
+            with open(self.path('js/' + name)) as f:
+                self.assertEqual(f.read(), name)
+
+    def test_corrupt_zip_is_ignored(self):
+        self.server.artifacts['/civet/abc.zip'] = b'not a zip file'
+        self.assertFalse(self.compiler.fetch_artifact(self.dst_path, 'abc'))
+        self.assertEqual(os.listdir(self.path('js')), [])
+        warnings = self.get_warnings()
+        self.assertEqual(len(warnings), 1)
+        self.assertIn('broken artifact abc', warnings[0])
+        # Only the artifact is bad, not the cache
+        self.assertTrue(self.compiler.artifact_cache.available)
+
+    def test_force_skips_cache(self):
+        self.compiler.force = True
+        self.assertFalse(self.compiler.fetch_artifact(self.dst_path, 'abc'))
+        self.assertEqual(self.server.requests, [])
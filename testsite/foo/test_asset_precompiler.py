@@ -0,0 +1,128 @@
+import os
+import sys
+
+from django.test.utils import override_settings
+from django.utils import six
+
+from civet import asset_precompiler
+from civet import sourcemaps
+from civet.asset_precompiler import iter_files
+from civet.asset_precompiler import sweep_orphaned_outputs
+from civet.compilers.coffeescript import CoffeescriptCompiler
+from civet.compilers.es6 import ES6Compiler
+from civet.compilers.es6 import es6_extension
+
+from foo.fake_compilers import read_log
+from foo.fake_compilers import write_fake_compiler
+from foo.testcases import FileSystemTestCase
+
+
+class SweepOrphanedOutputsTest(FileSystemTestCase):
+    def setUp(self):
+        super(SweepOrphanedOutputsTest, self).setUp()
+        self.patch(asset_precompiler, 'precompiled_assets_dir', self.root)
+        self.patch(sys, 'stdout', six.StringIO())
+
+    def write_all(self, *names):
+        for name in names:
+            self.write(name)
+
+    def sweep(self, dry_run=False):
+        outputs = {'compiler': [
+            ('/static/coffee/app.coffee', self.path('coffee/app.js')),
+            ('/static/sass/main.scss', self.path('sass/main.css')),
+        ]}
+        return sweep_orphaned_outputs(
+            outputs, dry_run, [self.path('bundles/all.js')])
+
+    def test_outputs_and_their_files_are_kept(self):
+        self.write_all(
+            'coffee/app.js', 'coffee/app.map', 'coffee/app.js.map',
+            'coffee/app.5f1a8c3b9e02.js', 'sass/main.css', 'sass/main.css.map',
+            'bundles/all.js', 'bundles/all.js.map')
+        self.assertEqual(self.sweep(), 0)
+
+    def test_orphans_are_removed(self):
+        self.write_all('coffee/app.js', 'coffee/old.js', 'coffee/old.map',
+                       'sass/old.css')
+        self.assertEqual(self.sweep(), 3)
+        self.assertEqual(os.listdir(self.path('coffee')), ['app.js'])
+        self.assertEqual(os.listdir(self.path('sass')), [])
+
+    def test_other_files_are_kept(self):
+        self.write_all('.civet-build-cache.json', 'coffee/notes.txt',
+                       'coffee/.civet-tmp-x/app.js', '.civet-tmp-y/old.js')
+        self.assertEqual(self.sweep(), 0)
+
+    def test_dry_run(self):
+        self.write_all('coffee/old.js')
+        self.assertEqual(self.sweep(dry_run=True), 1)
+        self.assertTrue(os.path.exists(self.path('coffee/old.js')))
+        self.assertIn('Would remove orphaned output', sys.stdout.getvalue())
+
+
+class RunAtomicallyTest(FileSystemTestCase):
+    def setUp(self):
+        super(RunAtomicallyTest, self).setUp()
+        self.precompiled_dir = self.path('precompiled')
+        self.src = self.write('static/app' + es6_extension, 'let app = 1;')
+        self.babel = write_fake_compiler(self.root, 'babel')
+        compiler_class = type('FakeES6Compiler', (ES6Compiler,),
+                              {'executable': self.babel})
+        self.compiler = compiler_class(self.precompiled_dir, False)
+
+    def compile(self, dst_path):
+        stdout, sys.stdout = sys.stdout, six.StringIO()
+        try:
+            self.compiler.compile(self.src, dst_path)
+            sourcemaps.pipeline.wait()
+        finally:
+            sys.stdout = stdout
+        args, = read_log(self.babel)
+        # The directory the compiler wrote to
+        return os.path.dirname(os.path.dirname(args[args.index('-o') + 1]))
+
+    def test_output_in_subdirectory(self):
+        dst_path = os.path.join(self.precompiled_dir, 'js', 'app.js')
+        self.assertEqual(self.compile(dst_path), self.precompiled_dir)
+        self.assertTrue(os.path.exists(dst_path))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(dst_path))),
+                         ['app.js', 'app.js.map'])
+
+    def test_output_at_the_root_stays_in_it(self):
+        dst_path = os.path.join(self.precompiled_dir, 'app.js')
+        self.assertEqual(self.compile(dst_path), self.precompiled_dir)
+        self.assertTrue(os.path.exists(dst_path))
+        self.assertEqual(sorted(os.listdir(self.root)),
+                         ['fake-babel', 'fake-babel.log', 'precompiled',
+                          'static'])
+
+
+class IterFilesTest(FileSystemTestCase):
+    def setUp(self):
+        super(IterFilesTest, self).setUp()
+        self.precompiled_dir = self.path('precompiled')
+        self.patch(asset_precompiler, 'precompiled_assets_dir',
+                   self.precompiled_dir)
+        self.write('static/app.coffee')
+        self.write('precompiled/old.coffee')
+        compiler_class = type('FakeCoffeeCompiler', (CoffeescriptCompiler,),
+                              {'executable': '/usr/local/bin/coffee'})
+        self.compiler = compiler_class(self.precompiled_dir, False)
+
+    def test_precompiled_dir_is_not_a_source(self):
+        settings = override_settings(
+            STATICFILES_DIRS=(self.path('static'), self.precompiled_dir),
+            STATICFILES_FINDERS=[
+                'django.contrib.staticfiles.finders.FileSystemFinder',
+            ])
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # However CIVET_PRECOMPILED_ASSET_DIR is spelled
+        for precompiled_dir in [self.precompiled_dir + os.sep,
+                                os.path.relpath(self.precompiled_dir)]:
+            asset_precompiler.precompiled_assets_dir = precompiled_dir
+            files = list(iter_files([self.compiler]))
+            self.assertEqual(
+                [os.path.basename(src) for _, src, _ in files],
+                ['app.coffee'])
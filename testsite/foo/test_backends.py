@@ -0,0 +1,289 @@
+import json
+import os
+import subprocess
+import sys
+import types
+
+from django.test.utils import override_settings
+from django.utils import six
+
+from civet.artifacts import LocalArtifactCache
+from civet.compilers.backends import BackendCompileError
+from civet.compilers.backends import InProcessBackend
+from civet.compilers import sass
+from civet.compilers.coffeescript import CoffeescriptCompiler
+from civet.compilers.coffeescript import DukpyCoffeeBackend
+from civet.compilers.es6 import DukpyBabelBackend
+from civet.compilers.es6 import ES6Compiler
+from civet.compilers.sass import LibsassBackend
+from civet.compilers.sass import SassCompiler
+from foo.testcases import FileSystemTestCase
+
+
+class FakeSassBackend(InProcessBackend):
+    name = 'fake'
+
+    def get_version(self):
+        return 'fake 1.0'
+
+    def compile_source(self, source, src_path, dst_path):
+        if '@error' in source:
+            raise BackendCompileError('@error in {0}'.format(src_path))
+        return '/* compiled */\n' + source, {'version': 3, 'mappings': ''}
+
+
+class FakeSassCompiler(SassCompiler):
+    # As if sass were not installed
+    executable = None
+    backends = {'fake': FakeSassBackend}
+
+
+def install_fake_module(test, name, **attrs):
+    """Make `import name` return a module with the given attributes until
+    the end of the test.
+    """
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    if name in sys.modules:
+        test.addCleanup(sys.modules.__setitem__, name, sys.modules[name])
+    else:
+        test.addCleanup(sys.modules.pop, name, None)
+    sys.modules[name] = module
+    return module
+
+
+@override_settings(CIVET_SASS_BACKEND='fake')
+class InProcessBackendTest(FileSystemTestCase):
+    def setUp(self):
+        super(InProcessBackendTest, self).setUp()
+        self.src = self.write('static/sass/main.scss', 'a { color: red; }')
+        self.precompiled_dir = self.path('precompiled')
+        self.dst = self.path('precompiled/sass/main.css')
+
+    def make_compiler(self, artifact_cache=None):
+        compiler = FakeSassCompiler(self.precompiled_dir, False)
+        compiler.artifact_cache = artifact_cache
+        compiler.set_sources([(self.src, self.dst)])
+        return compiler
+
+    def compile(self, compiler):
+        stdout, sys.stdout = sys.stdout, six.StringIO()
+        try:
+            compiler.compile(self.src, self.dst)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_output_and_sourcemap_are_written(self):
+        compiler = self.make_compiler()
+        self.assertIsInstance(compiler.backend, FakeSassBackend)
+        self.compile(compiler)
+        with open(self.dst) as f:
+            self.assertEqual(f.read(), '/* compiled */\na { color: red; }')
+        self.assertTrue(os.path.exists(self.dst + '.map'))
+
+    def test_compile_error(self):
+        compiler = self.make_compiler()
+        self.write('static/sass/main.scss', '@error "broken";')
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            self.compile(compiler)
+        self.assertIn('@error in', context.exception.output)
+        self.assertFalse(os.path.exists(self.dst))
+
+    def test_identity_does_not_depend_on_the_executable(self):
+        compiler = self.make_compiler()
+        identity = compiler.get_artifact_identity()
+        self.assertIn('fake 1.0', identity)
+        compiler.executable = '/usr/local/bin/sass'
+        self.assertEqual(compiler.get_artifact_identity(), identity)
+        self.assertEqual(compiler.get_cache_identity()[1], None)
+
+    def test_artifact_cache(self):
+        artifact_cache = LocalArtifactCache(self.path('cache'))
+        output = self.compile(self.make_compiler(artifact_cache))
+        self.assertIn('Compiling Sass file', output)
+        self.assertTrue(os.path.exists(self.dst))
+
+        os.remove(self.dst)
+        output = self.compile(self.make_compiler(artifact_cache))
+        self.assertIn('Fetched Sass file', output)
+        self.assertTrue(os.path.exists(self.dst))
+
+
+class FakeLibsassCompileError(Exception):
+    pass
+
+
+@override_settings(CIVET_SASS_BACKEND='libsass')
+class LibsassBackendTest(FileSystemTestCase):
+    def setUp(self):
+        super(LibsassBackendTest, self).setUp()
+        self.src = self.write('static/sass/main.scss', 'a { color: red; }')
+        self.precompiled_dir = self.path('precompiled')
+        self.dst = self.path('precompiled/sass/main.css')
+        self.calls = []
+        install_fake_module(
+            self, 'sass', compile=self.fake_compile,
+            CompileError=FakeLibsassCompileError, __version__='0.22.0',
+            libsass_version='3.6.4')
+        self.stderr, sys.stderr = sys.stderr, six.StringIO()
+        self.addCleanup(setattr, sys, 'stderr', self.stderr)
+
+    def fake_compile(self, **kwargs):
+        self.calls.append(kwargs)
+        with open(kwargs['filename']) as f:
+            source = f.read()
+        if '@error' in source:
+            raise FakeLibsassCompileError('Error: broken')
+        return source, '{"version": 3, "mappings": ""}'
+
+    def make_compiler(self, executable=None):
+        compiler_class = type('FakeSassCompiler', (SassCompiler,),
+                              {'executable': executable})
+        compiler = compiler_class(self.precompiled_dir, False)
+        compiler.set_sources([(self.src, self.dst)])
+        return compiler
+
+    def test_compile(self):
+        compiler = self.make_compiler()
+        self.assertIsInstance(compiler.backend, LibsassBackend)
+        self.assertEqual(compiler.get_version(),
+                         'libsass-python 0.22.0 (libsass 3.6.4)')
+        compiler.run(self.src, self.dst)
+        with open(self.dst) as f:
+            self.assertEqual(f.read(), 'a { color: red; }')
+        with open(self.dst + '.map') as f:
+            self.assertEqual(f.read(), '{"version": 3, "mappings": ""}')
+        call, = self.calls
+        self.assertEqual(call['filename'], self.src)
+        self.assertEqual(call['source_map_filename'], self.dst + '.map')
+        self.assertEqual(call['output_filename_hint'], self.dst)
+        self.assertEqual(call['include_paths'],
+                         [os.path.dirname(self.src)])
+        self.assertNotIn('output_style', call)
+
+    def test_arguments(self):
+        self.addCleanup(setattr, sass, 'sass_arguments', sass.sass_arguments)
+        sass.sass_arguments = ('--style', 'compressed', '-I', '/vendor')
+        self.make_compiler().run(self.src, self.dst)
+        call, = self.calls
+        self.assertEqual(call['output_style'], 'compressed')
+        self.assertEqual(call['include_paths'],
+                         ['/vendor', os.path.dirname(self.src)])
+
+    def test_compile_error(self):
+        self.write('static/sass/main.scss', '@error "broken";')
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            self.make_compiler().run(self.src, self.dst)
+        self.assertEqual(context.exception.output, 'Error: broken')
+        self.assertEqual(context.exception.cmd, ['libsass', self.src])
+        self.assertFalse(os.path.exists(self.dst))
+
+    def test_missing_library(self):
+        sys.modules['sass'] = None
+        compiler = self.make_compiler('/usr/local/bin/sass')
+        self.assertIsNone(compiler.backend)
+        self.assertEqual(
+            compiler.get_command_with_arguments(self.src, self.dst)[0],
+            '/usr/local/bin/sass')
+        self.assertIn(
+            'settings.CIVET_SASS_BACKEND is "libsass", but the libsass '
+            'package is not installed', sys.stderr.getvalue())
+
+
+class FakeJSRuntimeError(Exception):
+    pass
+
+
+def fake_coffee_compile(source):
+    if '@error' in source:
+        raise FakeJSRuntimeError('SyntaxError: unexpected @')
+    return '// coffee\n' + source
+
+
+def fake_babel_compile(source, filename, sourceMaps):
+    if '@error' in source:
+        raise FakeJSRuntimeError('SyntaxError: unexpected @')
+    return {'code': '// babel\n' + source,
+            'map': {'version': 3, 'sources': [filename], 'mappings': ''}}
+
+
+class DukpyBackendTest(FileSystemTestCase):
+    def setUp(self):
+        super(DukpyBackendTest, self).setUp()
+        self.precompiled_dir = self.path('precompiled')
+        self.dukpy = install_fake_module(
+            self, 'dukpy', coffee_compile=fake_coffee_compile,
+            babel_compile=fake_babel_compile,
+            JSRuntimeError=FakeJSRuntimeError, __version__='0.2.3')
+        self.stderr, sys.stderr = sys.stderr, six.StringIO()
+        self.addCleanup(setattr, sys, 'stderr', self.stderr)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def make_compiler(self, compiler_class, executable=None):
+        compiler_class = type('Fake' + compiler_class.__name__,
+                              (compiler_class,), {'executable': executable})
+        return compiler_class(self.precompiled_dir, False)
+
+    @override_settings(CIVET_COFFEE_BACKEND='dukpy')
+    def test_coffee(self):
+        compiler = self.make_compiler(CoffeescriptCompiler)
+        self.assertIsInstance(compiler.backend, DukpyCoffeeBackend)
+        self.assertEqual(compiler.get_version(), 'dukpy 0.2.3')
+        src = self.write('static/app.coffee', 'app = 1')
+        dst = os.path.join(self.precompiled_dir, 'app.js')
+        compiler.run(src, dst)
+        self.assertEqual(self.read(dst), '// coffee\napp = 1')
+        # dukpy writes no sourcemap for CoffeeScript
+        self.assertFalse(os.path.exists(compiler.get_map_path(dst)))
+
+    @override_settings(CIVET_BABEL_BACKEND='dukpy')
+    def test_babel(self):
+        compiler = self.make_compiler(ES6Compiler)
+        self.assertIsInstance(compiler.backend, DukpyBabelBackend)
+        src = self.write('static/app.js', 'let app = 1;')
+        dst = os.path.join(self.precompiled_dir, 'app.js')
+        compiler.run(src, dst)
+        self.assertEqual(self.read(dst),
+                         '// babel\nlet app = 1;\n'
+                         '//# sourceMappingURL=app.js.map\n')
+        self.assertEqual(
+            json.loads(self.read(dst + '.map')),
+            {'version': 3, 'sources': ['app.js'], 'mappings': ''})
+
+    @override_settings(CIVET_COFFEE_BACKEND='dukpy')
+    def test_compile_error(self):
+        compiler = self.make_compiler(CoffeescriptCompiler)
+        src = self.write('static/app.coffee', '@error')
+        dst = os.path.join(self.precompiled_dir, 'app.js')
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            compiler.run(src, dst)
+        self.assertEqual(context.exception.output,
+                         'SyntaxError: unexpected @')
+        self.assertFalse(os.path.exists(dst))
+
+    @override_settings(CIVET_BABEL_BACKEND='dukpy')
+    def test_dukpy_without_babel(self):
+        del self.dukpy.babel_compile
+        compiler = self.make_compiler(ES6Compiler, '/usr/local/bin/babel')
+        self.assertIsNone(compiler.backend)
+        self.assertIn('the installed dukpy does not include Babel',
+                      sys.stderr.getvalue())
+
+    @override_settings(CIVET_COFFEE_BACKEND='coffee')
+    def test_executable(self):
+        compiler = self.make_compiler(CoffeescriptCompiler,
+                                      '/usr/local/bin/coffee')
+        self.assertIsNone(compiler.backend)
+        self.assertEqual(sys.stderr.getvalue(), '')
+
+    @override_settings(CIVET_COFFEE_BACKEND='v8')
+    def test_unknown_backend(self):
+        with self.assertRaises(AssertionError):
+            self.make_compiler(CoffeescriptCompiler, '/usr/local/bin/coffee')
+        self.assertIn(
+            'Unknown settings.CIVET_COFFEE_BACKEND "v8", must be one of: '
+            'coffee, dukpy.', sys.stderr.getvalue())
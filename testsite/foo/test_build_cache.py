@@ -0,0 +1,101 @@
+import os
+
+from civet.build_cache import BuildCache
+from foo.testcases import FileSystemTestCase
+
+
+class FakeCompiler(object):
+    def __init__(self, dependencies=(), identity=('fake', '1.0')):
+        self.dependencies = list(dependencies)
+        self.identity = list(identity)
+
+    def get_dependencies(self, src_path):
+        return self.dependencies
+
+    def get_cache_identity(self):
+        return self.identity
+
+
+class BuildCacheTest(FileSystemTestCase):
+    def setUp(self):
+        super(BuildCacheTest, self).setUp()
+        # The partial sorts before the source, which _get_files() puts first
+        self.partial = self.write('a/_partial.scss', '$x: 1;')
+        self.src = self.write('z/main.scss', '@import "partial";')
+        self.dst = self.write('out/main.css', 'body {}')
+        self.compiler = FakeCompiler([self.partial])
+
+    def touch(self, path, offset=10):
+        st = os.stat(path)
+        os.utime(path, (st.st_atime + offset, st.st_mtime + offset))
+
+    def record(self, cache):
+        cache.record(self.dst, cache.get_signature(self.compiler, self.src))
+
+    def test_unknown_output(self):
+        cache = BuildCache(self.root)
+        self.assertIsNone(cache.is_fresh(self.compiler, self.src, self.dst))
+
+    def test_hit_does_not_hash(self):
+        cache = BuildCache(self.root)
+        self.record(cache)
+
+        def fail(path, st):
+            raise AssertionError('hashed {0}'.format(path))
+        cache._hash_file = fail
+        self.assertTrue(cache.is_fresh(self.compiler, self.src, self.dst))
+
+    def test_miss_when_dependency_changes(self):
+        cache = BuildCache(self.root)
+        self.record(cache)
+        self.write('a/_partial.scss', '$x: 2;')
+        self.assertFalse(cache.is_fresh(self.compiler, self.src, self.dst))
+
+    def test_miss_when_compiler_changes(self):
+        cache = BuildCache(self.root)
+        self.record(cache)
+        compiler = FakeCompiler([self.partial], identity=('fake', '2.0'))
+        self.assertFalse(cache.is_fresh(compiler, self.src, self.dst))
+
+    def test_miss_when_output_is_missing(self):
+        cache = BuildCache(self.root)
+        self.record(cache)
+        os.remove(self.dst)
+        self.assertFalse(cache.is_fresh(self.compiler, self.src, self.dst))
+
+    def test_deleted_dependency_is_stale_until_it_is_back(self):
+        cache = BuildCache(self.root)
+        os.remove(self.partial)
+        signature = cache.get_signature(self.compiler, self.src)
+        self.assertIsNone(signature['files'][self.partial])
+        cache.record(self.dst, signature)
+        self.assertFalse(cache.is_fresh(self.compiler, self.src, self.dst))
+        self.write('a/_partial.scss', '$x: 1;')
+        self.assertFalse(cache.is_fresh(self.compiler, self.src, self.dst))
+
+    def test_touch_only_is_fresh_and_remembered(self):
+        cache = BuildCache(self.root)
+        self.record(cache)
+        self.touch(self.src)
+        self.touch(self.partial)
+        self.assertTrue(cache.is_fresh(self.compiler, self.src, self.dst))
+
+        # The new mtimes were recorded, so the next check does not hash
+        def fail(path, st):
+            raise AssertionError('hashed {0}'.format(path))
+        cache._hash_file = fail
+        self.assertTrue(cache.is_fresh(self.compiler, self.src, self.dst))
+
+    def test_saved_and_loaded(self):
+        cache = BuildCache(self.root)
+        self.record(cache)
+        cache.save()
+        loaded = BuildCache(self.root)
+        self.assertTrue(loaded.is_fresh(self.compiler, self.src, self.dst))
+
+    def test_evict_stale(self):
+        cache = BuildCache(self.root)
+        self.record(cache)
+        os.remove(self.src)
+        self.assertEqual(cache.evict_stale(), 1)
+        self.assertIsNone(cache.is_fresh(self.compiler, self.src, self.dst))
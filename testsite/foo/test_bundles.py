@@ -0,0 +1,107 @@
+import io
+import json
+import os
+import sys
+
+from django.test import SimpleTestCase
+from django.utils import six
+
+from civet.bundles import Bundle
+from civet.bundles import BundleBuilder
+from civet.bundles import relocate_sourcemap
+from foo.testcases import FileSystemTestCase
+
+
+class RelocateSourcemapTest(SimpleTestCase):
+    def test_sources_are_relative_to_bundle(self):
+        map_data = {
+            'version': 3,
+            'file': 'a.js',
+            'sourceRoot': 'src',
+            'sources': ['a.coffee', 'http://example.com/b.js', '/abs.js'],
+            'mappings': 'AAAA',
+        }
+        relocated = relocate_sourcemap(
+            map_data, os.path.join('root', 'js', 'lib'),
+            os.path.join('root', 'bundles'))
+        self.assertEqual(relocated['sources'], [
+            '../js/lib/src/a.coffee', 'http://example.com/b.js', '/abs.js'])
+        self.assertEqual(relocated['sourceRoot'], '')
+        self.assertNotIn('file', relocated)
+        self.assertEqual(map_data['sources'][0], 'a.coffee')
+
+
+class BundleBuilderTest(FileSystemTestCase):
+    def setUp(self):
+        super(BundleBuilderTest, self).setUp()
+        self.outputs = [
+            self.write('js/lib/a.js',
+                       'var a = 1;\n//# sourceMappingURL=a.js.map\n'),
+            self.write('js/b.js', 'var b = 1;\nvar b2 = 2;'),
+            self.write('js/c.js',
+                       'var c = 1;\n//# sourceMappingURL=c.js.map\n'),
+        ]
+        self.write('js/lib/a.js.map', json.dumps({
+            'version': 3, 'sources': ['a.coffee'], 'mappings': 'AAAA'}))
+        self.write('js/c.js.map', json.dumps({
+            'version': 3, 'sources': ['c.coffee'], 'mappings': 'AACA'}))
+        self.bundle = Bundle(
+            'bundles/app.js', ['js/lib/*.js', 'js/*.js'], self.root)
+        self.builder = BundleBuilder(self.root, [self.bundle])
+        self.builder.add_outputs(self.outputs)
+
+    def read(self, path):
+        with io.open(path, encoding='utf-8') as f:
+            return f.read()
+
+    def build_all(self):
+        stdout, sys.stdout = sys.stdout, six.StringIO()
+        stderr, sys.stderr = sys.stderr, six.StringIO()
+        try:
+            self.builder.build_all()
+            return sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def test_members_in_pattern_order(self):
+        self.assertEqual(self.builder.get_members(self.bundle), [
+            self.path('js/lib/a.js'),
+            self.path('js/b.js'),
+            self.path('js/c.js'),
+        ])
+
+    def test_bundle_and_index_map(self):
+        self.build_all()
+        self.assertEqual(self.read(self.bundle.path), (
+            'var a = 1;\n'
+            'var b = 1;\nvar b2 = 2;\n'
+            'var c = 1;\n'
+            '//# sourceMappingURL=app.js.map\n'))
+        index_map = json.loads(self.read(self.bundle.map_path))
+        self.assertEqual(index_map['file'], 'app.js')
+        self.assertEqual(
+            [(section['offset'], section['map']['sources'])
+             for section in index_map['sections']],
+            [({'line': 0, 'column': 0}, ['../js/lib/a.coffee']),
+             ({'line': 3, 'column': 0}, ['../js/c.coffee'])])
+
+    def test_changed_member_is_read_again(self):
+        self.build_all()
+        path = self.write('js/b.js', 'var b = 3;\n')
+        # Make sure the mtime changes on coarse file systems
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+        self.build_all()
+        self.assertIn('var b = 3;\nvar c', self.read(self.bundle.path))
+        index_map = json.loads(self.read(self.bundle.map_path))
+        self.assertEqual(index_map['sections'][1]['offset']['line'], 2)
+
+    def test_unmatched_patterns_warn(self):
+        bundle = Bundle('bundles/src.js', ['js/*.coffee', 'js/*.js'],
+                        self.root)
+        self.builder.bundles = [bundle]
+        self.assertEqual(
+            self.builder.get_unmatched_patterns(bundle), ['js/*.coffee'])
+        warnings = self.build_all()
+        self.assertIn('js/*.coffee', warnings)
+        self.assertNotIn('js/*.js', warnings)
@@ -0,0 +1,102 @@
+import os
+import subprocess
+import sys
+
+from django.utils import six
+
+from civet import sourcemaps
+from civet.compilers import coffeescript
+from civet.compilers.coffeescript import CoffeescriptCompiler
+from civet.pool import CompilePool
+from civet.stats import CompileStats
+
+from foo.fake_compilers import read_log
+from foo.fake_compilers import write_fake_compiler
+from foo.testcases import FileSystemTestCase
+
+
+class CoffeeBatchTest(FileSystemTestCase):
+    def setUp(self):
+        super(CoffeeBatchTest, self).setUp()
+        self.precompiled_dir = self.path('precompiled')
+        self.coffee = write_fake_compiler(self.root, 'coffee')
+        compiler_class = type('FakeCoffeeCompiler', (CoffeescriptCompiler,),
+                              {'executable': self.coffee})
+        self.compiler = compiler_class(self.precompiled_dir, False)
+        self.compiler.args = ('--compile', '--map')
+        self.compiler.stats = CompileStats()
+        self.stdout, sys.stdout = sys.stdout, six.StringIO()
+        self.addCleanup(setattr, sys, 'stdout', self.stdout)
+
+    def add(self, name, content='x = 1'):
+        src = self.write('static/' + name, content)
+        dst = self.path('precompiled/' + name.replace('.coffee', '.js'))
+        return src, dst
+
+    def submit_all(self, files):
+        pool = CompilePool(2)
+        self.compiler.submit_all(files, pool)
+        errors = pool.shutdown()
+        sourcemaps.pipeline.wait()
+        return errors
+
+    def get_batches(self):
+        return sorted(
+            [os.path.basename(arg) for arg in args if arg.endswith('.coffee')]
+            for args in read_log(self.coffee))
+
+    def test_one_process_per_directory(self):
+        files = [self.add('a/one.coffee'), self.add('a/two.coffee'),
+                 self.add('b/three.coffee')]
+        self.assertEqual(self.submit_all(files), [])
+        self.assertEqual(self.get_batches(),
+                         [['one.coffee', 'two.coffee'], ['three.coffee']])
+        for src, dst in files:
+            self.assertTrue(os.path.exists(dst))
+            self.assertTrue(os.path.exists(self.compiler.get_map_path(dst)))
+        self.assertEqual(self.compiler.stats.total(CompileStats.COMPILED), 3)
+
+    def test_batch_size(self):
+        self.patch(coffeescript, 'batch_size', 2)
+        files = [self.add('a/{0}.coffee'.format(i)) for i in range(3)]
+        self.submit_all(files)
+        self.assertEqual(self.get_batches(),
+                         [['0.coffee', '1.coffee'], ['2.coffee']])
+
+    def test_up_to_date_files_are_left_out(self):
+        files = [self.add('a/one.coffee'), self.add('a/two.coffee')]
+        self.submit_all(files)
+        os.utime(files[0][0], (0, 0))
+        os.utime(files[1][0], None)
+        os.utime(files[1][1], (0, 0))
+        self.submit_all(files)
+        self.assertEqual(self.get_batches(),
+                         [['one.coffee', 'two.coffee'], ['two.coffee']])
+
+    def test_failed_batch_falls_back_to_each_file(self):
+        files = [self.add('a/good.coffee'), self.add('a/bad.coffee', '@error'),
+                 self.add('a/fine.coffee')]
+        errors = self.submit_all(files)
+        self.assertEqual(
+            self.get_batches(),
+            [['bad.coffee'], ['bad.coffee', 'fine.coffee', 'good.coffee'],
+             ['fine.coffee'], ['good.coffee']])
+        # The error is reported against the file that caused it
+        (src, err), = errors
+        self.assertEqual(src, files[1][0])
+        self.assertIn('@error in', err.output)
+        self.assertTrue(os.path.exists(files[0][1]))
+        self.assertFalse(os.path.exists(files[1][1]))
+        self.assertTrue(os.path.exists(files[2][1]))
+
+    def test_fallback_without_pool(self):
+        files = [self.add('a/good.coffee'), self.add('a/bad.coffee', '@error')]
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.compiler.compile_batch(files)
+        self.assertTrue(os.path.exists(files[0][1]))
+        self.assertEqual(len(read_log(self.coffee)), 3)
+
+    def test_messages_are_printed(self):
+        self.submit_all([self.add('a/warn.coffee')])
+        self.assertIn('CoffeeScript messages for', sys.stdout.getvalue())
+        self.assertIn('Warning: be careful', sys.stdout.getvalue())
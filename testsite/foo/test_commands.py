@@ -0,0 +1,138 @@
+import os
+import shutil
+import sys
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test.utils import override_settings
+from django.utils import six
+
+from civet import asset_precompiler
+from civet import diagnostics
+from civet.compilers.coffeescript import CoffeescriptCompiler
+from civet.compilers.sass import SassCompiler
+from civet.diagnostics import CompileErrorLog
+from civet.diagnostics import read_compile_errors
+from civet.management.commands import civet_precompile
+
+from foo.fake_compilers import read_log
+from foo.fake_compilers import write_fake_compiler
+from foo.testcases import FileSystemTestCase
+
+
+class PrecompileTestCase(FileSystemTestCase):
+    """Sets up a project with a CoffeeScript source and a Sass stylesheet,
+    and fake compilers for them.
+    """
+
+    def setUp(self):
+        super(PrecompileTestCase, self).setUp()
+        self.precompiled_dir = self.path('precompiled')
+        self.write('static/coffee/app.coffee', 'app = 1')
+        self.write('static/sass/main.scss', '@import "colors";')
+        self.write('static/sass/_colors.scss', '$red: #f00;')
+
+        self.coffee = write_fake_compiler(self.root, 'coffee')
+        self.sass = write_fake_compiler(self.root, 'sass')
+        classes = [
+            type('FakeCoffeeCompiler', (CoffeescriptCompiler,),
+                 {'executable': self.coffee}),
+            type('FakeSassCompiler', (SassCompiler,),
+                 {'executable': self.sass}),
+        ]
+        self.patch(asset_precompiler, 'precompiled_assets_dir',
+                   self.precompiled_dir)
+        self.patch(asset_precompiler, 'compiler_classes', classes)
+        self.patch(civet_precompile, 'compiler_classes', classes)
+        self.errors_path = os.path.join(
+            self.precompiled_dir, diagnostics.ERRORS_FILENAME)
+        self.patch(diagnostics, '_error_log',
+                   CompileErrorLog(self.errors_path))
+        settings = override_settings(
+            STATICFILES_DIRS=(self.path('static'),),
+            STATICFILES_FINDERS=[
+                'django.contrib.staticfiles.finders.FileSystemFinder',
+            ])
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def call_command(self, *args):
+        out = six.StringIO()
+        stdout, sys.stdout = sys.stdout, six.StringIO()
+        stderr, sys.stderr = sys.stderr, six.StringIO()
+        try:
+            call_command('civet_precompile', *args, stdout=out)
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        return out.getvalue()
+
+
+class CivetPrecompileTest(PrecompileTestCase):
+    def test_everything_is_compiled(self):
+        output = self.call_command()
+        self.assertIn('Compiled 2 files, 0 up to date', output)
+        self.assertIn('CoffeeScript: 1 compiled, 0 up to date, 0 failed',
+                      output)
+        self.assertTrue(os.path.exists(self.path('precompiled/coffee/app.js')))
+        self.assertTrue(os.path.exists(self.path('precompiled/sass/main.css')))
+        # Partials are only compiled into the stylesheets importing them
+        self.assertFalse(
+            os.path.exists(self.path('precompiled/sass/_colors.css')))
+
+    def test_up_to_date_files_are_skipped(self):
+        self.call_command()
+        output = self.call_command()
+        self.assertIn('Compiled 0 files, 2 up to date', output)
+        self.assertEqual(len(read_log(self.coffee)), 1)
+
+    def test_force(self):
+        self.call_command()
+        output = self.call_command('--force')
+        self.assertIn('Compiled 2 files, 0 up to date', output)
+        self.assertEqual(len(read_log(self.coffee)), 2)
+
+    def test_compiler(self):
+        output = self.call_command('--compiler', 'coffee')
+        self.assertIn('Compiled 1 files', output)
+        self.assertFalse(os.path.exists(self.path('precompiled/sass')))
+        with self.assertRaises(CommandError):
+            self.call_command('--compiler', 'less')
+
+    def test_compile_error(self):
+        self.write('static/coffee/app.coffee', '@error')
+        with self.assertRaises(CommandError):
+            self.call_command()
+        self.assertEqual(list(read_compile_errors(self.errors_path)),
+                         [self.path('static/coffee/app.coffee')])
+
+    def test_dry_run_writes_nothing(self):
+        output = self.call_command('--dry-run')
+        self.assertIn('Would compile 2 files, 0 up to date', output)
+        self.assertFalse(os.path.exists(self.precompiled_dir))
+        self.assertEqual(read_log(self.coffee), [])
+        self.assertEqual(read_log(self.sass), [])
+
+    def test_dry_run_leaves_existing_outputs_alone(self):
+        self.write('static/coffee/broken.coffee', '@error')
+        with self.assertRaises(CommandError):
+            self.call_command()
+        os.remove(self.path('static/coffee/broken.coffee'))
+        shutil.rmtree(self.path('precompiled/sass'))
+        with open(self.errors_path) as f:
+            errors = f.read()
+
+        output = self.call_command('--dry-run')
+        self.assertIn('Would compile 1 files, 1 up to date', output)
+        self.assertFalse(os.path.exists(self.path('precompiled/sass')))
+        # The error of the deleted source is only forgotten by a real run
+        with open(self.errors_path) as f:
+            self.assertEqual(f.read(), errors)
+
+    def test_other_files_in_the_precompiled_dir_are_kept(self):
+        vendor = self.write('precompiled/vendor/lib.js', 'lib = 1')
+        self.call_command()
+        self.assertTrue(os.path.exists(vendor))
+
+        self.patch(asset_precompiler, 'remove_orphaned_outputs', True)
+        self.call_command()
+        self.assertFalse(os.path.exists(vendor))
@@ -0,0 +1,97 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from civet.compile_queue import CompileQueue
+from civet.scheduler import scheduler
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class CompileQueueTest(SimpleTestCase):
+    def make_queue(self, debounce=0.05, max_workers=2):
+        queue = CompileQueue(debounce=debounce, max_workers=max_workers)
+        self.addCleanup(queue.stop)
+        return queue
+
+    def test_burst_of_puts_runs_once(self):
+        queue = self.make_queue(debounce=0.1)
+        calls = []
+        for i in range(5):
+            queue.put('foo.coffee', calls.append, i)
+        self.assertTrue(wait_for(lambda: calls))
+        time.sleep(0.2)
+        # Only the last job put is run
+        self.assertEqual(calls, [4])
+
+    def test_debounce_delays_job(self):
+        queue = self.make_queue(debounce=0.3)
+        calls = []
+        start = time.time()
+        queue.put('foo.coffee', lambda: calls.append(time.time()))
+        self.assertTrue(wait_for(lambda: calls))
+        self.assertGreaterEqual(calls[0] - start, 0.25)
+
+    def test_same_key_never_runs_concurrently(self):
+        queue = self.make_queue(debounce=0, max_workers=4)
+        lock = threading.Lock()
+        running = []
+        most_running = []
+        done = []
+
+        def job(i):
+            with lock:
+                running.append(i)
+                most_running.append(len(running))
+            time.sleep(0.1)
+            with lock:
+                running.remove(i)
+            done.append(i)
+
+        queue.put('foo.coffee', job, 1)
+        self.assertTrue(wait_for(lambda: running))
+        queue.put('foo.coffee', job, 2)
+        self.assertTrue(wait_for(lambda: len(done) == 2))
+        self.assertEqual(done, [1, 2])
+        self.assertEqual(max(most_running), 1)
+
+    def test_different_keys_run_concurrently(self):
+        queue = self.make_queue(debounce=0, max_workers=2)
+        both_running = threading.Event()
+        running = []
+
+        def job(i):
+            running.append(i)
+            if len(running) == 2:
+                both_running.set()
+            both_running.wait(5)
+        queue.put('a.coffee', job, 1)
+        queue.put('b.coffee', job, 2)
+        self.assertTrue(both_running.wait(5))
+
+    def test_requested_output_runs_first(self):
+        queue = self.make_queue(debounce=0, max_workers=1)
+        release = threading.Event()
+        order = []
+        queue.put('blocker', release.wait, 5)
+        time.sleep(0.1)
+        queue.put('a.coffee', order.append, 'a', output='/out/a.js')
+        queue.put('b.coffee', order.append, 'b', output='/out/b.js')
+        scheduler.request('/out/a.js')
+        release.set()
+        self.assertTrue(wait_for(lambda: len(order) == 2))
+        # Without the request, b, put last, would run first
+        self.assertEqual(order, ['a', 'b'])
+
+    def test_unexpected_keyword_argument(self):
+        queue = self.make_queue()
+        self.assertRaises(
+            TypeError, queue.put, 'foo.coffee', len, 'x', outputs=['x'])
@@ -0,0 +1,142 @@
+import json
+import os
+
+from django.http import HttpResponse
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from civet.diagnostics import ERRORS_FILENAME
+from civet.diagnostics import CompileErrorLog
+from civet.diagnostics import read_compile_errors
+from civet.middleware import ErrorOverlayMiddleware
+from civet.stats import CompileStats
+from foo.testcases import FileSystemTestCase
+
+
+class FakeCompiler(object):
+    name = 'Sass'
+
+
+class CompileErrorLogTest(FileSystemTestCase):
+    def setUp(self):
+        super(CompileErrorLogTest, self).setUp()
+        self.errors_path = self.path(ERRORS_FILENAME)
+        self.src = self.write('main.scss')
+
+    def test_failures_are_saved(self):
+        log = CompileErrorLog(self.errors_path)
+        log.record(self.src, CompileStats.FAILED, FakeCompiler(), 0.5, 65,
+                   'Error: broken')
+        self.assertEqual(read_compile_errors(self.errors_path), {self.src: {
+            'compiler': 'Sass',
+            'returncode': 65,
+            'seconds': 0.5,
+            'messages': 'Error: broken',
+        }})
+        # Loaded again by the next process
+        self.assertEqual(CompileErrorLog(self.errors_path).get_data(),
+                         read_compile_errors(self.errors_path))
+
+    def test_success_clears_the_error(self):
+        log = CompileErrorLog(self.errors_path)
+        log.record(self.src, CompileStats.FAILED, FakeCompiler(), 0.5, 1)
+        log.record(self.src, CompileStats.COMPILED, FakeCompiler(), 0.5, 0)
+        self.assertEqual(read_compile_errors(self.errors_path), {})
+
+    def test_unchanged_log_is_not_saved(self):
+        log = CompileErrorLog(self.errors_path)
+        log.record(self.src, CompileStats.SKIPPED)
+        self.assertFalse(os.path.exists(self.errors_path))
+        log.record(self.src, CompileStats.FAILED, FakeCompiler(), 0.5, 1)
+        os.remove(self.errors_path)
+        log.record(self.src, CompileStats.FAILED, FakeCompiler(), 0.5, 1)
+        self.assertFalse(os.path.exists(self.errors_path))
+
+    def test_evict_stale(self):
+        log = CompileErrorLog(self.errors_path)
+        log.record(self.src, CompileStats.FAILED, FakeCompiler(), 0.5, 1)
+        os.remove(self.src)
+        log.evict_stale()
+        self.assertEqual(read_compile_errors(self.errors_path), {})
+
+    def test_missing_directory_is_not_created(self):
+        path = self.path('precompiled/' + ERRORS_FILENAME)
+        log = CompileErrorLog(path)
+        log.record(self.src, CompileStats.FAILED, FakeCompiler(), 0.5, 1)
+        self.assertFalse(os.path.exists(os.path.dirname(path)))
+
+
+class ErrorOverlayMiddlewareTest(FileSystemTestCase):
+    def setUp(self):
+        super(ErrorOverlayMiddlewareTest, self).setUp()
+        settings = override_settings(DEBUG=True,
+                                     CIVET_PRECOMPILED_ASSET_DIR=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.middleware = ErrorOverlayMiddleware()
+        self.request = RequestFactory().get('/')
+
+    def write_errors(self, errors, mtime=1000):
+        path = self.write(ERRORS_FILENAME, json.dumps(errors))
+        os.utime(path, (mtime, mtime))
+
+    def process(self, response):
+        return self.middleware.process_response(self.request, response)
+
+    def error(self, messages='Error: <broken>'):
+        return {'/static/sass/main.scss': {
+            'compiler': 'Sass', 'returncode': 65, 'seconds': 0.1,
+            'messages': messages}}
+
+    def test_overlay_is_added_before_the_body_end(self):
+        self.write_errors(self.error())
+        response = HttpResponse('<html><body><p>Hi</p></BODY></html>')
+        # As if set by another middleware
+        response['Content-Length'] = str(len(response.content))
+        response = self.process(response)
+        content = response.content.decode('utf-8')
+        self.assertIn('1 asset(s) failed to compile', content)
+        self.assertIn('Sass: /static/sass/main.scss (exit status 65)',
+                      content)
+        self.assertIn('Error: &lt;broken&gt;', content)
+        self.assertTrue(content.endswith('</div></BODY></html>'))
+        self.assertEqual(response['Content-Length'],
+                         str(len(response.content)))
+
+    def test_overlay_is_appended_without_a_body(self):
+        self.write_errors(self.error())
+        response = self.process(HttpResponse('<p>Hi</p>'))
+        self.assertTrue(response.content.startswith(b'<p>Hi</p><div'))
+
+    def test_no_errors(self):
+        self.assertEqual(self.process(HttpResponse('<p>Hi</p>')).content,
+                         b'<p>Hi</p>')
+        self.write_errors({})
+        self.assertEqual(self.process(HttpResponse('<p>Hi</p>')).content,
+                         b'<p>Hi</p>')
+
+    def test_responses_left_alone(self):
+        self.write_errors(self.error())
+        json_response = HttpResponse('{}', content_type='application/json')
+        self.assertEqual(self.process(json_response).content, b'{}')
+
+        # Compressed by an earlier middleware
+        response = HttpResponse(b'\x1f\x8b')
+        response['Content-Encoding'] = 'gzip'
+        self.assertEqual(self.process(response).content, b'\x1f\x8b')
+
+        response = StreamingHttpResponse(iter([b'<p>Hi</p>']))
+        self.assertEqual(b''.join(self.process(response)), b'<p>Hi</p>')
+
+        with self.settings(DEBUG=False):
+            self.assertEqual(self.process(HttpResponse('<p>Hi</p>')).content,
+                             b'<p>Hi</p>')
+
+    def test_errors_are_read_again_when_the_file_changes(self):
+        self.write_errors(self.error('first'))
+        self.assertIn(b'first', self.process(HttpResponse('')).content)
+        self.write_errors(self.error('second'))
+        self.assertIn(b'first', self.process(HttpResponse('')).content)
+        self.write_errors(self.error('second'), mtime=2000)
+        self.assertIn(b'second', self.process(HttpResponse('')).content)
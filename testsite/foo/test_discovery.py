@@ -0,0 +1,110 @@
+import os
+import shutil
+
+from django.contrib.staticfiles.utils import get_files
+from django.core.files.storage import FileSystemStorage
+
+from civet.discovery import DirectoryListingCache
+from civet.discovery import is_ignored_dir
+from civet.discovery import listdir
+from civet.discovery import walk_storage
+from foo.testcases import FileSystemTestCase
+
+
+class CountingListingCache(object):
+    """Lists directories directly, counting which ones were listed."""
+
+    def __init__(self):
+        self.listed = []
+
+    def listdir(self, path):
+        self.listed.append(path)
+        return listdir(path)
+
+
+class WalkStorageTest(FileSystemTestCase):
+    def setUp(self):
+        super(WalkStorageTest, self).setUp()
+        for name in ['coffee/app.coffee', 'coffee/app.coffee~',
+                     'coffee/lib/util.coffee', 'sass/main.scss',
+                     'sass/.sass-cache/main.scssc', 'CVS/Entries',
+                     'vendor/bower_components/jquery/jquery.js',
+                     'top.js']:
+            self.write(name)
+
+    def walk(self, ignore_patterns, ignore_dirs=(), listing_cache=None):
+        return sorted(walk_storage(
+            self.root, ignore_patterns, ignore_dirs, listing_cache))
+
+    def test_same_files_as_get_files(self):
+        ignore_patterns = ['CVS', '.*', '*~']
+        storage = FileSystemStorage(location=self.root)
+        expected = sorted(
+            (path, storage.path(path))
+            for path in get_files(storage, ignore_patterns))
+        self.assertEqual(self.walk(ignore_patterns), expected)
+        self.assertEqual([path for path, _ in expected], [
+            os.path.join('coffee', 'app.coffee'),
+            os.path.join('coffee', 'lib', 'util.coffee'),
+            os.path.join('sass', 'main.scss'),
+            'top.js',
+            os.path.join('vendor', 'bower_components', 'jquery',
+                         'jquery.js'),
+        ])
+
+    def test_ignored_directories_are_not_listed(self):
+        listing_cache = CountingListingCache()
+        files = self.walk(['.*'], ['bower_components'], listing_cache)
+        self.assertNotIn(
+            os.path.join(self.root, 'vendor', 'bower_components'),
+            listing_cache.listed)
+        self.assertNotIn(os.path.join(self.root, 'sass', '.sass-cache'),
+                         listing_cache.listed)
+        self.assertNotIn(
+            os.path.join('vendor', 'bower_components', 'jquery', 'jquery.js'),
+            [path for path, _ in files])
+        self.assertIn(os.path.join(self.root, 'vendor'),
+                      listing_cache.listed)
+
+    def test_ignored_location(self):
+        self.assertEqual(self.walk([], [os.path.basename(self.root)]), [])
+
+    def test_is_ignored_dir(self):
+        self.assertTrue(is_ignored_dir('/a/node_modules/b', ['node_modules']))
+        self.assertFalse(is_ignored_dir('/a/modules/b', ['node_modules']))
+
+
+class DirectoryListingCacheTest(FileSystemTestCase):
+    def setUp(self):
+        super(DirectoryListingCacheTest, self).setUp()
+        self.dir = self.path('static')
+        os.makedirs(self.path('static/js'))
+        self.write('static/app.js')
+
+    def test_listing(self):
+        cache = DirectoryListingCache(self.root)
+        self.assertEqual(cache.listdir(self.dir), (['js'], ['app.js']))
+
+    def test_listing_is_reused_until_the_directory_changes(self):
+        cache = DirectoryListingCache(self.root)
+        cache.listdir(self.dir)
+        cache.save()
+        mtime = os.stat(self.dir).st_mtime
+
+        self.write('static/new.js')
+        # Unchanged as far as the cache can tell
+        os.utime(self.dir, (mtime, mtime))
+        cache = DirectoryListingCache(self.root)
+        self.assertEqual(cache.listdir(self.dir), (['js'], ['app.js']))
+
+        os.utime(self.dir, (mtime + 10, mtime + 10))
+        self.assertEqual(cache.listdir(self.dir),
+                         (['js'], ['app.js', 'new.js']))
+
+    def test_deleted_directory(self):
+        cache = DirectoryListingCache(self.root)
+        shutil.rmtree(self.dir)
+        with self.assertRaises(OSError):
+            cache.listdir(self.dir)
+        self.assertEqual(
+            list(walk_storage(self.dir, [], [], cache)), [])
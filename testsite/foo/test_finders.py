@@ -0,0 +1,106 @@
+import os
+import sys
+
+from django.test.utils import override_settings
+from django.utils import six
+
+from civet import asset_precompiler
+from civet import finders
+from civet.compilers.coffeescript import CoffeescriptCompiler
+from civet.compilers.sass import SassCompiler
+from civet.finders import LazyCompileFinder
+
+from foo.fake_compilers import read_log
+from foo.fake_compilers import write_fake_compiler
+from foo.testcases import FileSystemTestCase
+
+
+class LazyCompileFinderTest(FileSystemTestCase):
+    def setUp(self):
+        super(LazyCompileFinderTest, self).setUp()
+        self.precompiled_dir = self.path('precompiled')
+        self.write('static_a/coffee/app.coffee', 'app = 1')
+        self.write('static_a/sass/main.scss', '@import "colors";')
+        self.write('static_b/_colors.scss', '$red: #f00;')
+        self.write('static_b/css/plain.css', 'a {}')
+
+        self.coffee = write_fake_compiler(self.root, 'coffee')
+        self.sass = write_fake_compiler(self.root, 'sass')
+        self.patch(finders, 'precompiled_assets_dir', self.precompiled_dir)
+        self.patch(asset_precompiler, 'precompiled_assets_dir',
+                   self.precompiled_dir)
+        self.patch(asset_precompiler, 'compiler_classes', [
+            type('FakeCoffeeCompiler', (CoffeescriptCompiler,),
+                 {'executable': self.coffee}),
+            type('FakeSassCompiler', (SassCompiler,),
+                 {'executable': self.sass}),
+        ])
+        # The precompiled assets are served as static files too, and are
+        # found before the sources
+        settings = override_settings(
+            STATICFILES_DIRS=[self.precompiled_dir, self.path('static_a'),
+                              self.path('static_b')],
+            STATICFILES_FINDERS=[
+                'civet.finders.LazyCompileFinder',
+                'django.contrib.staticfiles.finders.FileSystemFinder',
+            ])
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.finder = LazyCompileFinder()
+
+    def read(self, name):
+        with open(self.path(name)) as f:
+            return f.read()
+
+    def find(self, path):
+        stdout, sys.stdout = sys.stdout, six.StringIO()
+        stderr, sys.stderr = sys.stderr, six.StringIO()
+        try:
+            return self.finder.find(path), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def test_output_is_compiled_on_request(self):
+        found, _ = self.find('coffee/app.js')
+        self.assertEqual(found, self.path('precompiled/coffee/app.js'))
+        self.assertIn('/* compiled from app.coffee */',
+                      self.read('precompiled/coffee/app.js'))
+
+        # Up to date, so not compiled again
+        self.find('coffee/app.js')
+        self.assertEqual(len(read_log(self.coffee)), 1)
+
+    def test_stale_output_is_compiled_before_it_is_served(self):
+        self.write('precompiled/coffee/app.js', 'stale')
+        os.utime(self.path('precompiled/coffee/app.js'), (0, 0))
+        found, _ = self.find('coffee/app.js')
+        self.assertEqual(found, self.path('precompiled/coffee/app.js'))
+        self.assertIn('app = 1', self.read('precompiled/coffee/app.js'))
+
+    def test_files_that_are_not_outputs(self):
+        self.assertEqual(self.find('css/plain.css'), ([], ''))
+        self.assertEqual(self.find('coffee/app.coffee'), ([], ''))
+        self.assertEqual(self.find('coffee/missing.js'), ([], ''))
+        self.assertEqual(read_log(self.coffee), [])
+
+    def test_compile_error(self):
+        self.write('static_a/coffee/app.coffee', '@error')
+        found, errors = self.find('coffee/app.js')
+        self.assertEqual(found, [])
+        self.assertIn('@error in', errors)
+
+    def test_load_paths_are_the_static_files_directories(self):
+        self.assertEqual(self.finder.get_roots(),
+                         [self.path('static_a'), self.path('static_b')])
+        sass_compiler = self.finder.get_compilers()[1]
+        self.assertEqual(sass_compiler.dependency_graph.load_paths,
+                         [self.path('static_a'), self.path('static_b')])
+
+    def test_import_from_another_directory(self):
+        found, errors = self.find('sass/main.css')
+        self.assertEqual(found, self.path('precompiled/sass/main.css'))
+        self.assertEqual(errors, '')
+        sass_compiler = self.finder.get_compilers()[1]
+        main = self.path('static_a/sass/main.scss')
+        self.assertEqual(sass_compiler.get_dependencies(main),
+                         set([self.path('static_b/_colors.scss')]))
@@ -0,0 +1,143 @@
+from distutils.spawn import find_executable
+import os
+import subprocess
+import sys
+import unittest
+
+from django.utils import six
+
+from civet.compilers.node_worker import NodeWorker
+from civet.compilers.node_worker import NodeWorkerUnavailable
+from foo.testcases import FileSystemTestCase
+
+
+# Stands in for node_worker.js, printing around its responses like compilers
+# and their plugins may
+FAKE_WORKER = '''
+import json, sys, time
+print('loading plugins')
+print(json.dumps({'ready': True}))
+sys.stdout.flush()
+for line in sys.stdin:
+    job = json.loads(line)
+    print('deprecated option')
+    print('42')
+    if job['src'].endswith('hang.coffee'):
+        sys.stdout.flush()
+        time.sleep(60)
+    if job['src'].endswith('stale.coffee'):
+        # A response to some other job comes first
+        print(json.dumps({'id': job['id'] - 1, 'ok': False}))
+    if job['src'].endswith('bad.coffee'):
+        response = {'id': job['id'], 'ok': False, 'error': 'syntax error',
+                    'output': 'line 1: unexpected indent\\n'}
+    else:
+        with open(job['dst'], 'w') as f:
+            f.write('compiled')
+        response = {'id': job['id'], 'ok': True}
+    print(json.dumps(response))
+    sys.stdout.flush()
+'''
+
+# A compiler module for the real node_worker.js, which prints like CoffeeScript
+# does when it warns
+FAKE_COFFEE_MODULE = '''
+exports.compile = function(source, options) {
+  console.log('warning: ' + options.filename);
+  console.error('more on stderr');
+  if (source.indexOf('@error') !== -1) {
+    throw new Error('unexpected @error');
+  }
+  return '// compiled\\n' + source;
+};
+'''
+
+
+class NodeWorkerTest(FileSystemTestCase):
+    def setUp(self):
+        super(NodeWorkerTest, self).setUp()
+        script = self.write('worker.py', FAKE_WORKER)
+        self.worker = NodeWorker('node', 'coffee', self.root, [])
+        self.worker.args = [sys.executable, script]
+        self.addCleanup(self.worker.stop)
+        self.stdout, sys.stdout = sys.stdout, six.StringIO()
+        self.addCleanup(setattr, sys, 'stdout', self.stdout)
+
+    def test_printed_lines_are_returned(self):
+        dst_path = self.path('foo.js')
+        messages = self.worker.compile(self.path('foo.coffee'), dst_path)
+        with open(dst_path) as f:
+            self.assertEqual(f.read(), 'compiled')
+        self.assertEqual(messages, 'deprecated option\n42')
+        # Only what was printed while loading goes to stdout
+        self.assertEqual(sys.stdout.getvalue(), 'loading plugins\n')
+
+    def test_responses_to_other_jobs_are_skipped(self):
+        dst_path = self.path('stale.js')
+        self.worker.compile(self.path('stale.coffee'), dst_path)
+        self.assertTrue(os.path.exists(dst_path))
+
+    def test_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            self.worker.compile(self.path('bad.coffee'), self.path('bad.js'))
+        self.assertEqual(
+            context.exception.output,
+            'syntax error\nline 1: unexpected indent\ndeprecated option\n42')
+
+    def test_hung_worker_is_restarted(self):
+        self.worker.timeout = 0.5
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            self.worker.compile(self.path('hang.coffee'), self.path('hang.js'))
+        self.assertEqual(
+            context.exception.output,
+            'Compile worker timed out after 0.5 seconds\n'
+            'deprecated option\n42')
+        self.assertIsNone(self.worker.process)
+
+        dst_path = self.path('foo.js')
+        self.worker.compile(self.path('foo.coffee'), dst_path)
+        self.assertTrue(os.path.exists(dst_path))
+
+    def test_start_timeout(self):
+        self.worker.args = [sys.executable, '-c',
+                            'import time; time.sleep(60)']
+        self.worker.timeout = 0.5
+        with self.assertRaises(NodeWorkerUnavailable) as context:
+            self.worker.start()
+        self.assertIn('did not start within 0.5 seconds',
+                      str(context.exception))
+        self.assertIsNone(self.worker.process)
+
+
+@unittest.skipUnless(find_executable('node'), 'node is not installed')
+class NodeWorkerScriptTest(FileSystemTestCase):
+    def setUp(self):
+        super(NodeWorkerScriptTest, self).setUp()
+        self.write('node_modules/fake-coffee/index.js', FAKE_COFFEE_MODULE)
+        self.worker = NodeWorker(
+            find_executable('node'), 'coffee', self.root,
+            ['missing-coffee', 'fake-coffee'])
+        self.addCleanup(self.worker.stop)
+
+    def test_output_is_captured_per_job(self):
+        src_path = self.write('foo.coffee', 'x = 1')
+        dst_path = self.path('foo.js')
+        messages = self.worker.compile(src_path, dst_path)
+        self.assertEqual(
+            messages, 'warning: {0}\nmore on stderr'.format(src_path))
+        with open(dst_path) as f:
+            self.assertEqual(f.read(), '// compiled\nx = 1')
+
+    def test_failure_includes_output(self):
+        src_path = self.write('bad.coffee', '@error')
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            self.worker.compile(src_path, self.path('bad.js'))
+        self.assertIn('unexpected @error', context.exception.output)
+        self.assertIn('more on stderr', context.exception.output)
+
+    def test_module_not_found(self):
+        self.worker.args[4:] = ['missing-coffee']
+        with self.assertRaises(NodeWorkerUnavailable) as context:
+            self.worker.start()
+        self.assertIn('Cannot load any of missing-coffee',
+                      str(context.exception))
@@ -0,0 +1,174 @@
+import os
+import shutil
+import sys
+import time
+
+from django.test import SimpleTestCase
+from django.utils import six
+from watchdog.events import DirCreatedEvent
+from watchdog.events import FileModifiedEvent
+from watchdog.events import FileMovedEvent
+
+from civet import asset_precompiler
+from civet.compilers.base_compiler import CompilerObserver
+from civet.compilers.base_compiler import RoutingEventHandler
+
+from foo.test_commands import PrecompileTestCase
+from foo.testcases import FileSystemTestCase
+
+
+class RecordingHandler(object):
+    def __init__(self):
+        self.events = []
+
+    def dispatch(self, event):
+        self.events.append((event.event_type, event.src_path))
+
+
+class RoutingEventHandlerTest(SimpleTestCase):
+    def setUp(self):
+        self.router = RoutingEventHandler(
+            ignore_patterns=['*~'], ignore_dirs=['node_modules'],
+            excluded_dirs=['/project/precompiled'])
+        self.coffee = RecordingHandler()
+        self.sass = RecordingHandler()
+        self.router.add_route('/project/static/coffee', self.coffee)
+        self.router.add_route('/project/static/coffee/lib', self.coffee)
+        self.router.add_route('/project/static', self.sass)
+
+    def test_roots(self):
+        self.assertEqual(self.router.get_roots(), ['/project/static'])
+
+    def test_event_goes_to_each_handler_once(self):
+        event = FileModifiedEvent('/project/static/coffee/lib/a.coffee')
+        self.router.dispatch(event)
+        self.assertEqual(self.coffee.events,
+                         [('modified', event.src_path)])
+        self.assertEqual(self.sass.events, [('modified', event.src_path)])
+
+    def test_event_in_new_subdirectory(self):
+        self.router.dispatch(
+            FileModifiedEvent('/project/static/coffee/new/dir/a.coffee'))
+        self.assertEqual(len(self.coffee.events), 1)
+
+    def test_event_elsewhere(self):
+        self.router.dispatch(FileModifiedEvent('/project/static/a.scss'))
+        self.assertEqual(self.coffee.events, [])
+        self.assertEqual(len(self.sass.events), 1)
+        self.router.dispatch(FileModifiedEvent('/project/settings.py'))
+        self.assertEqual(len(self.sass.events), 1)
+
+    def test_ignored_events(self):
+        for path in ['/project/static/coffee/node_modules/x/a.coffee',
+                     '/project/static/coffee/a.coffee~',
+                     '/project/precompiled/coffee/a.js']:
+            self.router.dispatch(FileModifiedEvent(path))
+        self.assertEqual(self.coffee.events, [])
+        self.assertEqual(self.sass.events, [])
+
+    def test_move_out_of_ignored_file(self):
+        # Editors save by moving a temporary file over the source
+        event = FileMovedEvent('/project/static/coffee/a.coffee~',
+                               '/project/static/coffee/a.coffee')
+        self.router.dispatch(event)
+        self.assertEqual(self.coffee.events, [('moved', event.src_path)])
+
+
+class CompilerObserverTest(FileSystemTestCase):
+    def setUp(self):
+        super(CompilerObserverTest, self).setUp()
+        self.write('coffee/a.coffee')
+        self.write('coffee/lib/b.coffee')
+        self.write('js/c.js')
+        self.write('js/node_modules/pkg/index.js')
+        self.write('precompiled/coffee/a.js')
+        self.observer = CompilerObserver(
+            ignore_dirs=['node_modules'],
+            excluded_dirs=[self.path('precompiled')])
+        self.addCleanup(self.observer.compile_queue.stop)
+        self.handler = RecordingHandler()
+        self.observer.add_route(self.root, self.handler)
+
+    def get_watches(self):
+        return sorted((emitter.watch.path, emitter.watch.is_recursive)
+                      for emitter in self.observer.emitters)
+
+    def test_ignored_directories_are_not_watched(self):
+        self.assertEqual(self.observer.plan_watches(self.root), [
+            (self.root, False),
+            (self.path('coffee'), True),
+            (self.path('js'), False),
+        ])
+
+    def test_tree_without_ignored_directories(self):
+        shutil.rmtree(self.path('js/node_modules'))
+        shutil.rmtree(self.path('precompiled'))
+        self.assertEqual(self.observer.plan_watches(self.root),
+                         [(self.root, True)])
+
+    def test_new_directory_in_split_directory(self):
+        self.observer.schedule_watches(self.root)
+        self.write('js/lib/d.js')
+        self.write('js/lib/node_modules/pkg/index.js')
+        self.observer.split_dir_handler.dispatch(
+            DirCreatedEvent(self.path('js/lib')))
+        self.assertEqual(self.get_watches(), [
+            (self.root, False),
+            (self.path('coffee'), True),
+            (self.path('js'), False),
+            (self.path('js/lib'), False),
+        ])
+        # Files written before the watch was set up are not missed
+        self.assertEqual(self.handler.events,
+                         [('created', self.path('js/lib/d.js'))])
+
+    def test_new_ignored_directory(self):
+        self.observer.schedule_watches(self.root)
+        self.write('node_modules/pkg/index.js')
+        self.observer.split_dir_handler.dispatch(
+            DirCreatedEvent(self.path('node_modules')))
+        self.assertNotIn((self.path('node_modules'), True), self.get_watches())
+        self.assertEqual(self.handler.events, [])
+
+
+class StartWatchingTest(PrecompileTestCase):
+    """Sources in new directories of the static files directories are
+    compiled while watching.
+    """
+
+    def setUp(self):
+        super(StartWatchingTest, self).setUp()
+        self.stdout, sys.stdout = sys.stdout, six.StringIO()
+        self.addCleanup(setattr, sys, 'stdout', self.stdout)
+
+    def start_watching(self, watcher):
+        self.patch(asset_precompiler, 'watcher', watcher)
+        compilers = asset_precompiler.create_compilers()
+        src = self.path('static/coffee/app.coffee')
+        files = {compilers[0]: [(src, self.path('precompiled/coffee/app.js'))],
+                 compilers[1]: []}
+        observer = asset_precompiler.create_observer()
+        self.addCleanup(observer.compile_queue.stop)
+        self.addCleanup(observer.stop)
+        asset_precompiler.start_watching(compilers, files, observer)
+
+    def wait_for(self, name):
+        deadline = time.time() + 10
+        while not os.path.exists(self.path(name)):
+            if time.time() > deadline:
+                self.fail('{0} was not compiled'.format(name))
+            time.sleep(0.05)
+
+    def check_new_directories(self):
+        self.write('static/newdir/a.coffee', 'a = 1')
+        self.wait_for('precompiled/newdir/a.js')
+        self.write('static/coffee/lib/b.coffee', 'b = 1')
+        self.wait_for('precompiled/coffee/lib/b.js')
+
+    def test_native(self):
+        self.start_watching('native')
+        self.check_new_directories()
+
+    def test_polling(self):
+        self.start_watching('polling')
+        self.check_new_directories()
@@ -0,0 +1,119 @@
+import os
+import shutil
+import time
+
+from civet.polling import PollingCompilerObserver
+from foo.testcases import FileSystemTestCase
+
+
+class FakeCompiler(object):
+    def matches(self, base, ext):
+        return ext == '.coffee'
+
+
+class RecordingHandler(object):
+    compiler = FakeCompiler()
+
+    def __init__(self):
+        self.events = []
+
+    def dispatch(self, event):
+        self.events.append((event.event_type, event.is_directory,
+                            event.src_path))
+
+
+class PollingCompilerObserverTest(FileSystemTestCase):
+    def setUp(self):
+        super(PollingCompilerObserverTest, self).setUp()
+        self.write('coffee/a.coffee')
+        self.write('coffee/notes.txt')
+        self.write('coffee/lib/b.coffee')
+        self.observer = PollingCompilerObserver(ignore_dirs=['ignored'])
+        self.addCleanup(self.observer.compile_queue.stop)
+        self.handler = RecordingHandler()
+        self.observer.add_route(self.root, self.handler)
+        self.observer.track_tree(self.root, time.time())
+
+    def check_directory(self, name):
+        path = self.path(name)
+        entry = self.observer._entries[path]
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            stat_result = None
+        # As if the mtime changed, however coarse it is
+        entry.signature = None
+        return self.observer.check_directory(entry, stat_result, time.time())
+
+    def is_tracked(self, name):
+        return self.path(name) in self.observer._entries
+
+    def test_tracks_sources_and_directories(self):
+        self.assertTrue(self.is_tracked('coffee'))
+        self.assertTrue(self.is_tracked('coffee/lib'))
+        self.assertTrue(self.is_tracked('coffee/a.coffee'))
+        self.assertTrue(self.is_tracked('coffee/lib/b.coffee'))
+        self.assertFalse(self.is_tracked('coffee/notes.txt'))
+
+    def test_added_file(self):
+        self.write('coffee/new.coffee')
+        self.assertTrue(self.check_directory('coffee'))
+        self.assertEqual(self.handler.events, [
+            ('created', False, self.path('coffee/new.coffee'))])
+        self.assertTrue(self.is_tracked('coffee/new.coffee'))
+
+    def test_removed_file(self):
+        os.remove(self.path('coffee/a.coffee'))
+        self.check_directory('coffee')
+        self.assertEqual(self.handler.events, [
+            ('deleted', False, self.path('coffee/a.coffee'))])
+        self.assertFalse(self.is_tracked('coffee/a.coffee'))
+
+    def test_renamed_file(self):
+        os.rename(self.path('coffee/a.coffee'), self.path('coffee/c.coffee'))
+        self.check_directory('coffee')
+        self.assertEqual(self.handler.events, [
+            ('deleted', False, self.path('coffee/a.coffee')),
+            ('created', False, self.path('coffee/c.coffee')),
+        ])
+        self.assertFalse(self.is_tracked('coffee/a.coffee'))
+        self.assertTrue(self.is_tracked('coffee/c.coffee'))
+
+    def test_added_directory(self):
+        self.write('coffee/more/d.coffee')
+        self.check_directory('coffee')
+        self.assertEqual(self.handler.events, [
+            ('created', True, self.path('coffee/more'))])
+        self.assertTrue(self.is_tracked('coffee/more'))
+        self.assertTrue(self.is_tracked('coffee/more/d.coffee'))
+
+    def test_removed_directory(self):
+        shutil.rmtree(self.path('coffee/lib'))
+        self.check_directory('coffee')
+        self.assertEqual(self.handler.events, [
+            ('deleted', False, self.path('coffee/lib/b.coffee')),
+            ('deleted', True, self.path('coffee/lib')),
+        ])
+        self.assertFalse(self.is_tracked('coffee/lib'))
+        self.assertFalse(self.is_tracked('coffee/lib/b.coffee'))
+
+    def test_ignored_directory(self):
+        self.write('coffee/ignored/e.coffee')
+        self.check_directory('coffee')
+        self.assertEqual(self.handler.events, [])
+        self.assertFalse(self.is_tracked('coffee/ignored'))
+
+    def test_unchanged_directory(self):
+        path = self.path('coffee')
+        entry = self.observer._entries[path]
+        self.assertFalse(self.observer.check_directory(
+            entry, os.stat(path), time.time()))
+        self.assertEqual(self.handler.events, [])
+
+    def test_modified_file(self):
+        path = self.path('coffee/a.coffee')
+        self.write('coffee/a.coffee', 'x = 1')
+        entry = self.observer._entries[path]
+        self.assertTrue(self.observer.check_file(
+            entry, os.stat(path), time.time()))
+        self.assertEqual(self.handler.events, [('modified', False, path)])
@@ -0,0 +1,102 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from civet.pool import CompilePool
+from civet.scheduler import scheduler
+
+
+class CompilePoolTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = CompilePool(max_workers=1)
+        self.addCleanup(self.pool.shutdown)
+
+    def block(self):
+        """Occupy the only worker until the returned event is set."""
+        started = threading.Event()
+        release = threading.Event()
+
+        def job():
+            started.set()
+            release.wait(5)
+        self.pool.submit('blocker', job)
+        started.wait(5)
+        return release
+
+    def test_errors_are_collected(self):
+        def fail():
+            raise ValueError('broken')
+        done = []
+        self.pool.submit('bad.coffee', fail)
+        self.pool.submit('good.coffee', done.append, True)
+
+        errors = self.pool.wait()
+        self.assertEqual(len(errors), 1)
+        description, err = errors[0]
+        self.assertEqual(description, 'bad.coffee')
+        self.assertIsInstance(err, ValueError)
+        # Later jobs still ran, and errors are only returned once
+        self.assertEqual(done, [True])
+        self.assertEqual(self.pool.wait(), [])
+
+    def test_shutdown_waits_for_queued_jobs(self):
+        pool = CompilePool(max_workers=2)
+        threads = list(pool._threads)
+        release = threading.Event()
+        done = []
+
+        def job(i):
+            release.wait(5)
+            done.append(i)
+        for i in range(4):
+            pool.submit(str(i), job, i)
+        release.set()
+
+        self.assertEqual(pool.shutdown(), [])
+        self.assertEqual(sorted(done), [0, 1, 2, 3])
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertNotIn(pool, scheduler.get_listeners())
+
+    def test_lower_priority_runs_first(self):
+        release = self.block()
+        order = []
+        for priority in (5, 1, 3):
+            self.pool.submit_with_priority(
+                priority, str(priority), order.append, priority)
+        release.set()
+        self.pool.wait()
+        self.assertEqual(order, [1, 3, 5])
+
+    def test_requested_output_runs_first(self):
+        release = self.block()
+        order = []
+        self.pool.submit_job(0, 'a', order.append, ('a',),
+                             outputs=['/out/a.js'])
+        self.pool.submit_job(10, 'b', order.append, ('b',),
+                             outputs=['/out/b.js'])
+        scheduler.request('/out/b.js')
+        release.set()
+        self.pool.wait()
+        # Promoted jobs are only run once
+        self.assertEqual(order, ['b', 'a'])
+
+    def test_group_limit(self):
+        scheduler.limits['fake-compiler'] = 1
+        self.addCleanup(scheduler.limits.pop, 'fake-compiler')
+        pool = CompilePool(max_workers=3)
+        self.addCleanup(pool.shutdown)
+        lock = threading.Lock()
+        running = []
+        most_running = []
+
+        def job():
+            with lock:
+                running.append(True)
+                most_running.append(len(running))
+            threading.Event().wait(0.05)
+            with lock:
+                running.pop()
+        for i in range(3):
+            pool.submit_job(0, str(i), job, group='fake-compiler')
+        self.assertEqual(pool.wait(), [])
+        self.assertEqual(max(most_running), 1)
@@ -0,0 +1,105 @@
+import json
+import os
+
+from django.test.utils import override_settings
+
+from civet import probe_cache
+from civet.probe_cache import PROBE_CACHE_FILENAME
+from civet.probe_cache import ProbeCache
+from civet.probe_cache import get_environment_key
+from civet.probe_cache import probe
+from foo.testcases import FileSystemTestCase
+
+
+class Counter(object):
+    """A probe returning the given result, counting how often it ran."""
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+
+class ProbeCacheTest(FileSystemTestCase):
+    def setUp(self):
+        super(ProbeCacheTest, self).setUp()
+        self.cache_path = self.path(PROBE_CACHE_FILENAME)
+        self.addCleanup(os.environ.__setitem__, 'PATH', os.environ['PATH'])
+
+    def test_results_are_saved(self):
+        compute = Counter('/usr/bin/sass')
+        self.assertEqual(ProbeCache(self.root).get('executable:sass', compute),
+                         '/usr/bin/sass')
+        self.assertEqual(ProbeCache(self.root).get('executable:sass', compute),
+                         '/usr/bin/sass')
+        self.assertEqual(compute.calls, 1)
+        with open(self.cache_path) as f:
+            data = json.load(f)
+        self.assertEqual(data['results'], {'executable:sass': '/usr/bin/sass'})
+
+    def test_empty_results_are_not_saved(self):
+        compute = Counter(None)
+        ProbeCache(self.root).get('executable:sass', compute)
+        self.assertFalse(os.path.exists(self.cache_path))
+        ProbeCache(self.root).get('executable:sass', compute)
+        self.assertEqual(compute.calls, 2)
+
+    def test_invalid_results_are_probed_again(self):
+        ProbeCache(self.root).get('executable:sass', Counter('/old/sass'))
+        compute = Counter('/new/sass')
+        cache = ProbeCache(self.root)
+        self.assertEqual(
+            cache.get('executable:sass', compute,
+                      is_valid=lambda path: path != '/old/sass'),
+            '/new/sass')
+        self.assertEqual(compute.calls, 1)
+
+    def test_environment_change_drops_results(self):
+        ProbeCache(self.root).get('executable:sass', Counter('/usr/bin/sass'))
+        os.environ['PATH'] = '/opt/bin'
+        compute = Counter('/opt/bin/sass')
+        self.assertEqual(ProbeCache(self.root).get('executable:sass', compute),
+                         '/opt/bin/sass')
+        self.assertEqual(compute.calls, 1)
+
+    def test_gemfile_lock_is_part_of_the_environment(self):
+        gemfile = self.path('Gemfile')
+        self.write('Gemfile.lock')
+        with override_settings(CIVET_BUNDLE_GEMFILE=gemfile):
+            key = get_environment_key()
+            os.utime(gemfile + '.lock', (0, 0))
+            self.assertNotEqual(get_environment_key(), key)
+        self.assertNotEqual(get_environment_key(), key)
+
+    def test_missing_directory_is_not_created(self):
+        root = self.path('precompiled')
+        compute = Counter('/usr/bin/sass')
+        self.assertEqual(ProbeCache(root).get('executable:sass', compute),
+                         '/usr/bin/sass')
+        self.assertFalse(os.path.exists(root))
+
+
+class ProbeTest(FileSystemTestCase):
+    def setUp(self):
+        super(ProbeTest, self).setUp()
+        self.addCleanup(probe_cache._probe_caches.pop, self.root, None)
+
+    def test_cache_is_loaded_once(self):
+        compute = Counter('1.0')
+        probe(self.root, 'version:sass', compute)
+        # Only read when the process first probes
+        os.remove(self.path(PROBE_CACHE_FILENAME))
+        self.assertEqual(probe(self.root, 'version:sass', compute), '1.0')
+        self.assertEqual(compute.calls, 1)
+
+    def test_disabled(self):
+        self.patch(probe_cache, 'use_probe_cache', False)
+        compute = Counter('1.0')
+        probe(self.root, 'version:sass', compute)
+        probe(self.root, 'version:sass', compute)
+        self.assertEqual(compute.calls, 2)
+        self.assertFalse(
+            os.path.exists(self.path(PROBE_CACHE_FILENAME)))
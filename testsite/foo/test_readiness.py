@@ -0,0 +1,101 @@
+import os
+import sys
+import threading
+import time
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from django.utils import six
+
+from civet import finders
+from civet import readiness
+from civet.finders import FileSystemFinder
+from civet.readiness import ReadinessRegistry
+from foo.testcases import FileSystemTestCase
+
+
+class ReadinessRegistryTest(SimpleTestCase):
+    def setUp(self):
+        self.registry = ReadinessRegistry()
+
+    def test_begin_and_end(self):
+        self.registry.begin('/precompiled/js/a.js')
+        self.assertTrue(self.registry.is_pending('/precompiled/js/./a.js'))
+        self.assertFalse(self.registry.wait('/precompiled/js/a.js', 0.01))
+        self.registry.end('/precompiled/js/a.js')
+        self.assertFalse(self.registry.is_pending('/precompiled/js/a.js'))
+        self.assertTrue(self.registry.wait('/precompiled/js/a.js', 0.01))
+
+    def test_wait_until_done(self):
+        self.registry.begin('/precompiled/js/a.js')
+        timer = threading.Timer(
+            0.05, self.registry.end, ['/precompiled/js/a.js'])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertTrue(self.registry.wait('/precompiled/js/a.js', 5))
+
+    def test_end_owned_only_ends_marks_of_the_owner(self):
+        run = object()
+        self.registry.begin('/precompiled/js/a.js', owner=run)
+        self.registry.begin('/precompiled/js/b.js', owner=run)
+        # The watcher is recompiling b.js and c.js
+        self.registry.begin('/precompiled/js/b.js')
+        self.registry.begin('/precompiled/js/c.js')
+        self.registry.end_owned(run)
+        self.assertFalse(self.registry.is_pending('/precompiled/js/a.js'))
+        self.assertTrue(self.registry.is_pending('/precompiled/js/b.js'))
+        self.assertTrue(self.registry.is_pending('/precompiled/js/c.js'))
+
+    def test_end_ends_every_mark(self):
+        self.registry.begin('/precompiled/js/a.js', owner=object())
+        self.registry.begin('/precompiled/js/a.js')
+        self.registry.end('/precompiled/js/a.js')
+        self.assertFalse(self.registry.is_pending('/precompiled/js/a.js'))
+
+
+class FileSystemFinderTest(FileSystemTestCase):
+    def setUp(self):
+        super(FileSystemFinderTest, self).setUp()
+        self.precompiled_dir = self.path('precompiled')
+        self.static_dir = self.path('static')
+        os.makedirs(self.path('static/js'))
+        self.patch(finders, 'precompiled_assets_dir', self.precompiled_dir)
+        settings = override_settings(
+            STATICFILES_DIRS=[self.static_dir, self.precompiled_dir])
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.finder = FileSystemFinder()
+        self.output = self.path('precompiled/js/app.js')
+        self.addCleanup(readiness.registry.end, self.output)
+
+    def write_output(self):
+        self.write('precompiled/js/app.js', 'compiled')
+        readiness.registry.end(self.output)
+
+    def test_pending_output_is_found_once_compiled(self):
+        readiness.registry.begin(self.output)
+        timer = threading.Timer(0.05, self.write_output)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(self.finder.find('js/app.js'), self.output)
+
+    def test_timeout(self):
+        self.patch(readiness, 'ready_timeout', 0.01)
+        readiness.registry.begin(self.output)
+        stderr, sys.stderr = sys.stderr, six.StringIO()
+        try:
+            self.assertEqual(self.finder.find('js/app.js'), [])
+            self.assertIn('timed out waiting for', sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+
+    def test_other_directories_do_not_wait(self):
+        self.addCleanup(readiness.registry.end,
+                        os.path.join(self.static_dir, 'js', 'lib.js'))
+        readiness.registry.begin(os.path.join(self.static_dir, 'js', 'lib.js'))
+        with open(os.path.join(self.static_dir, 'js', 'lib.js'), 'w') as f:
+            f.write('lib')
+        start = time.time()
+        self.assertEqual(self.finder.find('js/lib.js'),
+                         os.path.join(self.static_dir, 'js', 'lib.js'))
+        self.assertLess(time.time() - start, 1)
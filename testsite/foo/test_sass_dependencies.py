@@ -0,0 +1,169 @@
+import os
+import sys
+
+from django.test import SimpleTestCase
+from django.utils import six
+from watchdog.events import FileDeletedEvent
+
+from civet.build_cache import BuildCache
+from civet.compilers.sass import SassCompiler
+from civet.compilers.sass import SassFSEventHandler
+from civet.compilers.sass_dependencies import SassDependencyGraph
+from civet.compilers.sass_dependencies import is_partial
+from civet.compilers.sass_dependencies import parse_imports
+from civet.stats import CompileStats
+from foo.fake_compilers import write_fake_compiler
+from foo.testcases import FileSystemTestCase
+
+
+class ParseImportsTest(SimpleTestCase):
+    def test_scss_rules(self):
+        source = '''
+            @import "base", 'mixins';
+            @use "sass:math";
+            @use "theme" as t;
+            @forward "src/list";
+        '''
+        self.assertEqual(parse_imports(source),
+                         ['base', 'mixins', 'theme', 'src/list'])
+
+    def test_plain_css_imports_are_left_out(self):
+        source = '''
+            @import "print.css";
+            @import url(foo.scss);
+            @import "http://fonts.example.com/font";
+            @import "real";
+        '''
+        self.assertEqual(parse_imports(source), ['real'])
+
+    def test_comments_are_ignored(self):
+        source = '''
+            // @import "line";
+            /* @import "block"; */
+            @import "kept"; // trailing http://example.com
+        '''
+        self.assertEqual(parse_imports(source), ['kept'])
+
+    def test_indented_syntax_allows_unquoted_imports(self):
+        source = '@import base, mixins\n.foo\n  color: red\n'
+        self.assertEqual(parse_imports(source, indented_syntax=True),
+                         ['base', 'mixins'])
+        self.assertEqual(parse_imports(source), [])
+
+    def test_is_partial(self):
+        self.assertTrue(is_partial('/static/sass/_base.scss'))
+        self.assertFalse(is_partial('/static/sass/main.scss'))
+
+
+class SassDependencyGraphTest(FileSystemTestCase):
+    def test_partials_resolve_to_their_entries(self):
+        colors = self.write('sass/_colors.scss', '$red: #f00;')
+        base = self.write('sass/_base.scss', '@import "colors";')
+        main = self.write('sass/main.scss', '@import "base";')
+        other = self.write('sass/other.scss', '@import "colors";')
+        graph = SassDependencyGraph()
+        for path in (colors, base, main, other):
+            graph.update(path)
+
+        self.assertEqual(graph.get_dependencies(main), set([base, colors]))
+        self.assertEqual(graph.get_affected_entries(colors), [main, other])
+        self.assertEqual(graph.get_affected_entries(base), [main])
+        self.assertEqual(graph.get_affected_entries(main), [main])
+
+    def test_index_files_and_load_paths(self):
+        index = self.write('lib/grid/_index.scss')
+        self.write('sass/main.scss', '@use "grid";')
+        main = self.path('sass/main.scss')
+        graph = SassDependencyGraph([self.path('lib')])
+        graph.update(main)
+        self.assertEqual(graph.get_dependencies(main), set([index]))
+
+    def test_new_partial_is_resolved(self):
+        main = self.write('sass/main.scss', '@import "later";')
+        graph = SassDependencyGraph()
+        graph.update(main)
+        self.assertEqual(graph.get_dependencies(main), set())
+
+        later = self.write('sass/_later.scss', '$x: 1;')
+        graph.add(later)
+        self.assertEqual(graph.get_dependencies(main), set([later]))
+        self.assertEqual(graph.get_affected_entries(later), [main])
+
+    def test_edges_follow_edits(self):
+        first = self.write('sass/_first.scss')
+        second = self.write('sass/_second.scss')
+        main = self.write('sass/main.scss', '@import "first";')
+        graph = SassDependencyGraph()
+        graph.update(main)
+        self.write('sass/main.scss', '@import "second";')
+        graph.update(main)
+        self.assertEqual(graph.get_affected_entries(first), [])
+        self.assertEqual(graph.get_affected_entries(second), [main])
+
+    def test_deleted_partial_still_affects_importers(self):
+        partial = self.write('sass/_gone.scss')
+        main = self.write('sass/main.scss', '@import "gone";')
+        graph = SassDependencyGraph()
+        graph.update(main)
+        os.remove(partial)
+        graph.update(partial)
+        self.assertEqual(graph.get_affected_entries(partial), [main])
+
+    def test_cycles(self):
+        a = self.write('sass/_a.scss', '@import "b";')
+        b = self.write('sass/_b.scss', '@import "a";')
+        main = self.write('sass/main.scss', '@import "a";')
+        graph = SassDependencyGraph()
+        graph.update_tree(main)
+        self.assertEqual(graph.get_dependencies(main), set([a, b]))
+        self.assertEqual(graph.get_affected_entries(b), [main])
+
+
+class SassFSEventHandlerTest(FileSystemTestCase):
+    def setUp(self):
+        super(SassFSEventHandlerTest, self).setUp()
+        self.src_dir = self.path('static/sass')
+        self.dst_dir = self.path('precompiled/sass')
+        self.partial = self.write('static/sass/_colors.scss', '$red: #f00;')
+        self.main = self.write('static/sass/main.scss', '@import "colors";')
+        self.dst = self.path('precompiled/sass/main.css')
+
+        compiler_class = type('FakeSassCompiler', (SassCompiler,), {
+            'executable': write_fake_compiler(self.root, 'sass')})
+        self.compiler = compiler_class(self.path('precompiled'), False)
+        self.compiler.build_cache = BuildCache(self.root)
+        self.compiler.stats = CompileStats()
+        self.compiler.set_sources([(self.main, self.dst)])
+        self.handler = SassFSEventHandler(
+            self.compiler, {self.src_dir: self.dst_dir})
+
+    def dispatch(self, event):
+        stdout, sys.stdout = sys.stdout, six.StringIO()
+        stderr, sys.stderr = sys.stderr, six.StringIO()
+        try:
+            self.handler.dispatch(event)
+            return sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def test_deleted_partial_fails_its_importers(self):
+        stdout, sys.stdout = sys.stdout, six.StringIO()
+        try:
+            self.compiler.compile(self.main, self.dst)
+        finally:
+            sys.stdout = stdout
+        self.assertTrue(os.path.exists(self.dst))
+
+        os.remove(self.partial)
+        errors = self.dispatch(FileDeletedEvent(self.partial))
+        # Reported like any other compile error, and not served stale
+        self.assertIn('Error compiling {0}'.format(self.main), errors)
+        self.assertIn('File to import not found: colors', errors)
+        self.assertFalse(os.path.exists(self.dst))
+        failure, = self.compiler.stats.get_failures()
+        self.assertEqual(failure.src_path, self.main)
+        self.assertIn('File to import not found', failure.messages)
+
+        # Compiled again once the partial is back
+        self.write('static/sass/_colors.scss', '$red: #e00;')
+        self.assertTrue(self.compiler.is_stale(self.main, self.dst))
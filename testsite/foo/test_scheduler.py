@@ -0,0 +1,144 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from civet.scheduler import CompileCancelled
+from civet.scheduler import CompileScheduler
+from civet.scheduler import get_cancellation
+from civet.scheduler import scheduler
+from civet.util import run_process
+
+
+# Runs a compile job, and exits like on Ctrl-C while the compiler is running
+INTERRUPTED_SCRIPT = '''
+import os, sys, threading, time
+from django.conf import settings
+settings.configure()
+from civet.scheduler import get_cancellation, scheduler
+from civet.util import run_process
+
+pid_path = sys.argv[1]
+
+def job():
+    with scheduler.running(['/out/slow.js']):
+        run_process(
+            [sys.executable, '-c',
+             'import os, time; open(%r, "w").write(str(os.getpid())); '
+             'time.sleep(30)' % pid_path],
+            cancellation=get_cancellation())
+
+thread = threading.Thread(target=job)
+thread.daemon = True
+thread.start()
+while not os.path.exists(pid_path) or not open(pid_path).read():
+    time.sleep(0.05)
+raise KeyboardInterrupt()
+'''
+
+
+class CompileSchedulerTest(SimpleTestCase):
+    def test_acquire_respects_limits(self):
+        compile_scheduler = CompileScheduler(limits={'sass': 1})
+        self.assertTrue(compile_scheduler.acquire('sass'))
+        self.assertFalse(compile_scheduler.acquire('sass'))
+        # Groups without a limit are never held back
+        self.assertTrue(compile_scheduler.acquire('coffee'))
+        self.assertTrue(compile_scheduler.acquire(None))
+        compile_scheduler.release('sass')
+        self.assertTrue(compile_scheduler.acquire('sass'))
+
+    def test_release_wakes_listeners(self):
+        class Listener(object):
+            woken = 0
+
+            def wake(self):
+                self.woken += 1
+
+        compile_scheduler = CompileScheduler(limits={'sass': 1})
+        listener = Listener()
+        compile_scheduler.add_listener(listener)
+        compile_scheduler.acquire('sass')
+        compile_scheduler.release('sass')
+        self.assertEqual(listener.woken, 1)
+
+    def test_request_promotes_on_listeners(self):
+        class Listener(object):
+            def __init__(self):
+                self.promoted = []
+
+            def promote(self, path):
+                self.promoted.append(path)
+
+        compile_scheduler = CompileScheduler(limits={})
+        listener = Listener()
+        compile_scheduler.add_listener(listener)
+        compile_scheduler.request('/out/js/../js/foo.js')
+        self.assertEqual(listener.promoted, ['/out/js/foo.js'])
+        compile_scheduler.remove_listener(listener)
+        compile_scheduler.request('/out/js/bar.js')
+        self.assertEqual(listener.promoted, ['/out/js/foo.js'])
+
+    def test_cancel_kills_running_process(self):
+        result = []
+        started = threading.Event()
+
+        def job():
+            with scheduler.running(['/out/slow.js']):
+                started.set()
+                try:
+                    run_process(
+                        [sys.executable, '-c', 'import time; time.sleep(30)'],
+                        cancellation=get_cancellation())
+                except CompileCancelled:
+                    result.append('cancelled')
+        thread = threading.Thread(target=job)
+        start = time.time()
+        thread.start()
+        started.wait(5)
+        # Other outputs are left alone
+        scheduler.cancel('/out/other.js')
+        time.sleep(0.2)
+        self.assertEqual(result, [])
+        scheduler.cancel('/out/slow.js')
+        thread.join(10)
+        self.assertEqual(result, ['cancelled'])
+        self.assertLess(time.time() - start, 10)
+
+    def test_cancelled_before_process_starts(self):
+        with scheduler.running(['/out/early.js']) as cancellation:
+            scheduler.cancel('/out/early.js')
+            self.assertRaises(
+                CompileCancelled, run_process,
+                [sys.executable, '-c', 'import time; time.sleep(30)'],
+                cancellation=cancellation)
+        self.assertIsNone(get_cancellation())
+
+    def test_running_processes_are_killed_on_exit(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        pid_path = os.path.join(root, 'pid')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        env.pop('DJANGO_SETTINGS_MODULE', None)
+        process = subprocess.Popen(
+            [sys.executable, '-c', INTERRUPTED_SCRIPT, pid_path], env=env,
+            stderr=subprocess.PIPE)
+        _, stderr = process.communicate()
+        self.assertIn(b'KeyboardInterrupt', stderr)
+        with open(pid_path) as f:
+            pid = int(f.read())
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                break
+            time.sleep(0.05)
+        else:
+            os.kill(pid, 9)
+            self.fail('The compiler process outlived Civet')
@@ -0,0 +1,132 @@
+import __main__
+import os
+import sys
+import threading
+
+from django.utils import six
+
+from civet import sidecar
+from civet.sidecar import RUN_MAIN_ENV
+from civet.sidecar import SIDECAR_PID_ENV
+from civet.sidecar import get_sidecar_command
+from civet.sidecar import is_autoreloader_parent
+from civet.sidecar import is_sidecar_running
+from civet.sidecar import start_sidecar
+from civet.sidecar import wait_while_parent_runs
+from foo.testcases import FileSystemTestCase
+
+
+class FakeSpec(object):
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+
+
+class SidecarTestCase(FileSystemTestCase):
+    def set_environ(self, name, value):
+        if name in os.environ:
+            self.addCleanup(os.environ.__setitem__, name, os.environ[name])
+        else:
+            self.addCleanup(os.environ.pop, name, None)
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+class EnvironmentTest(SidecarTestCase):
+    def test_is_autoreloader_parent(self):
+        self.set_environ(RUN_MAIN_ENV, None)
+        self.assertTrue(is_autoreloader_parent())
+        self.set_environ(RUN_MAIN_ENV, 'true')
+        self.assertFalse(is_autoreloader_parent())
+
+    def test_is_sidecar_running(self):
+        self.set_environ(SIDECAR_PID_ENV, None)
+        self.assertFalse(is_sidecar_running())
+        self.set_environ(SIDECAR_PID_ENV, '1234')
+        self.assertTrue(is_sidecar_running())
+
+
+class GetSidecarCommandTest(SidecarTestCase):
+    def setUp(self):
+        super(GetSidecarCommandTest, self).setUp()
+        self.patch(__main__, '__spec__', None)
+        self.patch(sys, 'warnoptions', [])
+        self.script = self.path('manage.py')
+        self.patch(sys, 'argv', [self.script, 'runserver'])
+
+    def test_script(self):
+        open(self.script, 'w').close()
+        self.assertEqual(
+            get_sidecar_command({'settings': 'foo.settings',
+                                 'pythonpath': None}),
+            [sys.executable, self.script, 'civet_precompile', '--watch',
+             '--settings=foo.settings'])
+
+    def test_warning_options(self):
+        open(self.script, 'w').close()
+        sys.warnoptions = ['error']
+        self.assertEqual(get_sidecar_command({})[:3],
+                         [sys.executable, '-Werror', self.script])
+
+    def test_module(self):
+        __main__.__spec__ = FakeSpec('django.__main__', 'django')
+        self.assertEqual(
+            get_sidecar_command({'pythonpath': '/src'}),
+            [sys.executable, '-m', 'django', 'civet_precompile', '--watch',
+             '--pythonpath=/src'])
+
+    def test_windows_entry_points(self):
+        sys.argv[0] = self.path('django-admin')
+        open(sys.argv[0] + '-script.py', 'w').close()
+        self.assertEqual(
+            get_sidecar_command({})[:2],
+            [sys.executable, sys.argv[0] + '-script.py'])
+        open(sys.argv[0] + '.exe', 'w').close()
+        self.assertEqual(
+            get_sidecar_command({}),
+            [sys.argv[0] + '.exe', 'civet_precompile', '--watch'])
+
+    def test_missing_script(self):
+        with self.assertRaises(RuntimeError):
+            get_sidecar_command({})
+
+
+class StartSidecarTest(SidecarTestCase):
+    def setUp(self):
+        super(StartSidecarTest, self).setUp()
+        self.set_environ(SIDECAR_PID_ENV, None)
+        self.kills = []
+        self.patch(sidecar, 'raise_error_or_kill', self.kills.append)
+        self.stderr, sys.stderr = sys.stderr, six.StringIO()
+        self.addCleanup(setattr, sys, 'stderr', self.stderr)
+
+    def start(self, returncode):
+        self.patch(sidecar, 'get_sidecar_command', lambda options: [
+            sys.executable, '-c',
+            'import sys; sys.exit({0})'.format(returncode)])
+        threads = set(threading.enumerate())
+        process = start_sidecar({})
+        self.assertEqual(os.environ[SIDECAR_PID_ENV], str(process.pid))
+        # The thread waiting for the sidecar to exit
+        for thread in set(threading.enumerate()) - threads:
+            thread.join(5)
+
+    def test_failure_stops_runserver(self):
+        self.start(3)
+        self.assertEqual(self.kills, [True])
+        self.assertIn('Asset compiler exited with code 3',
+                      sys.stderr.getvalue())
+
+    def test_success(self):
+        self.start(0)
+        self.assertEqual(self.kills, [])
+
+
+class WaitWhileParentRunsTest(SidecarTestCase):
+    def test_returns_when_orphaned(self):
+        parent_pids = iter([100, 100, 100, 1])
+        self.patch(os, 'getppid', lambda: next(parent_pids))
+        wait_while_parent_runs(interval=0)
+        self.assertEqual(list(parent_pids), [])
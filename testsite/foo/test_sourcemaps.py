@@ -0,0 +1,65 @@
+import json
+
+from civet import sourcemaps
+from civet.sourcemaps import SourcemapRewriteError
+from civet.sourcemaps import rewrite_head
+from civet.sourcemaps import rewrite_sourcemap
+from foo.testcases import FileSystemTestCase
+
+
+class RewriteSourcemapTest(FileSystemTestCase):
+    def setUp(self):
+        super(RewriteSourcemapTest, self).setUp()
+        self.map_path = self.path('foo.js.map')
+        self.src_path = self.path('src/foo.coffee')
+
+    def write_map(self, text):
+        self.write('foo.js.map', text)
+
+    def read_map(self):
+        with open(self.map_path) as f:
+            return json.load(f)
+
+    def test_rewrites_sources_in_head(self):
+        self.write_map(json.dumps({
+            'version': 3,
+            'file': 'foo.js',
+            'sourceRoot': '../../..',
+            'sources': ['myapp/static/js/foo.coffee'],
+            'names': [],
+            'mappings': 'AAAA',
+        }))
+        rewrite_sourcemap(self.map_path, self.src_path)
+        data = self.read_map()
+        self.assertEqual(data['sourceRoot'], '')
+        self.assertEqual(data['sources'], ['foo.coffee'])
+        self.assertEqual(data['mappings'], 'AAAA')
+        self.assertEqual(data['file'], 'foo.js')
+
+    def test_keys_after_head_are_parsed(self):
+        # Sources come after mappings that are larger than the head
+        mappings = 'AAAA;' * (sourcemaps.HEAD_SIZE // 4)
+        self.write_map(
+            '{"version":3,"mappings":"%s","sourceRoot":"..",'
+            '"sources":["a/foo.coffee"],"names":[]}' % mappings)
+        rewrite_sourcemap(self.map_path, self.src_path)
+        data = self.read_map()
+        self.assertEqual(data['sourceRoot'], '')
+        self.assertEqual(data['sources'], ['foo.coffee'])
+        self.assertEqual(data['mappings'], mappings)
+
+    def test_invalid_map_is_left_alone(self):
+        self.write_map('not json')
+        rewrite_sourcemap(self.map_path, self.src_path)
+        with open(self.map_path) as f:
+            self.assertEqual(f.read(), 'not json')
+
+    def test_rewrite_head(self):
+        head = b'{"version":3,"sourceRoot":"x","sources":["a","b"],"m'
+        self.assertEqual(
+            rewrite_head(head, b'["foo.coffee"]'),
+            b'{"version":3,"sourceRoot":"","sources":["foo.coffee"],"m')
+        self.assertRaises(SourcemapRewriteError, rewrite_head,
+                          b'{"version":3,"mappings":"AA', b'[]')
+        self.assertRaises(SourcemapRewriteError, rewrite_head,
+                          b'{"version":3,"sections":[', b'[]')
@@ -0,0 +1,132 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from django.test import SimpleTestCase
+
+from civet.signals import asset_compiled
+from civet.stats import CompileStats
+
+from foo.test_commands import PrecompileTestCase
+
+
+class FakeCompiler(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class CompileStatsTest(SimpleTestCase):
+    def setUp(self):
+        self.stats = CompileStats()
+        self.coffee = FakeCompiler('CoffeeScript')
+        self.sass = FakeCompiler('Sass')
+        self.stats.record(self.coffee, '/a.coffee', CompileStats.COMPILED,
+                          1.5, '/a.js', 0, 100, '')
+        self.stats.record(self.coffee, '/b.coffee', CompileStats.SKIPPED,
+                          dst_path='/b.js')
+        self.stats.record(self.sass, '/z.scss', CompileStats.FAILED, 0.25,
+                          '/z.css', 1, None, 'Error: broken')
+        self.stats.record(self.sass, '/m.scss', CompileStats.COMPILED, 6.0,
+                          '/m.css', 0, 2000, '')
+
+    def test_totals(self):
+        self.assertEqual(self.stats.total(CompileStats.COMPILED), 2)
+        self.assertEqual(self.stats.total(CompileStats.SKIPPED), 1)
+        self.assertEqual(self.stats.total(CompileStats.FAILED), 1)
+        self.assertEqual(self.stats.total(CompileStats.WOULD_COMPILE), 0)
+
+    def test_summary_lines(self):
+        self.assertEqual(self.stats.get_summary_lines(), [
+            'CoffeeScript: 1 compiled, 1 up to date, 0 failed '
+            '(1.50s compiling)',
+            'Sass: 1 compiled, 0 up to date, 1 failed (6.25s compiling)',
+        ])
+        self.assertEqual(
+            self.stats.get_summary_lines(dry_run=True)[0],
+            'CoffeeScript: 0 would compile, 1 up to date, 0 failed '
+            '(1.50s compiling)')
+
+    def test_skipped_files_have_no_record(self):
+        self.assertEqual(sorted(r.src_path for r in self.stats.records),
+                         ['/a.coffee', '/m.scss', '/z.scss'])
+
+    def test_failures(self):
+        failure, = self.stats.get_failures()
+        self.assertEqual(failure.src_path, '/z.scss')
+        self.assertEqual(failure.returncode, 1)
+        self.assertEqual(failure.messages, 'Error: broken')
+
+    def test_slowest(self):
+        self.assertEqual(
+            [r.src_path for r in self.stats.get_slowest(2)],
+            ['/m.scss', '/a.coffee'])
+
+    def test_reports(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.stats.write_report(os.path.join(root, 'report.json'))
+        with open(os.path.join(root, 'report.json')) as f:
+            records = json.load(f)
+        self.assertEqual([r['src_path'] for r in records],
+                         ['/m.scss', '/a.coffee', '/z.scss'])
+        self.assertEqual(records[0]['output_size'], 2000)
+
+        self.stats.write_report(os.path.join(root, 'report.csv'))
+        with open(os.path.join(root, 'report.csv')) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0][:4],
+                         ['compiler', 'src_path', 'dst_path', 'outcome'])
+        self.assertEqual(rows[1][:2], ['Sass', '/m.scss'])
+        self.assertEqual(len(rows), 4)
+
+    def test_concurrent_records(self):
+        stats = CompileStats()
+
+        def record():
+            for _ in range(200):
+                stats.record(self.coffee, '/a.coffee', CompileStats.COMPILED,
+                             0.01)
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats.total(CompileStats.COMPILED), 800)
+        self.assertEqual(len(stats.records), 800)
+
+
+class ProfileCommandTest(PrecompileTestCase):
+    def test_profile_and_report(self):
+        report_path = self.path('report.json')
+        output = self.call_command('--profile', '1', '--report', report_path)
+        self.assertIn('Slowest files:', output)
+        with open(report_path) as f:
+            records = json.load(f)
+        self.assertEqual(
+            sorted(os.path.basename(r['src_path']) for r in records),
+            ['app.coffee', 'main.scss'])
+        for record in records:
+            self.assertEqual(record['outcome'], CompileStats.COMPILED)
+            self.assertEqual(record['returncode'], 0)
+            self.assertEqual(record['output_size'],
+                             os.path.getsize(record['dst_path']))
+
+    def test_signal(self):
+        received = []
+
+        def receiver(sender, compiler, src_path, outcome, **kwargs):
+            received.append((os.path.basename(src_path), outcome,
+                             kwargs['returncode']))
+        asset_compiled.connect(receiver)
+        self.addCleanup(asset_compiled.disconnect, receiver)
+        self.write('static/coffee/bad.coffee', '@error')
+        with self.assertRaises(Exception):
+            self.call_command()
+        self.assertEqual(sorted(received), [
+            ('app.coffee', CompileStats.COMPILED, 0),
+            ('bad.coffee', CompileStats.FAILED, 1),
+            ('main.scss', CompileStats.COMPILED, 0),
+        ])
@@ -0,0 +1,80 @@
+import json
+import os
+
+from django.core.management import call_command
+from django.test.utils import override_settings
+
+from civet.manifest import AssetManifest
+from foo.testcases import FileSystemTestCase
+
+
+class ManifestStaticFilesStorageTest(FileSystemTestCase):
+    def setUp(self):
+        super(ManifestStaticFilesStorageTest, self).setUp()
+        self.precompiled_dir = self.path('precompiled')
+        self.static_root = self.path('collected')
+        dst_path = self.write('precompiled/js/foo.js', 'var foo = 1;\n')
+        self.manifest = AssetManifest(self.precompiled_dir)
+        self.manifest.add(dst_path)
+        self.manifest.save()
+        self.hashed_name = self.manifest.lookup('js/foo.js')
+
+    def collectstatic(self, storage):
+        with override_settings(
+                CIVET_PRECOMPILED_ASSET_DIR=self.precompiled_dir,
+                STATIC_ROOT=self.static_root,
+                STATICFILES_DIRS=[self.precompiled_dir],
+                STATICFILES_FINDERS=[
+                    'django.contrib.staticfiles.finders.FileSystemFinder'],
+                STATICFILES_STORAGE=storage):
+            call_command('collectstatic', interactive=False, verbosity=0)
+        names = []
+        for dirpath, _, filenames in os.walk(self.static_root):
+            for filename in filenames:
+                names.append(os.path.relpath(
+                    os.path.join(dirpath, filename),
+                    self.static_root).replace(os.sep, '/'))
+        with open(os.path.join(self.static_root, 'staticfiles.json')) as f:
+            return sorted(names), json.load(f)['paths']
+
+    def test_hashed_copies_are_not_hashed_again(self):
+        names, paths = self.collectstatic(
+            'civet.storage.ManifestStaticFilesStorage')
+        self.assertEqual(names, sorted(
+            ['js/foo.js', self.hashed_name, 'staticfiles.json']))
+        self.assertEqual(paths, {'js/foo.js': self.hashed_name})
+
+    def test_django_storage_hashes_them_again(self):
+        names, paths = self.collectstatic(
+            'django.contrib.staticfiles.storage.ManifestStaticFilesStorage')
+        # The hashed copy and Civet's manifest get hashed copies of their own
+        self.assertIn(self.hashed_name, paths)
+        self.assertIn(paths[self.hashed_name], names)
+        self.assertIn(paths['staticfiles.json'], names)
+
+    def test_compiled_files_are_not_hashed_again(self):
+        # As if Civet's copy were named differently than Django would
+        hashed_path = os.path.join(self.precompiled_dir, self.hashed_name)
+        os.rename(hashed_path, self.path('precompiled/js/foo.civet.js'))
+        self.manifest._paths['js/foo.js'] = 'js/foo.civet.js'
+        self.manifest._dirty = True
+        self.manifest.save()
+        names, paths = self.collectstatic(
+            'civet.storage.ManifestStaticFilesStorage')
+        self.assertEqual(names, sorted(
+            ['js/foo.js', 'js/foo.civet.js', 'staticfiles.json']))
+        self.assertEqual(paths, {'js/foo.js': 'js/foo.civet.js'})
+
+    def test_compiled_css_with_urls_is_processed(self):
+        self.write('precompiled/img/dot.png', 'png')
+        self.manifest.add(self.write(
+            'precompiled/css/app.css',
+            'a { background: url("../img/dot.png"); }'))
+        self.manifest.save()
+        civet_name = self.manifest.lookup('css/app.css')
+        names, paths = self.collectstatic(
+            'civet.storage.ManifestStaticFilesStorage')
+        # Rewritten to refer to the hashed image, so hashed again
+        self.assertNotEqual(paths['css/app.css'], civet_name)
+        self.assertIn(paths['css/app.css'], names)
+        self.assertEqual(paths['js/foo.js'], self.hashed_name)
@@ -0,0 +1,183 @@
+import os
+import stat
+import sys
+
+from django.test import SimpleTestCase
+from django.utils import six
+
+from civet.util import is_same_path
+from civet.util import JSONFile
+from civet.util import open_atomically
+from civet.util import PathTrie
+from civet.util import temporary_sibling_directory
+from civet.util import write_file_atomically
+from foo.testcases import FileSystemTestCase
+
+
+def p(*parts):
+    return os.path.join(os.sep, *parts)
+
+
+class PathTrieTest(SimpleTestCase):
+    def setUp(self):
+        self.trie = PathTrie()
+        self.trie[p('static')] = 'static'
+        self.trie[p('static', 'app', 'js')] = 'js'
+
+    def test_get_and_contains(self):
+        self.assertEqual(self.trie.get(p('static')), 'static')
+        self.assertEqual(self.trie.get(p('static', 'app', 'js')), 'js')
+        # Intermediate and unknown directories have no value
+        self.assertNotIn(p('static', 'app'), self.trie)
+        self.assertIsNone(self.trie.get(p('static', 'app')))
+        self.assertEqual(self.trie.get(p('other'), 'default'), 'default')
+        self.assertIn(p('static', 'app', 'js'), self.trie)
+        self.assertNotIn(p('static', 'app', 'js', 'lib'), self.trie)
+
+    def test_trailing_and_repeated_separators(self):
+        self.assertIn(p('static', 'app', 'js') + os.sep, self.trie)
+        self.assertEqual(self.trie.get(os.sep + os.sep + 'static'), 'static')
+
+    def test_keys(self):
+        self.assertEqual(sorted(self.trie.keys()),
+                         [p('static'), p('static', 'app', 'js')])
+
+    def test_iter_ancestors(self):
+        self.assertEqual(
+            list(self.trie.iter_ancestors(p('static', 'app', 'js', 'foo.js'))),
+            [(p('static'), 'static'), (p('static', 'app', 'js'), 'js')])
+        self.assertEqual(list(self.trie.iter_ancestors(p('other'))), [])
+
+    def test_find_nearest(self):
+        self.assertEqual(
+            self.trie.find_nearest(p('static', 'app', 'js', 'lib', 'a.js')),
+            (p('static', 'app', 'js'), 'js'))
+        self.assertEqual(self.trie.find_nearest(p('static', 'app', 'a.js')),
+                         (p('static'), 'static'))
+        self.assertEqual(self.trie.find_nearest(p('other', 'a.js')),
+                         (None, None))
+
+    def test_overwrite(self):
+        self.trie[p('static')] = 'new'
+        self.assertEqual(self.trie.get(p('static')), 'new')
+        self.assertEqual(len(list(self.trie.keys())), 2)
+
+
+class CounterFile(JSONFile):
+    description = 'counter'
+
+    def __init__(self, path):
+        super(CounterFile, self).__init__(path)
+        self.count = self.load() or 0
+        self.snapshots = 0
+
+    def get_data(self):
+        self.snapshots += 1
+        return self.count or None
+
+
+class JSONFileTest(FileSystemTestCase):
+    def setUp(self):
+        super(JSONFileTest, self).setUp()
+        self.file_path = self.path('state/counter.json')
+
+    def test_saved_and_loaded(self):
+        counter = CounterFile(self.file_path)
+        counter.count = 3
+        counter.save()
+        self.assertEqual(CounterFile(self.file_path).count, 3)
+
+    def test_nothing_to_save(self):
+        counter = CounterFile(self.file_path)
+        counter.save()
+        self.assertEqual(counter.snapshots, 1)
+        self.assertFalse(os.path.exists(self.file_path))
+
+    def test_directory_is_not_created_if_disabled(self):
+        counter = CounterFile(self.file_path)
+        counter.create_directory = False
+        counter.count = 3
+        counter.save()
+        self.assertFalse(os.path.exists(os.path.dirname(self.file_path)))
+
+    def test_unreadable_file_is_ignored(self):
+        self.write('state/counter.json', '{')
+        stderr, sys.stderr = sys.stderr, six.StringIO()
+        try:
+            counter = CounterFile(self.file_path)
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(counter.count, 0)
+        self.assertIn('ignoring unreadable counter', output)
+
+
+class WriteFileAtomicallyTest(FileSystemTestCase):
+    def setUp(self):
+        super(WriteFileAtomicallyTest, self).setUp()
+        self.file_path = self.path('js/app.js')
+
+    def test_write(self):
+        write_file_atomically(self.file_path, 'new')
+        write_file_atomically(self.file_path, b'newer', 'wb')
+        with open(self.file_path) as f:
+            self.assertEqual(f.read(), 'newer')
+        self.assertEqual(os.listdir(self.path('js')), ['app.js'])
+
+    def test_mode_is_that_of_new_files(self):
+        for umask, mode in [(0o022, 0o644), (0o077, 0o600)]:
+            old_umask = os.umask(umask)
+            try:
+                write_file_atomically(self.file_path, 'new')
+            finally:
+                os.umask(old_umask)
+            self.assertEqual(
+                stat.S_IMODE(os.stat(self.file_path).st_mode), mode)
+
+    def test_failed_write_leaves_the_file_alone(self):
+        write_file_atomically(self.file_path, 'old')
+        with self.assertRaises(ValueError):
+            with open_atomically(self.file_path) as f:
+                f.write('half')
+                raise ValueError()
+        with open(self.file_path) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(os.listdir(self.path('js')), ['app.js'])
+
+
+class TemporarySiblingDirectoryTest(FileSystemTestCase):
+    def setUp(self):
+        super(TemporarySiblingDirectoryTest, self).setUp()
+        self.precompiled_dir = self.path('precompiled')
+        os.makedirs(self.path('precompiled/js'))
+
+    def test_next_to_path(self):
+        path = self.path('precompiled/js')
+        with temporary_sibling_directory(path, self.precompiled_dir) as tmp:
+            self.assertEqual(os.path.dirname(tmp), self.precompiled_dir)
+            self.assertTrue(os.path.basename(tmp).startswith('.civet-tmp-'))
+            with open(os.path.join(tmp, 'app.js'), 'w') as f:
+                f.write('app')
+        self.assertFalse(os.path.exists(tmp))
+
+    def test_in_root_itself(self):
+        with temporary_sibling_directory(
+                self.precompiled_dir, self.precompiled_dir) as tmp:
+            self.assertEqual(os.path.dirname(tmp), self.precompiled_dir)
+        self.assertFalse(os.path.exists(tmp))
+        self.assertEqual(os.listdir(self.root), ['precompiled'])
+
+    def test_removed_on_error(self):
+        path = self.path('precompiled/js')
+        with self.assertRaises(ValueError):
+            with temporary_sibling_directory(path) as tmp:
+                raise ValueError()
+        self.assertFalse(os.path.exists(tmp))
+
+
+class IsSamePathTest(SimpleTestCase):
+    def test_is_same_path(self):
+        self.assertTrue(is_same_path(p('a', 'b'), p('a', 'b', '')))
+        self.assertTrue(is_same_path(p('a', 'b'), p('a', 'c', '..', 'b')))
+        self.assertTrue(is_same_path(os.getcwd(), '.'))
+        self.assertFalse(is_same_path(p('a', 'b'), p('a', 'bc')))
@@ -0,0 +1,39 @@
+import io
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+from django.utils import six
+
+
+class FileSystemTestCase(SimpleTestCase):
+    """Runs each test with a temporary directory, self.root, which is deleted
+    afterwards.
+    """
+
+    def setUp(self):
+        super(FileSystemTestCase, self).setUp()
+        # Resolved, like the paths of the sources Civet finds
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def path(self, name):
+        """Return the path of name, a /-separated path below self.root."""
+        return os.path.join(self.root, *name.split('/'))
+
+    def write(self, name, content=''):
+        """Write content to the file at path(name), creating its directory
+        if needed, and return its path.
+        """
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(six.text_type(content))
+        return path
+
+    def patch(self, obj, name, value):
+        """Set obj.name to value until the end of the test."""
+        self.addCleanup(setattr, obj, name, getattr(obj, name))
+        setattr(obj, name, value)